@@ -0,0 +1,113 @@
+"""
+Microbenchmarks of the SPOP codec.
+
+    python -m benchmarks.codec --output codec.json
+"""
+import argparse
+import io
+import ipaddress
+import json
+import platform
+import sys
+import timeit
+
+from haproxyspoa.payloads.ack import AckPayload
+from haproxyspoa.payloads.notify import NotifyPayload
+from haproxyspoa.spoa_data_types import ACCELERATED, SpopDataTypes, decode_typed_data, decode_varint, \
+    parse_typed_data, parse_varint, write_typed_autodetect, write_varint
+from haproxyspoa.spoa_payloads import StringTable, parse_list_of_messages
+
+from benchmarks.haproxy_client import encode_notify_payload
+
+
+# Encoded the way HAProxy sends them.  Negative integers are sent as their
+#  two's complement, reinterpreted as unsigned.
+TYPED_SAMPLES = {
+    "null": bytes([SpopDataTypes.NULL]),
+    "bool": bytes([SpopDataTypes.BOOL | 0x10]),
+    "int32": bytes([SpopDataTypes.INT32]) + write_varint(-1234 & 0xFFFFFFFF),
+    "uint32": bytes([SpopDataTypes.UINT32]) + write_varint(80),
+    "int64": bytes([SpopDataTypes.INT64]) + write_varint(123456789),
+    "uint64": bytes([SpopDataTypes.UINT64]) + write_varint(2 ** 40),
+    "ipv4": write_typed_autodetect(ipaddress.IPv4Address("192.168.1.23")),
+    "ipv6": write_typed_autodetect(ipaddress.IPv6Address("2001:db8::1")),
+    "string": write_typed_autodetect("www.example.com"),
+    "binary": write_typed_autodetect(b"\x00" * 64),
+}
+
+
+def build_cases() -> dict:
+    cases = {}
+
+    for value in (100, 2 ** 14, 2 ** 32):
+        encoded = write_varint(value)
+        cases[f"parse_varint[{len(encoded)}B]"] = lambda encoded=encoded: parse_varint(io.BytesIO(encoded))
+        cases[f"decode_varint[{len(encoded)}B]"] = lambda view=memoryview(encoded): decode_varint(view, 0)
+        cases[f"write_varint[{len(encoded)}B]"] = lambda value=value: write_varint(value)
+
+    for name, encoded in TYPED_SAMPLES.items():
+        cases[f"parse_typed_data[{name}]"] = lambda encoded=encoded: parse_typed_data(io.BytesIO(encoded))
+        cases[f"decode_typed_data[{name}]"] = lambda view=memoryview(encoded): decode_typed_data(view, 0)
+
+    notify = encode_notify_payload("earth-to-mars", {
+        "src": ipaddress.IPv4Address("10.1.2.3"),
+        "req_host": "www.example.com",
+        "path": "/api/v1/resource",
+        "length": 1024,
+    })
+    cases["parse_list_of_messages[4 args]"] = lambda: parse_list_of_messages(notify)
+    strings = StringTable(["earth-to-mars", "src", "req_host", "path", "length"])
+    cases["parse_list_of_messages[4 args, interned]"] = lambda: parse_list_of_messages(notify, strings)
+    cases["NotifyPayload[4 args]"] = lambda: NotifyPayload(notify)
+    cases["NotifyPayload[4 args, interned]"] = lambda: NotifyPayload(notify, strings=strings)
+
+    ack = AckPayload().set_txn_var("transmission_src", "10.1.2.3www.example.com").set_txn_var("score", 42)
+    cases["AckPayload.to_bytes[2 actions]"] = lambda: ack.to_bytes()
+    cases["AckPayload.encode[2 actions]"] = lambda: ack.encode()
+
+    template = AckPayload.template().set_txn_var("transmission_src").set_txn_var("score")
+    cases["AckTemplate.fill[2 actions]"] = lambda: template.fill("10.1.2.3www.example.com", 42).encode()
+
+    return cases
+
+
+def run(cases: dict, repeat: int) -> dict:
+    results = {}
+    for name, fn in cases.items():
+        timer = timeit.Timer(fn)
+        number, _ = timer.autorange()
+        best = min(timer.repeat(repeat=repeat, number=number)) / number
+        results[name] = {
+            "ns_per_op": round(best * 1e9, 1),
+            "ops_per_sec": round(1 / best),
+        }
+        print(f"{name:40s} {best * 1e9:10.1f} ns/op", file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="Timing repetitions, the best one is reported")
+    parser.add_argument("--filter", default="", help="Only run cases whose name contains this string")
+    parser.add_argument("--output", help="Write results as JSON to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    cases = {name: fn for name, fn in build_cases().items() if args.filter in name}
+    report = {
+        "benchmark": "codec",
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "accelerated": ACCELERATED,
+        "results": run(cases, args.repeat),
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
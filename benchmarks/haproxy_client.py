@@ -0,0 +1,67 @@
+import asyncio
+from typing import Optional
+
+from haproxyspoa.spoa_data_types import write_string, write_typed_autodetect, write_typed_uint32, write_varint
+from haproxyspoa.spoa_frame import Frame, FrameType
+from haproxyspoa.spoa_payloads import parse_kv_list, write_kv_list
+
+
+def encode_frame(frame_type: int, stream_id: int, frame_id: int, payload: bytes, flags: int = 1) -> bytes:
+    body = bytes([frame_type]) + flags.to_bytes(4, byteorder='big') \
+        + write_varint(stream_id) + write_varint(frame_id) + payload
+    return len(body).to_bytes(4, byteorder='big') + body
+
+
+def encode_notify_payload(message_name: str, args: dict) -> bytes:
+    return write_string(message_name) + bytes([len(args)]) + write_kv_list({
+        k: write_typed_autodetect(v) for k, v in args.items()
+    })
+
+
+class HaproxyStandIn:
+    """
+    Minimal client side of the SPOP protocol, playing the part of HAProxy against a
+    `SpoaServer`.  Only what the benchmarks need is implemented.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.agent_hello: Optional[dict] = None
+
+    @staticmethod
+    async def connect(host: str, port: int) -> 'HaproxyStandIn':
+        reader, writer = await asyncio.open_connection(host, port)
+        return HaproxyStandIn(reader, writer)
+
+    async def hello(self, capabilities: str = "pipelining,async", max_frame_size: int = 16380) -> dict:
+        self.writer.write(encode_frame(FrameType.HAPROXY_HELLO, 0, 0, write_kv_list({
+            "supported-versions": write_typed_autodetect("2.0"),
+            "max-frame-size": write_typed_uint32(max_frame_size),
+            "capabilities": write_typed_autodetect(capabilities),
+        })))
+        frame = await self.read_frame()
+        if frame.headers.type != FrameType.AGENT_HELLO:
+            raise RuntimeError(f"Expected AGENT-HELLO, received frame of type {frame.headers.type}")
+        self.agent_hello = parse_kv_list(frame.payload)
+        return self.agent_hello
+
+    def supports_pipelining(self) -> bool:
+        return "pipelining" in (self.agent_hello or {}).get("capabilities", "").split(",")
+
+    def send_notify(self, stream_id: int, frame_id: int, payload: bytes):
+        self.writer.write(encode_frame(FrameType.HAPROXY_NOTIFY, stream_id, frame_id, payload))
+
+    async def read_frame(self) -> Frame:
+        return await Frame.read_frame(self.reader)
+
+    async def disconnect(self):
+        self.writer.write(encode_frame(FrameType.HAPROXY_DISCONNECT, 0, 0, write_kv_list({
+            "status-code": write_typed_uint32(0),
+            "message": write_typed_autodetect("normal"),
+        })))
+        try:
+            await self.read_frame()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        self.writer.close()
@@ -0,0 +1,218 @@
+"""
+Load generator standing in for HAProxy.
+
+Opens `--connections` connections to an agent, performs the HELLO handshake and
+pushes NOTIFY frames, keeping up to `--window` frames in flight per connection
+when the agent supports pipelining.  Reports throughput and latency percentiles.
+
+By default a sample agent is started in a separate process; use `--connect` to
+target an agent that is already running.  With `--backend-latency`, the handler of
+the sample agent reads from an in-process `FakeBackend` through a `BackendPool`, to
+measure the latency of a handler calling a store without network access.
+
+    python -m benchmarks.load --connections 8 --messages 20000 --output load.json
+    python -m benchmarks.load --connect 127.0.0.1:9002 --duration 30
+"""
+import argparse
+import asyncio
+import ipaddress
+import json
+import multiprocessing
+import platform
+import sys
+import time
+from typing import List, Optional
+
+from haproxyspoa.payloads.ack import AckPayload
+from haproxyspoa.spoa_backends import FakeBackend
+from haproxyspoa.spoa_frame import FrameType
+from haproxyspoa.spoa_server import SpoaServer
+
+from benchmarks.haproxy_client import HaproxyStandIn, encode_notify_payload
+
+
+def run_sample_agent(port: int, pipelining: bool, transport: str, backend_latency: Optional[float] = None):
+    agent = SpoaServer(pipelining=pipelining, transport=transport)
+
+    if backend_latency is None:
+        @agent.handler("earth-to-mars")
+        async def handle_earth_to_mars(src: ipaddress.IPv4Address, req_host: str):
+            return AckPayload().set_txn_var("transmission_src", str(src) + req_host)
+    else:
+        backend = FakeBackend(latency=backend_latency, data={"www.example.com": "mars"})
+        store = agent.backend_pool(backend.connect, max_connections=4, pipelining=64)
+
+        @agent.handler("earth-to-mars")
+        async def handle_earth_to_mars(src: ipaddress.IPv4Address, req_host: str):
+            return AckPayload().set_txn_var("transmission_dst", await store.call(("GET", req_host)))
+
+    agent.run(host="127.0.0.1", port=port)
+
+
+async def wait_for_port(host: str, port: int, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.05)
+
+
+async def drive_connection(
+    host: str,
+    port: int,
+    payload: bytes,
+    messages: int,
+    deadline: float,
+    window: int,
+    latencies: List[float],
+) -> int:
+    client = await HaproxyStandIn.connect(host, port)
+    await client.hello()
+    if not client.supports_pipelining():
+        window = 1
+
+    sent_at = {}
+    slots = asyncio.Semaphore(window)
+
+    async def receive():
+        while True:
+            frame = await client.read_frame()
+            if frame.headers.type != FrameType.ACK:
+                raise RuntimeError(f"Unexpected frame of type {frame.headers.type}")
+            started = sent_at.pop(frame.headers.stream_id)
+            latencies.append(time.perf_counter() - started)
+            slots.release()
+
+    async def wait_until_acked():
+        for _ in range(window):
+            await slots.acquire()
+
+    receiver = asyncio.ensure_future(receive())
+    stream_id = 0
+    while stream_id < messages and time.monotonic() < deadline and not receiver.done():
+        await slots.acquire()
+        stream_id += 1
+        sent_at[stream_id] = time.perf_counter()
+        client.send_notify(stream_id, 1, payload)
+        if stream_id % 64 == 0:
+            await client.writer.drain()
+    await client.writer.drain()
+
+    # Every slot is free again once all in-flight frames have been acknowledged.
+    acked = asyncio.ensure_future(wait_until_acked())
+    await asyncio.wait({acked, receiver}, return_when=asyncio.FIRST_COMPLETED)
+    if receiver.done():
+        acked.cancel()
+        receiver.result()
+    receiver.cancel()
+    await asyncio.gather(receiver, return_exceptions=True)
+
+    await client.disconnect()
+    return stream_id
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run_load(args) -> dict:
+    host, port = args.connect.rsplit(":", 1)
+    port = int(port)
+    await wait_for_port(host, port)
+
+    payload = encode_notify_payload("earth-to-mars", {
+        "src": ipaddress.IPv4Address("10.1.2.3"),
+        "req_host": "www.example.com",
+    })
+    latencies: List[float] = []
+    deadline = time.monotonic() + args.duration if args.duration else float("inf")
+    messages = args.messages if args.messages else sys.maxsize
+
+    started = time.perf_counter()
+    sent = await asyncio.gather(*(
+        drive_connection(host, port, payload, messages, deadline, args.window, latencies)
+        for _ in range(args.connections)
+    ))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    total = sum(sent)
+    return {
+        "messages": total,
+        "elapsed_s": round(elapsed, 3),
+        "msgs_per_sec": round(total / elapsed, 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1e3, 3),
+            "p99": round(percentile(latencies, 0.99) * 1e3, 3),
+            "p999": round(percentile(latencies, 0.999) * 1e3, 3),
+            "max": round(latencies[-1] * 1e3, 3) if latencies else 0.0,
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connect", help="host:port of a running agent, instead of starting the sample agent")
+    parser.add_argument("--port", type=int, default=19002, help="Port for the sample agent")
+    parser.add_argument("--transport", default="stream", choices=("stream", "protocol"),
+                        help="Transport of the sample agent")
+    parser.add_argument("--no-pipelining", action="store_true", help="Disable pipelining on the sample agent")
+    parser.add_argument("--backend-latency", type=float,
+                        help="Seconds each call of the sample agent to its fake backend takes")
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--window", type=int, default=32, help="Maximum in-flight frames per connection")
+    parser.add_argument("--messages", type=int, default=10000, help="Messages per connection, 0 for unlimited")
+    parser.add_argument("--duration", type=float, default=0, help="Stop after this many seconds, 0 for unlimited")
+    parser.add_argument("--output", help="Write results as JSON to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    agent_process = None
+    if not args.connect:
+        args.connect = f"127.0.0.1:{args.port}"
+        agent_process = multiprocessing.Process(
+            target=run_sample_agent,
+            args=(args.port, not args.no_pipelining, args.transport, args.backend_latency),
+            daemon=True,
+        )
+        agent_process.start()
+
+    try:
+        results = asyncio.run(run_load(args))
+    finally:
+        if agent_process is not None:
+            agent_process.terminate()
+            agent_process.join()
+
+    report = {
+        "benchmark": "load",
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "config": {
+            "connect": args.connect,
+            "connections": args.connections,
+            "window": args.window,
+            "transport": args.transport if agent_process is not None else None,
+            "pipelining": not args.no_pipelining if agent_process is not None else None,
+            "backend_latency": args.backend_latency if agent_process is not None else None,
+        },
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
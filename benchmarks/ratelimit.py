@@ -0,0 +1,79 @@
+"""
+Benchmark of `RateLimiter` over many distinct keys.
+
+Checks `--keys` distinct IPv4 addresses once each, as a wave of new clients would,
+then checks random addresses among them, as returning clients would.  Reports the
+time per check, the size of the table and the peak memory of the process.
+
+    python -m benchmarks.ratelimit --keys 10000000 --output ratelimit.json
+"""
+import argparse
+import json
+import platform
+import random
+import resource
+import sys
+import time
+
+from haproxyspoa.spoa_ratelimit import RateLimitAlgorithm, RateLimiter
+
+
+def address(i: int) -> bytes:
+    # Packed, as handlers receive them with `ip_decoding="packed"`.
+    return (0x0A000000 + i).to_bytes(4, byteorder='big')
+
+
+def timed(limiter: RateLimiter, keys) -> dict:
+    check = limiter.check
+    count = 0
+    started = time.perf_counter()
+    for key in keys:
+        check(key)
+        count += 1
+    elapsed = time.perf_counter() - started
+    return {
+        "checks": count,
+        "ns_per_check": round(elapsed / count * 1e9, 1),
+        "checks_per_sec": round(count / elapsed),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=10_000_000, help="Distinct keys checked")
+    parser.add_argument("--capacity", type=int, help="Keys tracked at once, --keys by default")
+    parser.add_argument("--checks", type=int, default=1_000_000, help="Checks of returning keys")
+    parser.add_argument("--algorithm", default=RateLimitAlgorithm.SLIDING_WINDOW, choices=RateLimitAlgorithm.ALL)
+    parser.add_argument("--output", help="Write results as JSON to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    limiter = RateLimiter(limit=100, window=10, algorithm=args.algorithm, capacity=args.capacity or args.keys)
+    rng = random.Random(0x5EED)
+    results = {
+        "new_keys": timed(limiter, (address(i) for i in range(args.keys))),
+        "returning_keys": timed(limiter, (address(rng.randrange(args.keys)) for _ in range(args.checks))),
+    }
+    results["table_mb"] = round(limiter.size / 2 ** 20, 1)
+    results["evictions"] = limiter.evictions
+    # Kilobytes on Linux, bytes on macOS.
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results["max_rss_mb"] = round(max_rss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+    report = {
+        "benchmark": "ratelimit",
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "config": {"keys": args.keys, "capacity": limiter.capacity, "algorithm": args.algorithm},
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 from ipaddress import IPv4Address
 
+from haproxyspoa.logging import configure_logging
 from haproxyspoa.payloads.ack import AckPayload
 from haproxyspoa.spoa_server import SpoaServer
 
@@ -13,4 +14,5 @@ async def handle_earth_to_mars(src: IPv4Address, req_host: str):
 
 
 if __name__ == "__main__":
+    configure_logging()
     agent.run(host='127.0.0.1', port=9002)
@@ -0,0 +1,187 @@
+/*
+ * Optional C implementation of the varint codec of `haproxyspoa.spoa_data_types`.
+ *
+ * The functions mirror their pure-Python counterparts, which remain the reference
+ * implementation and are used whenever this module is not built.  The only
+ * difference is that values are limited to 64 bits, which is all SPOP ever sends.
+ */
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdint.h>
+
+#define SINGLE_BYTE_MAX 0xF0
+#define MIDDLE_BYTE_MASK 0x80
+/* A 64-bit value takes at most 10 bytes. */
+#define MAX_VARINT_LENGTH 10
+
+
+static int
+read_varint(const unsigned char *data, Py_ssize_t length, Py_ssize_t *offset, uint64_t *result)
+{
+    Py_ssize_t pos = *offset;
+    uint64_t value, next_byte;
+    unsigned int shift = 4;
+
+    if (pos < 0 || pos >= length) {
+        PyErr_SetString(PyExc_IndexError, "varint is truncated");
+        return -1;
+    }
+    value = data[pos++];
+
+    if (value >= SINGLE_BYTE_MAX) {
+        do {
+            if (pos >= length) {
+                PyErr_SetString(PyExc_IndexError, "varint is truncated");
+                return -1;
+            }
+            next_byte = data[pos++];
+            if (shift > 63 || ((next_byte << shift) >> shift) != next_byte
+                    || value + (next_byte << shift) < value) {
+                PyErr_SetString(PyExc_OverflowError, "varint does not fit in 64 bits");
+                return -1;
+            }
+            value += next_byte << shift;
+            shift += 7;
+        } while (next_byte >= MIDDLE_BYTE_MASK);
+    }
+
+    *offset = pos;
+    *result = value;
+    return 0;
+}
+
+
+enum varint_kind { VARINT, INT32, INT64, UINT32, UINT64 };
+
+
+static PyObject *
+decode(PyObject *const *args, Py_ssize_t nargs, enum varint_kind kind)
+{
+    Py_buffer view;
+    Py_ssize_t offset;
+    uint64_t value;
+    int status;
+
+    if (nargs != 2) {
+        PyErr_SetString(PyExc_TypeError, "expected (buffer, offset)");
+        return NULL;
+    }
+    offset = PyLong_AsSsize_t(args[1]);
+    if (offset == -1 && PyErr_Occurred()) {
+        return NULL;
+    }
+    if (PyObject_GetBuffer(args[0], &view, PyBUF_SIMPLE) < 0) {
+        return NULL;
+    }
+    status = read_varint((const unsigned char *)view.buf, view.len, &offset, &value);
+    PyBuffer_Release(&view);
+    if (status < 0) {
+        return NULL;
+    }
+
+    switch (kind) {
+    case INT32:
+        return Py_BuildValue("(in)", (int)(int32_t)(uint32_t)value, offset);
+    case INT64:
+        return Py_BuildValue("(Ln)", (long long)(int64_t)value, offset);
+    case UINT32:
+        return Py_BuildValue("(kn)", (unsigned long)(uint32_t)value, offset);
+    default:
+        return Py_BuildValue("(Kn)", (unsigned long long)value, offset);
+    }
+}
+
+
+static PyObject *
+decode_varint(PyObject *module, PyObject *const *args, Py_ssize_t nargs)
+{
+    return decode(args, nargs, VARINT);
+}
+
+
+static PyObject *
+decode_int32(PyObject *module, PyObject *const *args, Py_ssize_t nargs)
+{
+    return decode(args, nargs, INT32);
+}
+
+
+static PyObject *
+decode_int64(PyObject *module, PyObject *const *args, Py_ssize_t nargs)
+{
+    return decode(args, nargs, INT64);
+}
+
+
+static PyObject *
+decode_uint32(PyObject *module, PyObject *const *args, Py_ssize_t nargs)
+{
+    return decode(args, nargs, UINT32);
+}
+
+
+static PyObject *
+decode_uint64(PyObject *module, PyObject *const *args, Py_ssize_t nargs)
+{
+    return decode(args, nargs, UINT64);
+}
+
+
+static PyObject *
+write_varint(PyObject *module, PyObject *arg)
+{
+    unsigned char encoded[MAX_VARINT_LENGTH];
+    Py_ssize_t length = 0;
+    unsigned long long value = PyLong_AsUnsignedLongLong(arg);
+
+    if (value == (unsigned long long)-1 && PyErr_Occurred()) {
+        return NULL;
+    }
+
+    if (value < SINGLE_BYTE_MAX) {
+        encoded[length++] = (unsigned char)value;
+    }
+    else {
+        encoded[length++] = (unsigned char)((value | SINGLE_BYTE_MAX) & 0xFF);
+        value = (value - SINGLE_BYTE_MAX) >> 4;
+        while (value >= MIDDLE_BYTE_MASK) {
+            encoded[length++] = (unsigned char)((value | MIDDLE_BYTE_MASK) & 0xFF);
+            value = (value - MIDDLE_BYTE_MASK) >> 7;
+        }
+        encoded[length++] = (unsigned char)value;
+    }
+    return PyBytes_FromStringAndSize((const char *)encoded, length);
+}
+
+
+static PyMethodDef speedups_methods[] = {
+    {"decode_varint", (PyCFunction)(void (*)(void))decode_varint, METH_FASTCALL,
+     "decode_varint(buffer, offset) -> (value, offset)"},
+    {"decode_int32", (PyCFunction)(void (*)(void))decode_int32, METH_FASTCALL,
+     "decode_int32(buffer, offset) -> (value, offset)"},
+    {"decode_int64", (PyCFunction)(void (*)(void))decode_int64, METH_FASTCALL,
+     "decode_int64(buffer, offset) -> (value, offset)"},
+    {"decode_uint32", (PyCFunction)(void (*)(void))decode_uint32, METH_FASTCALL,
+     "decode_uint32(buffer, offset) -> (value, offset)"},
+    {"decode_uint64", (PyCFunction)(void (*)(void))decode_uint64, METH_FASTCALL,
+     "decode_uint64(buffer, offset) -> (value, offset)"},
+    {"write_varint", write_varint, METH_O,
+     "write_varint(value) -> bytes"},
+    {NULL, NULL, 0, NULL}
+};
+
+
+static struct PyModuleDef speedups_module = {
+    PyModuleDef_HEAD_INIT,
+    "haproxyspoa._speedups",
+    "C implementation of the SPOP varint codec.",
+    -1,
+    speedups_methods,
+};
+
+
+PyMODINIT_FUNC
+PyInit__speedups(void)
+{
+    return PyModule_Create(&speedups_module);
+}
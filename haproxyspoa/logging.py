@@ -1,15 +1,141 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import sys
+from typing import Optional, TextIO
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='[%(asctime)s] [%(levelname)s] %(message)s',
-    datefmt="%Y-%m-%dT%H:%M:%S%z"
-)
-
+# The library never configures logging on its own, see `configure_logging`.
 logger = logging.getLogger(__name__)
 
+# Attributes the agent attaches to its log records, through `FlowIdLoggerAdapter`.
+CONTEXT_FIELDS = ("flow_id", "stream_id", "frame_id")
+
+DEFAULT_MAX_QUEUE_SIZE = 10000
+
 
 class FlowIdLoggerAdapter(logging.LoggerAdapter):
+    """
+    Attaches the flow id of a connection, and the stream/frame ids of a frame when
+    given, to the records as attributes, which the formatters below render.
+    """
 
     def process(self, msg, kwargs):
-        return f"[{self.extra['flow_id']}] {msg}", kwargs
\ No newline at end of file
+        extra = kwargs.get("extra")
+        kwargs["extra"] = self.extra if extra is None else {**self.extra, **extra}
+        return msg, kwargs
+
+
+class TextFormatter(logging.Formatter):
+    """One line per record, the flow/stream/frame ids in brackets before the message."""
+
+    def __init__(self):
+        super().__init__(
+            fmt='[%(asctime)s] [%(levelname)s] %(context)s%(message)s',
+            datefmt="%Y-%m-%dT%H:%M:%S%z",
+        )
+
+    def format(self, record: logging.LogRecord) -> str:
+        context = ""
+        if hasattr(record, "flow_id"):
+            context = f"[{record.flow_id}] "
+        if hasattr(record, "stream_id"):
+            context += f"[{record.stream_id}:{getattr(record, 'frame_id', '-')}] "
+        record.context = context
+        return super().format(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the flow/stream/frame ids as separate fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S%z"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records over to a `QueueListener` thread, which formats and writes them, so
+    that neither formatting nor a slow output stream holds up the event loop.  Once the
+    queue is full, records are dropped and counted in `dropped`.
+    """
+
+    def __init__(self, max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE):
+        super().__init__(queue.Queue(max_queue_size))
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The listener runs in the same process, so the record is passed as is and
+        #  formatted there rather than on the caller's thread.
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listeners = []
+
+
+def configure_logging(
+    level: int = logging.INFO,
+    json_output: bool = False,
+    stream: Optional[TextIO] = None,
+    max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+    logger_name: Optional[str] = None,
+) -> logging.handlers.QueueListener:
+    """
+    Route the logs of `logger_name`, the root logger by default, through a
+    `NonBlockingQueueHandler` to `stream`, stderr by default.  Meant to be called once by
+    the application, before `SpoaServer.run`; worker processes forked afterwards start
+    their own listener thread.
+
+    :param json_output: Write `JsonFormatter` lines instead of `TextFormatter` ones.
+    :return: The listener, stopped by `stop_logging`, which runs at exit.
+    """
+    output = logging.StreamHandler(stream if stream is not None else sys.stderr)
+    output.setFormatter(JsonFormatter() if json_output else TextFormatter())
+    handler = NonBlockingQueueHandler(max_queue_size)
+
+    def start_listener() -> logging.handlers.QueueListener:
+        listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+        listener.start()
+        _listeners.append(listener)
+        return listener
+
+    def restart_in_child():
+        # Only the forking thread survives a fork, and the queue may have been left
+        #  locked by the listener thread: start over with fresh ones.
+        _listeners.clear()
+        handler.queue = queue.Queue(max_queue_size)
+        start_listener()
+
+    target = logging.getLogger(logger_name)
+    target.addHandler(handler)
+    target.setLevel(level)
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=restart_in_child)
+    return start_listener()
+
+
+def stop_logging():
+    """Write out the records still queued and stop the listeners of `configure_logging`."""
+    while _listeners:
+        _listeners.pop().stop()
+
+
+atexit.register(stop_logging)
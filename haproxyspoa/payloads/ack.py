@@ -1,3 +1,4 @@
+import functools
 import io
 from enum import IntEnum
 from typing import Any
@@ -14,6 +15,27 @@ class ActionVarScope(IntEnum):
     RESPONSE = 4
 
 
+# Handlers only ever set a handful of distinct variables, so everything in an action
+#  except its value is encoded once per (scope, name) and reused from then on.
+
+@functools.lru_cache(maxsize=4096)
+def encode_set_var_prefix(scope: ActionVarScope, name: str) -> bytes:
+    return bytes([
+        Action.SET_VAR,
+        3,  # Number of arguments
+        int(scope),
+    ]) + write_string(name)  # Possibly contrary to the docs, this is not a typed string.
+
+
+@functools.lru_cache(maxsize=4096)
+def encode_unset_var(scope: ActionVarScope, name: str) -> bytes:
+    return bytes([
+        Action.UNSET_VAR,
+        2,  # Number of arguments
+        int(scope),
+    ]) + write_typed_string(name)
+
+
 class ActionSetVar:
 
     def __init__(self, scope: ActionVarScope, name: str, value: Any):
@@ -21,14 +43,12 @@ class ActionSetVar:
         self.name = name
         self.value = value
 
+    def write_into(self, buffer: bytearray):
+        buffer += encode_set_var_prefix(self.scope, self.name)
+        buffer += write_typed_autodetect(self.value)
+
     def to_bytes(self) -> bytes:
-        buffer = io.BytesIO()
-        buffer.write(int.to_bytes(Action.SET_VAR, 1, byteorder='big', signed=False))
-        buffer.write(int.to_bytes(3, 1, byteorder='big', signed=False))  # Number of arguments
-        buffer.write(int.to_bytes(int(self.scope.value), 1, byteorder='big', signed=False))
-        buffer.write(write_string(self.name))  # Possibly contrary to the docs, this is not a typed string.
-        buffer.write(write_typed_autodetect(self.value))
-        return buffer.getvalue()
+        return encode_set_var_prefix(self.scope, self.name) + write_typed_autodetect(self.value)
 
 
 class ActionUnsetVar:
@@ -37,13 +57,24 @@ class ActionUnsetVar:
         self.scope = scope
         self.name = name
 
+    def write_into(self, buffer: bytearray):
+        buffer += encode_unset_var(self.scope, self.name)
+
     def to_bytes(self) -> bytes:
-        buffer = io.BytesIO()
-        buffer.write(int.to_bytes(Action.UNSET_VAR, 1, byteorder='big', signed=False))
-        buffer.write(int.to_bytes(2, 1, byteorder='big', signed=False))  # Number of arguments
-        buffer.write(int.to_bytes(int(self.scope.value), 1, byteorder='big', signed=False))
-        buffer.write(write_typed_string(self.name))
-        return buffer.getvalue()
+        return encode_unset_var(self.scope, self.name)
+
+
+class EncodedActions:
+    """A list of actions that has already been serialized, see `AckPayload.freeze`."""
+
+    def __init__(self, encoded: bytes):
+        self.encoded = encoded
+
+    def write_into(self, buffer: bytearray):
+        buffer += self.encoded
+
+    def to_bytes(self) -> bytes:
+        return self.encoded
 
 
 class AckPayload:
@@ -69,10 +100,56 @@ class AckPayload:
             actions.extend(ack.actions)
         return AckPayload(actions=actions)
 
-    def to_bytes(self) -> io.BytesIO:
-        buffer = io.BytesIO()
+    @staticmethod
+    def template() -> 'AckTemplate':
+        return AckTemplate()
+
+    def freeze(self) -> 'AckPayload':
+        """
+        Serialize the actions once, returning an equivalent payload that can be
+        reused (e.g. from a cache) without being encoded again.
+        """
+        return AckPayload(actions=[EncodedActions(bytes(self.encode()))])
+
+    def encode(self) -> bytearray:
+        """Serialize every action into a single buffer."""
+        buffer = bytearray()
         for action in self.actions:
-            buffer.write(action.to_bytes())
+            action.write_into(buffer)
         return buffer
 
+    def to_bytes(self) -> io.BytesIO:
+        return io.BytesIO(self.encode())
+
+
+class AckTemplate:
+    """
+    A fixed list of variables to set, of which only the values change between
+    ACKs.  The constant part of every action is encoded when the template is
+    declared, so filling it in only encodes the values:
+
+        verdict = AckPayload.template().set_txn_var("blocked").set_txn_var("score")
+
+        @agent.handler("check-ip")
+        async def check_ip(src):
+            return verdict.fill(False, 12)
+    """
+
+    def __init__(self):
+        self.prefixes = []
+
+    def set_var(self, scope: ActionVarScope, name: str):
+        self.prefixes.append(encode_set_var_prefix(scope, name))
+        return self
 
+    def set_txn_var(self, name: str):
+        return self.set_var(ActionVarScope.TRANSACTION, name)
+
+    def fill(self, *values: Any) -> AckPayload:
+        if len(values) != len(self.prefixes):
+            raise ValueError(f"Template sets {len(self.prefixes)} variables, but {len(values)} values were given")
+        buffer = bytearray()
+        for prefix, value in zip(self.prefixes, values):
+            buffer += prefix
+            buffer += write_typed_autodetect(value)
+        return AckPayload(actions=[EncodedActions(bytes(buffer))])
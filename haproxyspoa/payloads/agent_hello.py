@@ -24,6 +24,7 @@ class AgentCapabilities:
 
 
 class AgentHelloPayload:
+    MINIMUM_MAX_FRAME_SIZE = 256
     GENEROUS_MAX_FRAME_SIZE = 65536
     DEFAULT_MAX_FRAME_SIZE = 16380
 
@@ -1,11 +1,9 @@
-import io
-
-from haproxyspoa.spoa_payloads import parse_kv_list
+from haproxyspoa.spoa_payloads import PayloadBuffer, parse_kv_list
 
 
 class HaproxyDisconnectPayload:
 
-    def __init__(self, payload: io.BytesIO):
+    def __init__(self, payload: PayloadBuffer):
         self.kv_list = parse_kv_list(payload)
 
     def status_code(self) -> int:
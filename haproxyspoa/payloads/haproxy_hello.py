@@ -1,18 +1,16 @@
-import io
-
-from haproxyspoa.spoa_payloads import parse_kv_list
+from haproxyspoa.spoa_payloads import PayloadBuffer, parse_kv_list
 
 
 class HaproxyHelloPayload:
 
-    def __init__(self, payload: io.BytesIO):
+    def __init__(self, payload: PayloadBuffer):
         self.attrs = parse_kv_list(payload)
 
     def supported_versions(self):
         return self.attrs["supported-versions"].replace(" ", "").split(",")
 
     def max_frame_size(self):
-        return self.attrs["max-frame-size"]
+        return self.attrs.get("max-frame-size")
 
     def capabilities(self):
         return self.attrs["capabilities"].replace(" ", "").split(",")
@@ -1,10 +1,20 @@
-import io
+from typing import Container, Optional
 
-from haproxyspoa.spoa_payloads import parse_list_of_messages
+from haproxyspoa.spoa_payloads import PayloadBuffer, StringTable, index_list_of_messages, payload_view
 
 
 class NotifyPayload:
 
-    def __init__(self, payload: io.BytesIO):
-        self.messages = parse_list_of_messages(payload)
-
+    def __init__(
+        self,
+        payload: PayloadBuffer,
+        wanted: Optional[Container[str]] = None,
+        strings: Optional[StringTable] = None,
+    ):
+        """
+        :param wanted: Names of the messages of interest, the other messages are skipped.
+            The arguments of the messages are `MessageArguments`, decoded as they are used.
+        :param strings: Table interning the message names and argument keys.
+        """
+        view, offset = payload_view(payload)
+        self.messages = index_list_of_messages(view, offset, wanted, strings)
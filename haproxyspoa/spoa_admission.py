@@ -0,0 +1,65 @@
+from typing import Optional
+
+from haproxyspoa.payloads.ack import AckPayload
+
+
+class AdmissionController:
+    """
+    Decides whether a NOTIFY frame is processed or shed under overload.
+
+    A frame is shed when the server already processes `max_inflight` frames in
+    total, when its connection already processes `max_connection_inflight` frames,
+    or when it waited longer than `max_queue_delay` seconds between being read and
+    its processing starting, be it waiting for an in-flight slot or for the event
+    loop itself to get to it.  Shed frames are acknowledged right away with
+    `shed_ack`, so HAProxy can apply its own fail-open or fail-closed policy
+    instead of waiting on work that piles up without bound.
+
+    One controller is shared by every connection of a server.
+    """
+
+    def __init__(
+        self,
+        max_inflight: Optional[int] = None,
+        max_connection_inflight: Optional[int] = None,
+        max_queue_delay: Optional[float] = None,
+        shed_ack: Optional[AckPayload] = None,
+    ):
+        for name, value in (("max_inflight", max_inflight),
+                            ("max_connection_inflight", max_connection_inflight)):
+            if value is not None and value < 1:
+                raise ValueError(f"{name} must be at least 1")
+        if max_queue_delay is not None and max_queue_delay < 0:
+            raise ValueError("max_queue_delay must not be negative")
+
+        self.max_inflight = max_inflight
+        self.max_connection_inflight = max_connection_inflight
+        self.max_queue_delay = max_queue_delay
+        if shed_ack is None:
+            shed_ack = AckPayload().set_txn_var("shed", 1)
+        self.shed_ack = shed_ack
+        # Every shed frame gets the same ACK, so it is encoded only once.
+        self.shed_payload = bytes(shed_ack.encode())
+
+        self.inflight = 0
+
+    def try_admit(self, connection_inflight: int) -> bool:
+        """
+        Check the in-flight limits for a frame that was just read.  An admitted frame
+        counts towards the global limit until `release` is called for it.
+
+        :param connection_inflight: Frames already admitted on the frame's connection.
+        """
+        if (self.max_inflight is not None and self.inflight >= self.max_inflight) \
+                or (self.max_connection_inflight is not None
+                    and connection_inflight >= self.max_connection_inflight):
+            return False
+        self.inflight += 1
+        return True
+
+    def release(self):
+        self.inflight -= 1
+
+    def should_shed_on_start(self, queue_delay: float) -> bool:
+        """Check how long an admitted frame waited before its processing could start."""
+        return self.max_queue_delay is not None and queue_delay > self.max_queue_delay
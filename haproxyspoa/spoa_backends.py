@@ -0,0 +1,301 @@
+import abc
+import asyncio
+import collections
+import time
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from haproxyspoa.logging import logger
+
+
+class BackendConnection(abc.ABC):
+    """
+    A connection to an external store, as managed by `BackendPool`.  `call` may be
+    awaited several times concurrently when the pool pipelines requests.  A connection
+    that is no longer usable sets `closed`, and the pool replaces it.
+    """
+
+    closed = False
+
+    @abc.abstractmethod
+    async def call(self, request: Any) -> Any:
+        """Send `request` and return the response."""
+
+    async def close(self):
+        self.closed = True
+
+
+class PipelinedStreamConnection(BackendConnection):
+    """
+    A TCP connection to a backend answering requests in order, such as Redis or
+    memcached.  Requests are written as soon as they are made, and a reader task
+    resolves them with the responses as they come back.
+
+    :param encode_request: Serializes a request.
+    :param read_response: Reads the next response from the stream.
+    """
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        encode_request: Callable[[Any], bytes],
+        read_response: Callable[[asyncio.StreamReader], Awaitable[Any]],
+    ):
+        self.reader = reader
+        self.writer = writer
+        self.encode_request = encode_request
+        self.read_response = read_response
+        self.waiters: Deque[asyncio.Future] = collections.deque()
+        self.receiver = asyncio.ensure_future(self._receive())
+
+    @staticmethod
+    def connector(
+        host: str,
+        port: int,
+        encode_request: Callable[[Any], bytes],
+        read_response: Callable[[asyncio.StreamReader], Awaitable[Any]],
+    ) -> Callable[[], Awaitable['PipelinedStreamConnection']]:
+        """The `connect` function of a `BackendPool` opening these connections."""
+        async def connect():
+            reader, writer = await asyncio.open_connection(host, port)
+            return PipelinedStreamConnection(reader, writer, encode_request, read_response)
+        return connect
+
+    async def call(self, request: Any) -> Any:
+        if self.closed:
+            raise ConnectionError("Backend connection is closed")
+        response = asyncio.get_event_loop().create_future()
+        self.waiters.append(response)
+        self.writer.write(self.encode_request(request))
+        await self.writer.drain()
+        # If the call is cancelled, e.g. on timeout, its response is still read and
+        #  discarded, which keeps the following responses matched with their requests.
+        return await response
+
+    async def _receive(self):
+        try:
+            while True:
+                response = await self.read_response(self.reader)
+                waiter = self.waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(response)
+        except asyncio.CancelledError:
+            error = ConnectionError("Backend connection is closed")
+        except Exception as e:
+            error = e
+        self.closed = True
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(error)
+
+    async def close(self):
+        self.closed = True
+        self.receiver.cancel()
+        await asyncio.gather(self.receiver, return_exceptions=True)
+        self.writer.close()
+
+
+class _PooledConnection:
+    __slots__ = ("connection", "inflight", "idle_since")
+
+    def __init__(self, connection: BackendConnection):
+        self.connection = connection
+        self.inflight = 0
+        self.idle_since = time.monotonic()
+
+
+class BackendPool:
+    """
+    Keeps connections to an external store open for the handlers, with
+    `SpoaServer.backend_pool`.  A call goes to the least busy connection; a new one is
+    opened when every connection already has `pipelining` calls in flight, up to
+    `max_connections`, after which calls wait for a connection to free up.
+
+    :param connect: Coroutine function opening a `BackendConnection`.
+    :param max_connections: Upper bound on the open connections.
+    :param pipelining: Calls in flight on a single connection, 1 for protocols that only
+        take one request at a time.
+    :param keepalive: Seconds an idle connection is kept open.
+    :param timeout: Seconds after which a call raises `asyncio.TimeoutError`, which the
+        connection treats as a missed deadline.
+    :param min_connections: Connections opened by `start`, and kept open while idle.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Awaitable[BackendConnection]],
+        max_connections: int = 10,
+        pipelining: int = 1,
+        keepalive: float = 60.0,
+        timeout: Optional[float] = None,
+        min_connections: int = 0,
+    ):
+        if max_connections < 1:
+            raise ValueError("max_connections must be at least 1")
+        if pipelining < 1:
+            raise ValueError("pipelining must be at least 1")
+        if not 0 <= min_connections <= max_connections:
+            raise ValueError("min_connections must be between 0 and max_connections")
+        if timeout is not None and timeout <= 0:
+            raise ValueError("timeout must be positive")
+
+        self.connect = connect
+        self.max_connections = max_connections
+        self.pipelining = pipelining
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.min_connections = min_connections
+        self.connections: List[_PooledConnection] = []
+        # Connections being opened count towards `max_connections`.
+        self.opening = 0
+        self.closed = False
+        # Created on first use, so that it binds to the running event loop.
+        self._available: Optional[asyncio.Condition] = None
+        self._reaper: Optional[asyncio.Task] = None
+
+    @property
+    def available(self) -> asyncio.Condition:
+        if self._available is None:
+            self._available = asyncio.Condition()
+        return self._available
+
+    async def start(self):
+        """Open the `min_connections` and start closing idle connections."""
+        self.closed = False
+        missing = max(0, self.min_connections - len(self.connections) - self.opening)
+        self.opening += missing
+        await asyncio.gather(*(self._open() for _ in range(missing)))
+        if self._reaper is None and self.keepalive is not None:
+            self._reaper = asyncio.ensure_future(self._close_idle_connections())
+
+    async def close(self):
+        """Close every connection.  Calls still in flight fail."""
+        self.closed = True
+        if self._reaper is not None:
+            self._reaper.cancel()
+            await asyncio.gather(self._reaper, return_exceptions=True)
+            self._reaper = None
+        async with self.available:
+            self.available.notify_all()
+        connections, self.connections = self.connections, []
+        await asyncio.gather(*(pooled.connection.close() for pooled in connections), return_exceptions=True)
+
+    async def call(self, request: Any) -> Any:
+        if self.timeout is None:
+            return await self._call(request)
+        return await asyncio.wait_for(self._call(request), self.timeout)
+
+    async def _call(self, request: Any) -> Any:
+        pooled = await self._acquire()
+        try:
+            return await pooled.connection.call(request)
+        finally:
+            await self._release(pooled)
+
+    async def _acquire(self) -> _PooledConnection:
+        async with self.available:
+            while True:
+                if self.closed:
+                    raise ConnectionError("Backend pool is closed")
+                self.connections = [pooled for pooled in self.connections if not pooled.connection.closed]
+                pooled = min(self.connections, key=lambda p: p.inflight, default=None)
+                if pooled is not None and pooled.inflight < self.pipelining:
+                    pooled.inflight += 1
+                    return pooled
+                if len(self.connections) + self.opening < self.max_connections:
+                    self.opening += 1
+                    break
+                await self.available.wait()
+        return await self._open(inflight=1)
+
+    async def _open(self, inflight: int = 0) -> _PooledConnection:
+        """Open a connection, whose slot was reserved in `opening` by the caller."""
+        try:
+            pooled = _PooledConnection(await self.connect())
+            pooled.inflight = inflight
+            self.connections.append(pooled)
+            return pooled
+        finally:
+            self.opening -= 1
+            async with self.available:
+                self.available.notify_all()
+
+    async def _release(self, pooled: _PooledConnection):
+        pooled.inflight -= 1
+        if pooled.inflight == 0:
+            pooled.idle_since = time.monotonic()
+        async with self.available:
+            self.available.notify()
+
+    async def _close_idle_connections(self):
+        while True:
+            await asyncio.sleep(self.keepalive / 2)
+            cutoff = time.monotonic() - self.keepalive
+            idle = [
+                pooled for pooled in self.connections
+                if pooled.inflight == 0 and pooled.idle_since < cutoff
+            ][:max(0, len(self.connections) - self.min_connections)]
+            for pooled in idle:
+                self.connections.remove(pooled)
+            if idle:
+                logger.debug("Closing %d idle backend connections", len(idle))
+                await asyncio.gather(*(pooled.connection.close() for pooled in idle), return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "connections": len(self.connections),
+            "inflight": sum(pooled.inflight for pooled in self.connections),
+        }
+
+
+class FakeBackend:
+    """
+    In-process stand-in for a key/value store, for tests and benchmarks.  Each call
+    takes `latency` seconds, and requests are tuples of a command and its arguments:
+    `("GET", key)`, `("SET", key, value)`, `("INCR", key, amount)`, `("DEL", key)`
+    and `("MGET", keys)`.
+
+        backend = FakeBackend(latency=0.0005)
+        pool = agent.backend_pool(backend.connect, pipelining=32)
+    """
+
+    def __init__(self, latency: float = 0.0, data: Optional[Dict[Any, Any]] = None):
+        self.latency = latency
+        self.data = dict(data) if data else {}
+        self.calls = 0
+        self.connections_opened = 0
+
+    async def connect(self) -> 'FakeBackendConnection':
+        self.connections_opened += 1
+        return FakeBackendConnection(self)
+
+    def execute(self, request: tuple) -> Any:
+        command, *args = request
+        if command == "GET":
+            return self.data.get(args[0])
+        if command == "SET":
+            self.data[args[0]] = args[1]
+            return True
+        if command == "INCR":
+            self.data[args[0]] = self.data.get(args[0], 0) + (args[1] if len(args) > 1 else 1)
+            return self.data[args[0]]
+        if command == "DEL":
+            return self.data.pop(args[0], None) is not None
+        if command == "MGET":
+            return [self.data.get(key) for key in args[0]]
+        raise ValueError(f"Unknown command `{command}`")
+
+
+class FakeBackendConnection(BackendConnection):
+
+    def __init__(self, backend: FakeBackend):
+        self.backend = backend
+
+    async def call(self, request: tuple) -> Any:
+        if self.closed:
+            raise ConnectionError("Backend connection is closed")
+        self.backend.calls += 1
+        if self.backend.latency:
+            await asyncio.sleep(self.backend.latency)
+        return self.backend.execute(request)
@@ -0,0 +1,110 @@
+import asyncio
+import collections
+import time
+from typing import Any, Awaitable, Callable, Hashable, Tuple
+
+
+_MISSING = object()
+
+
+def make_cache_key(arguments: dict, namespace: Hashable = None) -> Tuple:
+    """
+    Build a hashable key from the parsed arguments of a message.  Binary values are
+    copied, since they are views into a frame buffer that must not be kept alive by
+    the cache, and repeated arguments become tuples.
+
+    :param namespace: Keeps apart the keys of the handlers sharing a cache, which may
+        receive the same arguments.
+    """
+    key = tuple(sorted((key, _freeze(value)) for key, value in arguments.items()))
+    return key if namespace is None else (namespace, key)
+
+
+def _freeze(value):
+    if isinstance(value, memoryview):
+        return value.tobytes()
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class TTLCache:
+    """
+    Bounded cache of handler results.  Entries expire `ttl` seconds after being
+    stored, and the least recently used entry is evicted once `maxsize` is reached.
+
+    `get_or_compute` coalesces concurrent misses: while a value is being computed
+    for a key, other callers asking for the same key wait for that computation
+    instead of starting their own.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, clock: Callable[[], float] = time.monotonic):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        if ttl <= 0:
+            raise ValueError("ttl must be positive")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = collections.OrderedDict()
+        self._inflight = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > self.clock():
+                self._entries.move_to_end(key)
+                return value
+            del self._entries[key]
+        return default
+
+    def put(self, key: Hashable, value: Any):
+        self._entries[key] = (self.clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    async def get_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            # The computation runs as its own task, so that one caller being
+            #  cancelled does not cancel it for every other waiter.
+            task = asyncio.ensure_future(compute())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_computed(key, t))
+        return await asyncio.shield(task)
+
+    def _on_computed(self, key: Hashable, task: asyncio.Future):
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self.put(key, task.result())
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+        }
@@ -1,6 +1,7 @@
-import ctypes
 import ipaddress
 import io
+import socket
+from typing import Any, Tuple, Union
 
 
 class SpopDataTypes:
@@ -16,18 +17,281 @@ class SpopDataTypes:
     BINARY = 9
 
 
+class IPDecoding:
+    # `ipaddress.IPv4Address` / `ipaddress.IPv6Address`, rich but slow to build and hash.
+    IPADDRESS = "ipaddress"
+    # The packed address as bytes, 4 or 16 long.
+    PACKED = "packed"
+    # The address as an integer, as `int(ipaddress.ip_address(...))`.
+    INT = "int"
+    # A `PackedAddress`, hashable like bytes and convertible to `ipaddress` objects.
+    COMPACT = "compact"
+
+    ALL = (IPADDRESS, PACKED, INT, COMPACT)
+
+
+class StringDecoding:
+    # Strict ASCII, which raises on the bytes some clients send in headers.
+    ASCII = "ascii"
+    # Maps every byte to a character, so it never fails, and is the fastest.
+    LATIN_1 = "latin-1"
+    # Bytes that are not valid UTF-8 are kept as lone surrogates, as with `os.fsdecode`,
+    #  and restored by `value.encode("utf-8", "surrogateescape")`.
+    UTF_8 = "utf-8"
+    # Not decoded: the string as bytes.
+    BYTES = "bytes"
+
+    ALL = (ASCII, LATIN_1, UTF_8, BYTES)
+
+
+class PackedAddress:
+    """
+    Compact IPv4 or IPv6 address, holding nothing but its packed bytes.  It is as cheap
+    to build, hash and compare as those bytes, which makes it a good lookup key, and is
+    only turned into an `ipaddress` object when asked to.
+    """
+
+    __slots__ = ("packed",)
+
+    def __init__(self, packed: Union[bytes, bytearray, memoryview]):
+        if len(packed) != 4 and len(packed) != 16:
+            raise ValueError(f"Packed address must be 4 or 16 bytes long, not {len(packed)}")
+        self.packed = bytes(packed)
+
+    @property
+    def version(self) -> int:
+        return 4 if len(self.packed) == 4 else 6
+
+    def to_ipaddress(self) -> Union[ipaddress.IPv4Address, ipaddress.IPv6Address]:
+        if len(self.packed) == 4:
+            return ipaddress.IPv4Address(self.packed)
+        return ipaddress.IPv6Address(self.packed)
+
+    def __int__(self):
+        return int.from_bytes(self.packed, byteorder='big')
+
+    def __str__(self):
+        if len(self.packed) == 4:
+            return socket.inet_ntoa(self.packed)
+        # inet_ntop formats some IPv6 addresses differently, stay consistent with ipaddress.
+        return str(ipaddress.IPv6Address(self.packed))
+
+    def __repr__(self):
+        return f"PackedAddress('{self}')"
+
+    def __hash__(self):
+        return hash(self.packed)
+
+    def __eq__(self, other):
+        if isinstance(other, PackedAddress):
+            return self.packed == other.packed
+        return NotImplemented
+
+    def __lt__(self, other):
+        if isinstance(other, PackedAddress):
+            return (len(self.packed), self.packed) < (len(other.packed), other.packed)
+        return NotImplemented
+
+
 SINGLE_BYTE_MAX = 0xF0
 MIDDLE_BYTE_MASK = 0x80
 TERMINAL_BYTE_MASK = 0x00
 
 
+# Largest value fitting in a two-byte varint: the header byte carries 4 bits on top of
+#  SINGLE_BYTE_MAX, and the terminal byte 7 more bits shifted by 4.
+TWO_BYTE_MAX = SINGLE_BYTE_MAX + 0x0F + ((MIDDLE_BYTE_MASK - 1) << 4)
+
+_UINT32_MASK = 0xFFFFFFFF
+_UINT64_MASK = 0xFFFFFFFFFFFFFFFF
+_INT32_SIGN = 1 << 31
+_INT64_SIGN = 1 << 63
+
+
 def __is_middle_byte(byte: int) -> bool:
     return byte > MIDDLE_BYTE_MASK
 
 
+# The `decode_*` functions walk a memoryview with an integer offset rather than going
+#  through a file-like object, and return the decoded value together with the offset of
+#  the first byte following it.  Binary values are returned as zero-copy slices of the
+#  underlying buffer; callers that hold onto them beyond the lifetime of the frame should
+#  take a copy with `bytes(value)`.
+
+def decode_varint(buffer: memoryview, offset: int) -> Tuple[int, int]:
+    head = buffer[offset]
+    if head < SINGLE_BYTE_MAX:
+        return head, offset + 1
+
+    # Stream and frame ids, lengths and most integers fit in two bytes.
+    next_byte = buffer[offset + 1]
+    if next_byte < MIDDLE_BYTE_MASK:
+        return head + (next_byte << 4), offset + 2
+
+    offset += 2
+    shift = 11
+    actual_value = head + (next_byte << 4)
+    while True:
+        next_byte = buffer[offset]
+        offset += 1
+        actual_value += next_byte << shift
+        shift += 7
+
+        if next_byte < MIDDLE_BYTE_MASK:
+            return actual_value, offset
+
+
+# Integers are truncated to their width and the sign bit is wrapped arithmetically,
+#  as a C cast would.
+
+def decode_int32(buffer: memoryview, offset: int) -> Tuple[int, int]:
+    value, offset = decode_varint(buffer, offset)
+    value &= _UINT32_MASK
+    return (value - (_INT32_SIGN << 1) if value & _INT32_SIGN else value), offset
+
+
+def decode_int64(buffer: memoryview, offset: int) -> Tuple[int, int]:
+    value, offset = decode_varint(buffer, offset)
+    value &= _UINT64_MASK
+    return (value - (_INT64_SIGN << 1) if value & _INT64_SIGN else value), offset
+
+
+def decode_uint32(buffer: memoryview, offset: int) -> Tuple[int, int]:
+    value, offset = decode_varint(buffer, offset)
+    return value & _UINT32_MASK, offset
+
+
+def decode_uint64(buffer: memoryview, offset: int) -> Tuple[int, int]:
+    value, offset = decode_varint(buffer, offset)
+    return value & _UINT64_MASK, offset
+
+
+def decode_ipv4(buffer: memoryview, offset: int) -> Tuple[ipaddress.IPv4Address, int]:
+    end = _checked_end(buffer, offset, 4)
+    return ipaddress.IPv4Address(bytes(buffer[offset:end])), end
+
+
+def decode_ipv6(buffer: memoryview, offset: int) -> Tuple[ipaddress.IPv6Address, int]:
+    end = _checked_end(buffer, offset, 16)
+    return ipaddress.IPv6Address(bytes(buffer[offset:end])), end
+
+
+def decode_binary(buffer: memoryview, offset: int) -> Tuple[memoryview, int]:
+    bytes_length, offset = decode_varint(buffer, offset)
+    end = _checked_end(buffer, offset, bytes_length)
+    return buffer[offset:end], end
+
+
+def decode_string(buffer: memoryview, offset: int) -> Tuple[str, int]:
+    _bytes, offset = decode_binary(buffer, offset)
+    # The actual encoding is not well documented, but other agents have used ASCII.
+    # Based on some offhand remarks in an Haproxy blog post, this seems probable.
+    return str(_bytes, "ascii"), offset
+
+
+def decode_typed_data(buffer: memoryview, offset: int) -> Tuple[Any, int]:
+    type_flags = buffer[offset]
+    offset += 1
+
+    # The order of the octets is backwards from what the documentation says,
+    #  but this is how Haproxy _actually_ behaves.
+    _type = type_flags & 0x0F
+    flags = (type_flags & 0xF0) >> 4
+
+    if _type == SpopDataTypes.NULL:
+        return None, offset
+    elif _type == SpopDataTypes.BOOL:
+        return bool(flags), offset
+    elif _type == SpopDataTypes.INT32:
+        return decode_int32(buffer, offset)
+    elif _type == SpopDataTypes.UINT32:
+        return decode_uint32(buffer, offset)
+    elif _type == SpopDataTypes.INT64:
+        return decode_int64(buffer, offset)
+    elif _type == SpopDataTypes.UINT64:
+        return decode_uint64(buffer, offset)
+    elif _type == SpopDataTypes.IPV4:
+        return decode_ipv4(buffer, offset)
+    elif _type == SpopDataTypes.IPV6:
+        return decode_ipv6(buffer, offset)
+    elif _type == SpopDataTypes.STRING:
+        return decode_string(buffer, offset)
+    elif _type == SpopDataTypes.BINARY:
+        return decode_binary(buffer, offset)
+    else:
+        raise ValueError(f"Data type `{_type}` is unknown, your copy of Haproxy is likely counterfeit ( ͡° ͜ʖ ͡° )")
+
+
+def decode_typed_data_raw(buffer: memoryview, offset: int) -> Tuple[int, Any, int]:
+    """
+    Decode typed data without building rich values: strings, binaries and addresses are
+    all returned as zero-copy memoryviews.  Returns the data type along with the value
+    and the next offset, so that callers can pick the representation they need.
+    """
+    type_flags = buffer[offset]
+    offset += 1
+    _type = type_flags & 0x0F
+
+    if _type == SpopDataTypes.STRING or _type == SpopDataTypes.BINARY:
+        value, offset = decode_binary(buffer, offset)
+        return _type, value, offset
+    elif _type == SpopDataTypes.IPV4:
+        end = _checked_end(buffer, offset, 4)
+        return _type, buffer[offset:end], end
+    elif _type == SpopDataTypes.IPV6:
+        end = _checked_end(buffer, offset, 16)
+        return _type, buffer[offset:end], end
+    # Everything else is cheap enough to decode as usual.
+    value, offset = decode_typed_data(buffer, offset - 1)
+    return _type, value, offset
+
+
+def skip_varint(buffer: memoryview, offset: int) -> int:
+    if buffer[offset] < SINGLE_BYTE_MAX:
+        return offset + 1
+    offset += 1
+    while buffer[offset] >= MIDDLE_BYTE_MASK:
+        offset += 1
+    return offset + 1
+
+
+def skip_binary(buffer: memoryview, offset: int) -> int:
+    bytes_length, offset = decode_varint(buffer, offset)
+    return _checked_end(buffer, offset, bytes_length)
+
+
+def skip_typed_data(buffer: memoryview, offset: int) -> int:
+    """Return the offset following the typed data at `offset`, without decoding it."""
+    _type = buffer[offset] & 0x0F
+    offset += 1
+
+    if _type == SpopDataTypes.NULL or _type == SpopDataTypes.BOOL:
+        return offset
+    elif _type == SpopDataTypes.STRING or _type == SpopDataTypes.BINARY:
+        return skip_binary(buffer, offset)
+    elif _type == SpopDataTypes.IPV4:
+        return _checked_end(buffer, offset, 4)
+    elif _type == SpopDataTypes.IPV6:
+        return _checked_end(buffer, offset, 16)
+    elif _type <= SpopDataTypes.UINT64:
+        return skip_varint(buffer, offset)
+    else:
+        raise ValueError(f"Data type `{_type}` is unknown, your copy of Haproxy is likely counterfeit ( ͡° ͜ʖ ͡° )")
+
+
+def _checked_end(buffer: memoryview, offset: int, length: int) -> int:
+    end = offset + length
+    if end > len(buffer):
+        raise ValueError(f"Truncated value: expected {length} bytes at offset {offset}, buffer holds {len(buffer)}")
+    return end
+
+
+# The `parse_*` functions are kept for compatibility with code reading from an io.BytesIO.
+#  They read the stream directly, with the same results as their `decode_*` counterparts,
+#  except that binaries are returned as `bytes`.
+
 def parse_varint(buffer: io.BytesIO) -> int:
     head = buffer.read(1)[0]
-
     if head < SINGLE_BYTE_MAX:
         return head
 
@@ -43,63 +307,54 @@ def parse_varint(buffer: io.BytesIO) -> int:
 
 
 def parse_int32(buffer: io.BytesIO) -> int:
-    return ctypes.c_int32(
-        parse_varint(buffer)
-    ).value
+    value = parse_varint(buffer) & _UINT32_MASK
+    return value - (_INT32_SIGN << 1) if value & _INT32_SIGN else value
 
 
 def parse_int64(buffer: io.BytesIO) -> int:
-    return ctypes.c_int64(
-        parse_varint(buffer)
-    ).value
+    value = parse_varint(buffer) & _UINT64_MASK
+    return value - (_INT64_SIGN << 1) if value & _INT64_SIGN else value
 
 
 def parse_uint32(buffer: io.BytesIO) -> int:
-    return ctypes.c_uint32(
-        parse_varint(buffer)
-    ).value
+    return parse_varint(buffer) & _UINT32_MASK
 
 
 def parse_uint64(buffer: io.BytesIO) -> int:
-    return ctypes.c_uint64(
-        parse_varint(buffer)
-    ).value
+    return parse_varint(buffer) & _UINT64_MASK
+
+
+def _read_exactly(buffer: io.BytesIO, length: int) -> bytes:
+    value = buffer.read(length)
+    if len(value) != length:
+        raise ValueError(f"Truncated value: expected {length} bytes, stream holds {len(value)}")
+    return value
 
 
 def parse_ipv4(buffer: io.BytesIO) -> ipaddress.IPv4Address:
-    ipv4_struct = buffer.read(4)
-    return ipaddress.IPv4Address(ipv4_struct)
+    return ipaddress.IPv4Address(_read_exactly(buffer, 4))
 
 
 def parse_ipv6(buffer: io.BytesIO) -> ipaddress.IPv6Address:
-    ipv6_struct = buffer.read(16)
-    return ipaddress.IPv6Address(ipv6_struct)
+    return ipaddress.IPv6Address(_read_exactly(buffer, 16))
 
 
 def parse_binary(buffer: io.BytesIO) -> bytes:
-    bytes_length = parse_varint(buffer)
-    return buffer.read(bytes_length)
+    return _read_exactly(buffer, parse_varint(buffer))
 
 
 def parse_string(buffer: io.BytesIO) -> str:
-    _bytes = parse_binary(buffer)
-    # The actual encoding is not well documented, but other agents have used ASCII.
-    # Based on some offhand remarks in an Haproxy blog post, this seems probable.
-    return _bytes.decode("ascii")
+    return parse_binary(buffer).decode("ascii")
 
 
 def parse_typed_data(buffer: io.BytesIO):
     type_flags = buffer.read(1)[0]
-
-    # The order of the octets is backwards from what the documentation says,
-    #  but this is how Haproxy _actually_ behaves.
     _type = type_flags & 0x0F
-    flags = (type_flags & 0xF0) >> 4
 
     if _type == SpopDataTypes.NULL:
         return None
     elif _type == SpopDataTypes.BOOL:
-        return bool(flags)
+        return bool(type_flags >> 4)
     elif _type == SpopDataTypes.INT32:
         return parse_int32(buffer)
     elif _type == SpopDataTypes.UINT32:
@@ -120,14 +375,9 @@ def parse_typed_data(buffer: io.BytesIO):
         raise ValueError(f"Data type `{_type}` is unknown, your copy of Haproxy is likely counterfeit ( ͡° ͜ʖ ͡° )")
 
 
-def write_varint(value: int) -> bytes:
-    byte_conv_params = {
-        "byteorder": "little",
-        "signed": False,
-    }
-
+def _encode_varint(value: int) -> bytes:
     if value < SINGLE_BYTE_MAX:
-        return value.to_bytes(1, **byte_conv_params)
+        return bytes((value,))
 
     byte_list = []
 
@@ -146,7 +396,19 @@ def write_varint(value: int) -> bytes:
     return bytes(byte_list)
 
 
-def write_binary(value: bytes) -> bytes:
+# Every one- and two-byte varint, so that encoding them is a list lookup.
+_VARINT_ENCODINGS = [_encode_varint(value) for value in range(TWO_BYTE_MAX + 1)]
+
+
+def write_varint(value: int) -> bytes:
+    if 0 <= value <= TWO_BYTE_MAX:
+        return _VARINT_ENCODINGS[value]
+    if value < 0:
+        raise OverflowError(f"Cannot encode negative value {value} as a varint")
+    return _encode_varint(value)
+
+
+def write_binary(value: Union[bytes, bytearray, memoryview]) -> bytes:
     length_bytes = write_varint(len(value))
     return length_bytes + value
 
@@ -167,27 +429,29 @@ def write_typed_uint64(value: int) -> bytes:
     return write_datatype(SpopDataTypes.UINT64) + write_varint(value)
 
 
+# Like HAProxy, signed integers are sent as their 64-bit two's complement.
+
 def write_typed_int32(value: int) -> bytes:
-    return write_datatype(SpopDataTypes.INT32) + write_varint(value)
+    return write_datatype(SpopDataTypes.INT32) + write_varint(value & _UINT64_MASK)
 
 
 def write_typed_int64(value: int) -> bytes:
-    return write_datatype(SpopDataTypes.INT64) + write_varint(value)
+    return write_datatype(SpopDataTypes.INT64) + write_varint(value & _UINT64_MASK)
 
 
 def write_typed_string(value: str) -> bytes:
     return write_datatype(SpopDataTypes.STRING) + write_string(value)
 
 
-def write_typed_binary(value: bytes) -> bytes:
+def write_typed_binary(value: Union[bytes, bytearray, memoryview]) -> bytes:
     return write_datatype(SpopDataTypes.BINARY) + write_binary(value)
 
 
-def write_typed_ipv4(value: ipaddress.IPv4Address) -> bytes:
+def write_typed_ipv4(value: Union[ipaddress.IPv4Address, PackedAddress]) -> bytes:
     return write_datatype(SpopDataTypes.IPV4) + value.packed
 
 
-def write_typed_ipv6(value: ipaddress.IPv6Address) -> bytes:
+def write_typed_ipv6(value: Union[ipaddress.IPv6Address, PackedAddress]) -> bytes:
     return write_datatype(SpopDataTypes.IPV6) + value.packed
 
 
@@ -206,7 +470,30 @@ def write_typed_autodetect(value) -> bytes:
         return write_typed_ipv4(value)
     elif isinstance(value, ipaddress.IPv6Address):
         return write_typed_ipv6(value)
-    elif isinstance(value, bytes):
+    elif isinstance(value, PackedAddress):
+        return write_typed_ipv4(value) if value.version == 4 else write_typed_ipv6(value)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        # Memoryviews include the binary arguments handlers receive, which may be echoed back.
         return write_typed_binary(value)
     else:
         raise TypeError(f"Unable to serialize type {type(value)} into an SPOP-equivalent!")
+
+
+# The pure-Python varint codec above is the reference implementation.  When the optional
+#  `_speedups` extension was built, it replaces those functions, including for the
+#  `decode_*`/`write_*` functions calling them.
+PURE_PYTHON_CODEC = {
+    "decode_varint": decode_varint,
+    "decode_int32": decode_int32,
+    "decode_int64": decode_int64,
+    "decode_uint32": decode_uint32,
+    "decode_uint64": decode_uint64,
+    "write_varint": write_varint,
+}
+
+try:
+    from haproxyspoa._speedups import decode_varint, decode_int32, decode_int64, decode_uint32, decode_uint64, \
+        write_varint
+    ACCELERATED = True
+except ImportError:
+    ACCELERATED = False
@@ -0,0 +1,25 @@
+from haproxyspoa.payloads.agent_disconnect import DisconnectStatusCode
+
+
+class SpoaProtocolError(Exception):
+    """
+    Raised when HAProxy violates the protocol or exceeds a negotiated limit.  The
+    connection is terminated with an AGENT-DISCONNECT frame carrying `status_code`.
+    """
+
+    def __init__(self, status_code: DisconnectStatusCode, message: str = ""):
+        super().__init__(message or status_code.name)
+        self.status_code = status_code
+        self.message = message
+
+
+class FrameTooBigError(Exception):
+    """
+    Raised when the agent tries to send a frame larger than the max-frame-size
+    negotiated with HAProxy.  The frame is not written.
+    """
+
+    def __init__(self, frame_length: int, max_frame_size: int):
+        super().__init__(f"Frame of {frame_length} bytes exceeds the negotiated max-frame-size of {max_frame_size} bytes")
+        self.frame_length = frame_length
+        self.max_frame_size = max_frame_size
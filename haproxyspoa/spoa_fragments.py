@@ -0,0 +1,135 @@
+from typing import Dict, Optional, Tuple
+
+from haproxyspoa.payloads.agent_disconnect import DisconnectStatusCode
+from haproxyspoa.spoa_errors import SpoaProtocolError
+from haproxyspoa.spoa_frame import Frame, FrameFlags, FrameType
+
+
+DEFAULT_FRAGMENT_MEMORY_BUDGET = 4 * 1024 * 1024
+
+
+class _Reassembly:
+
+    def __init__(self, capacity: int):
+        self.buffer = bytearray(capacity)
+        self.length = 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self.buffer)
+
+    def append(self, data: memoryview):
+        end = self.length + len(data)
+        self.buffer[self.length:end] = data
+        self.length = end
+
+
+class FragmentReassembler:
+    """
+    Reassembles NOTIFY payloads that HAProxy split over several frames.
+
+    A fragmented payload starts with a NOTIFY frame without the FIN flag, continues
+    with FRAGMENT (type 0) frames carrying the same stream-id/frame-id, and ends with
+    the first of those frames to carry the FIN flag.  Any of them may carry the ABORT
+    flag, in which case the partial payload is discarded.
+
+    Payloads are assembled into a preallocated bytearray that grows geometrically,
+    and the capacity of every buffer held on the connection is charged against
+    `memory_budget`.  Exceeding it terminates the connection with
+    RESOURCE_ALLOCATION_ERROR rather than letting HAProxy grow our memory unbounded.
+    """
+
+    def __init__(
+        self,
+        memory_budget: int = DEFAULT_FRAGMENT_MEMORY_BUDGET,
+        initial_capacity: int = 16380,
+        allow_interlacing: bool = False,
+    ):
+        self.memory_budget = memory_budget
+        self.initial_capacity = initial_capacity
+        self.allow_interlacing = allow_interlacing
+        self.bytes_reserved = 0
+        self._pending: Dict[Tuple[int, int], _Reassembly] = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def feed(self, frame: Frame) -> Optional[Frame]:
+        """
+        Process a NOTIFY or FRAGMENT frame.  Returns the frame to dispatch when a
+        payload is complete, or None while more fragments are expected.
+        """
+        headers = frame.headers
+        key = (headers.stream_id, headers.frame_id)
+
+        if headers.is_abort():
+            self.abort(*key)
+            return None
+
+        if headers.is_haproxy_notify():
+            if key in self._pending:
+                raise SpoaProtocolError(
+                    DisconnectStatusCode.INVALID_INTERLACED_FRAMES,
+                    f"Stream {key[0]} frame {key[1]} is already being reassembled",
+                )
+            if headers.is_fin():
+                return frame
+            if self._pending and not self.allow_interlacing:
+                raise SpoaProtocolError(
+                    DisconnectStatusCode.INVALID_INTERLACED_FRAMES,
+                    "Fragmented frames may only be interlaced when pipelining is enabled",
+                )
+            reassembly = self._pending[key] = _Reassembly(0)
+            self._append(reassembly, frame.payload)
+            return None
+
+        reassembly = self._pending.get(key)
+        if reassembly is None:
+            raise SpoaProtocolError(
+                DisconnectStatusCode.FRAME_ID_NOT_FOUND,
+                f"Received a fragment for unknown stream {key[0]} frame {key[1]}",
+            )
+        self._append(reassembly, frame.payload)
+
+        if not headers.is_fin():
+            return None
+
+        del self._pending[key]
+        self.bytes_reserved -= reassembly.capacity
+        return Frame(
+            FrameType.HAPROXY_NOTIFY,
+            FrameFlags.FIN,
+            headers.stream_id,
+            headers.frame_id,
+            memoryview(reassembly.buffer)[:reassembly.length],
+        )
+
+    def abort(self, stream_id: int, frame_id: int) -> bool:
+        """Discard an in-progress reassembly, returning whether one existed."""
+        reassembly = self._pending.pop((stream_id, frame_id), None)
+        if reassembly is None:
+            return False
+        self.bytes_reserved -= reassembly.capacity
+        return True
+
+    def clear(self):
+        self._pending.clear()
+        self.bytes_reserved = 0
+
+    def _append(self, reassembly: _Reassembly, data: memoryview):
+        required = reassembly.length + len(data)
+        if required > reassembly.capacity:
+            new_capacity = max(self.initial_capacity, reassembly.capacity * 2, required)
+            growth = new_capacity - reassembly.capacity
+            if self.bytes_reserved + growth > self.memory_budget:
+                # Retry with an exact fit before giving up on the payload.
+                growth = required - reassembly.capacity
+                new_capacity = required
+                if self.bytes_reserved + growth > self.memory_budget:
+                    raise SpoaProtocolError(
+                        DisconnectStatusCode.RESOURCE_ALLOCATION_ERROR,
+                        f"Fragmented payloads exceed the memory budget of {self.memory_budget} bytes",
+                    )
+            reassembly.buffer.extend(bytes(growth))
+            self.bytes_reserved += growth
+        reassembly.append(data)
@@ -1,9 +1,12 @@
 import asyncio
 import io
-from enum import IntEnum
+from enum import IntEnum, IntFlag
+from typing import Optional, Union
 
+from haproxyspoa.payloads.agent_disconnect import DisconnectStatusCode
 from haproxyspoa.payloads.agent_hello import AgentHelloPayload
-from haproxyspoa.spoa_data_types import parse_varint, write_varint
+from haproxyspoa.spoa_errors import FrameTooBigError, SpoaProtocolError
+from haproxyspoa.spoa_data_types import decode_varint, write_varint
 
 
 class FrameType(IntEnum):
@@ -16,6 +19,20 @@ class FrameType(IntEnum):
     ACK = 103
 
 
+def check_frame_length(frame_length: int, max_frame_size: Optional[int]):
+    """Reject an inbound frame from its length prefix, before anything is allocated for it."""
+    if max_frame_size is not None and frame_length > max_frame_size:
+        raise SpoaProtocolError(
+            DisconnectStatusCode.FRAME_TOO_BIG,
+            f"Frame of {frame_length} bytes exceeds the max-frame-size of {max_frame_size} bytes",
+        )
+
+
+class FrameFlags(IntFlag):
+    FIN = 0x01
+    ABORT = 0x02
+
+
 class FrameHeaders:
 
     def __init__(
@@ -31,10 +48,15 @@ class FrameHeaders:
         self.frame_id = frame_id
 
     def is_fragmented_or_unset(self):
-        # Note: This implementation doesn't support fragmented frames, so
-        #  if the frame is fragmented, we're toast.
+        # Continuation of a fragmented payload, see `FragmentReassembler`.
         return self.type == FrameType.FRAGMENT
 
+    def is_fin(self):
+        return bool(self.flags & FrameFlags.FIN)
+
+    def is_abort(self):
+        return bool(self.flags & FrameFlags.ABORT)
+
     def is_haproxy_hello(self):
         return self.type == FrameType.HAPROXY_HELLO
 
@@ -62,7 +84,7 @@ class Frame:
         flags: int,
         stream_id: int,
         frame_id: int,
-        payload: io.BytesIO,
+        payload: Union[io.BytesIO, bytes, memoryview],
     ):
         self.headers = FrameHeaders(
             frame_type,
@@ -71,42 +93,63 @@ class Frame:
             frame_id
         )
         self.payload = payload
+        # Size on the wire, including the length prefix; only known for frames that were read.
+        self.size: Optional[int] = None
 
     @staticmethod
-    async def read_frame(reader: asyncio.StreamReader):
+    async def read_frame(reader: asyncio.StreamReader, max_frame_size: Optional[int] = None):
         frame_length = int.from_bytes(await reader.readexactly(4), byteorder='big', signed=False)
+        check_frame_length(frame_length, max_frame_size)
         frame_bytes: bytes = await reader.readexactly(frame_length)
-        frame_bytesio = io.BytesIO(frame_bytes)
+        return Frame.from_bytes(frame_bytes)
 
-        frame_type = int.from_bytes(frame_bytesio.read(1), byteorder='big', signed=False)
-        flags = int.from_bytes(frame_bytesio.read(4), byteorder='big', signed=False)
-        stream_id = parse_varint(frame_bytesio)
-        frame_id = parse_varint(frame_bytesio)
-
-        return Frame(
+    @staticmethod
+    def from_bytes(frame_bytes: bytes):
+        """
+        Decode a frame (without its 4-byte length prefix).  The payload of the
+        returned frame is a zero-copy memoryview over `frame_bytes`.
+        """
+        view = memoryview(frame_bytes)
+
+        frame_type = view[0]
+        flags = int.from_bytes(view[1:5], byteorder='big', signed=False)
+        stream_id, offset = decode_varint(view, 5)
+        frame_id, offset = decode_varint(view, offset)
+
+        frame = Frame(
             frame_type,
             flags,
             stream_id,
             frame_id,
-            frame_bytesio
+            view[offset:]
         )
-
-    async def write_frame(self, writer: asyncio.StreamWriter):
-        header_buffer = io.BytesIO()
-
-        header_buffer.write(self.headers.type.to_bytes(1, byteorder='big'))
-        header_buffer.write(self.headers.flags.to_bytes(4, byteorder='big'))
-        header_buffer.write(write_varint(self.headers.stream_id))
-        header_buffer.write(write_varint(self.headers.frame_id))
-
-        frame_header_bytes = header_buffer.getvalue()
-        frame_payload_bytes = self.payload.getvalue()
-        frame_length = len(frame_header_bytes) + len(frame_payload_bytes)
-
-        writer.write(frame_length.to_bytes(4, byteorder='big'))
-        writer.write(frame_header_bytes)
-        writer.write(frame_payload_bytes)
+        frame.size = len(view) + 4
+        return frame
+
+    async def write_frame(self, writer: asyncio.StreamWriter, max_frame_size: Optional[int] = None) -> int:
+        """Write the frame, returning its size on the wire."""
+        if isinstance(self.payload, io.BytesIO):
+            frame_payload_bytes = self.payload.getbuffer()
+        else:
+            frame_payload_bytes = self.payload
+
+        # The length prefix, headers and payload are assembled into one buffer,
+        #  so the frame is handed to the transport in a single write.
+        buffer = bytearray(4)
+        buffer.append(self.headers.type)
+        buffer += self.headers.flags.to_bytes(4, byteorder='big')
+        buffer += write_varint(self.headers.stream_id)
+        buffer += write_varint(self.headers.frame_id)
+        buffer += frame_payload_bytes
+
+        frame_length = len(buffer) - 4
+        if max_frame_size is not None and frame_length > max_frame_size:
+            raise FrameTooBigError(frame_length, max_frame_size)
+        buffer[0:4] = frame_length.to_bytes(4, byteorder='big')
+
+        writer.write(buffer)
         await writer.drain()
+        return len(buffer)
 
 
 class AgentHelloFrame(Frame):
@@ -0,0 +1,260 @@
+import asyncio
+import concurrent.futures
+import functools
+import time
+from typing import Any, Awaitable, Callable, List, Mapping, Optional, Tuple
+
+from haproxyspoa.payloads.ack import AckPayload
+from haproxyspoa.spoa_cache import TTLCache, make_cache_key
+from haproxyspoa.spoa_data_types import IPDecoding, StringDecoding
+from haproxyspoa.spoa_metrics import Histogram
+from haproxyspoa.spoa_schema import MessageSchema, value_converter
+
+
+class HandlerExecutor:
+    # Run on the event loop: awaited if it is a coroutine function, called directly otherwise.
+    INLINE = "inline"
+    # Run in the server's thread pool, for blocking I/O or C code that releases the GIL.
+    THREAD = "thread"
+    # Run in the server's process pool, for CPU-bound pure Python work.
+    PROCESS = "process"
+
+    ALL = (INLINE, THREAD, PROCESS)
+
+
+class ExecutorPools:
+    """
+    Thread and process pools shared by the handlers of a server.  Pools are only
+    created once a handler needs them, which also means they are created inside
+    each worker process rather than inherited across a fork.
+    """
+
+    def __init__(self, thread_workers: Optional[int] = None, process_workers: Optional[int] = None):
+        self.thread_workers = thread_workers
+        self.process_workers = process_workers
+        self._thread_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._process_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+    def thread_pool(self) -> concurrent.futures.ThreadPoolExecutor:
+        if self._thread_pool is None:
+            self._thread_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.thread_workers,
+                thread_name_prefix="spoa-handler",
+            )
+        return self._thread_pool
+
+    def process_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        if self._process_pool is None:
+            self._process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.process_workers)
+        return self._process_pool
+
+    def shutdown(self, wait: bool = True):
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=wait)
+            self._thread_pool = None
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=wait)
+            self._process_pool = None
+
+
+def _call_in_process(fn: Callable, kwargs: dict) -> AckPayload:
+    return fn(**kwargs)
+
+
+def _to_picklable(value):
+    # Binary arguments are zero-copy views into the frame, which cannot be pickled.
+    if isinstance(value, memoryview):
+        return value.tobytes()
+    if isinstance(value, list):
+        return [_to_picklable(v) for v in value]
+    return value
+
+
+class Handler:
+    """
+    Wraps a function registered through `SpoaServer.handler`.  Calling it with the
+    message arguments returns an awaitable resolving to the handler's `AckPayload`,
+    however the function is actually executed.  `invoke` first picks and decodes the
+    arguments the function declares, see `MessageSchema`.
+    """
+
+    def __init__(
+        self,
+        fn: Callable,
+        pools: ExecutorPools,
+        executor: Optional[str] = None,
+        concurrency: Optional[int] = None,
+        cache: Optional[TTLCache] = None,
+        timeout: Optional[float] = None,
+        latency: Optional[Histogram] = None,
+        ip_decoding: str = IPDecoding.IPADDRESS,
+        string_decoding: str = StringDecoding.ASCII,
+    ):
+        self.fn = fn
+        self.pools = pools
+        self.is_coroutine = asyncio.iscoroutinefunction(fn)
+
+        if executor is None:
+            executor = HandlerExecutor.INLINE if self.is_coroutine else HandlerExecutor.THREAD
+        if executor not in HandlerExecutor.ALL:
+            raise ValueError(f"Unknown executor `{executor}`, expected one of {', '.join(HandlerExecutor.ALL)}")
+        if self.is_coroutine and executor != HandlerExecutor.INLINE:
+            raise ValueError(f"Coroutine handler `{fn.__qualname__}` can only run on the event loop")
+        if concurrency is not None and concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        if timeout is not None and timeout <= 0:
+            raise ValueError("timeout must be positive")
+
+        self.executor = executor
+        self.concurrency = concurrency
+        self.cache = cache
+        self.timeout = timeout
+        self.latency = latency
+        self.schema = MessageSchema.from_function(fn, ip_decoding=ip_decoding, string_decoding=string_decoding)
+        # Created on first use, so that it binds to the running event loop.
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        functools.update_wrapper(self, fn)
+
+    def __call__(self, **kwargs):
+        if self.cache is not None:
+            invocation = self._execute_cached(kwargs)
+        elif self.concurrency is None:
+            invocation = self._execute(kwargs)
+        else:
+            invocation = self._execute_limited(kwargs)
+
+        if self.timeout is not None:
+            # Raises asyncio.TimeoutError, which the connection treats as a missed deadline.
+            invocation = asyncio.wait_for(invocation, self.timeout)
+        if self.latency is None:
+            return invocation
+        return self._timed(invocation)
+
+    def invoke(self, arguments: Mapping[str, Any]) -> Awaitable[AckPayload]:
+        return self(**self.schema.extract(arguments))
+
+    async def _timed(self, invocation: Awaitable[AckPayload]) -> AckPayload:
+        started = time.perf_counter()
+        try:
+            return await invocation
+        finally:
+            self.latency.observe(time.perf_counter() - started)
+
+    async def _execute_cached(self, kwargs: dict) -> AckPayload:
+        # Keyed by the function as well, as the cache may be shared with other handlers.
+        key = make_cache_key(kwargs, namespace=self.fn)
+        return await self.cache.get_or_compute(key, functools.partial(self._compute_frozen, kwargs))
+
+    async def _compute_frozen(self, kwargs: dict) -> AckPayload:
+        if self.concurrency is None:
+            ack = await self._execute(kwargs)
+        else:
+            ack = await self._execute_limited(kwargs)
+        return ack.freeze()
+
+    async def _execute_limited(self, kwargs: dict) -> AckPayload:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            return await self._execute(kwargs)
+
+    async def _execute(self, kwargs: dict) -> AckPayload:
+        if self.executor == HandlerExecutor.INLINE:
+            if self.is_coroutine:
+                return await self.fn(**kwargs)
+            return self.fn(**kwargs)
+
+        loop = asyncio.get_event_loop()
+        if self.executor == HandlerExecutor.THREAD:
+            return await loop.run_in_executor(self.pools.thread_pool(), functools.partial(self.fn, **kwargs))
+
+        kwargs = {k: _to_picklable(v) for k, v in kwargs.items()}
+        return await loop.run_in_executor(self.pools.process_pool(), _call_in_process, self.fn, kwargs)
+
+
+class BatchHandler:
+    """
+    Wraps a function registered through `SpoaServer.batch_handler`.  Calls are queued
+    across frames and connections, and the function is called once per batch with the
+    list of their arguments, as dicts, once `max_batch` calls are queued or `max_wait`
+    seconds after the first one.  It returns one `AckPayload` per call, in order, which
+    is fanned back out to the ACK of the frame each call came from.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[List[dict]], Any],
+        max_batch: int = 256,
+        max_wait: float = 0.001,
+        timeout: Optional[float] = None,
+        latency: Optional[Histogram] = None,
+        ip_decoding: str = IPDecoding.IPADDRESS,
+        string_decoding: str = StringDecoding.ASCII,
+    ):
+        if max_batch < 1:
+            raise ValueError("max_batch must be at least 1")
+        if max_wait < 0:
+            raise ValueError("max_wait must not be negative")
+        if timeout is not None and timeout <= 0:
+            raise ValueError("timeout must be positive")
+
+        self.fn = fn
+        self.is_coroutine = asyncio.iscoroutinefunction(fn)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.latency = latency
+        # Every argument of the message is passed on, decoded as for `**kwargs`.
+        self.schema = MessageSchema({}, accepts_any=True, default=value_converter(ip_decoding, string_decoding))
+        self.queued: List[Tuple[dict, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        functools.update_wrapper(self, fn)
+
+    def invoke(self, arguments: Mapping[str, Any]) -> Awaitable[AckPayload]:
+        loop = asyncio.get_event_loop()
+        result = loop.create_future()
+        self.queued.append((self.schema.extract(arguments), result))
+        if len(self.queued) >= self.max_batch:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self.flush)
+
+        if self.timeout is not None:
+            # Raises asyncio.TimeoutError, which the connection treats as a missed deadline.
+            return asyncio.wait_for(result, self.timeout)
+        return result
+
+    def flush(self):
+        """Call the function right away with the calls queued so far."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        # Calls whose frame was already given up on are left out.
+        batch = [(kwargs, result) for kwargs, result in self.queued if not result.done()]
+        self.queued = []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[dict, asyncio.Future]]):
+        started = time.perf_counter()
+        try:
+            acks = self.fn([kwargs for kwargs, _ in batch])
+            if self.is_coroutine:
+                acks = await acks
+            acks = list(acks)
+            if len(acks) != len(batch):
+                raise ValueError(
+                    f"Batch handler `{self.fn.__qualname__}` returned {len(acks)} results for {len(batch)} calls"
+                )
+        except Exception as e:
+            for _, result in batch:
+                if not result.done():
+                    result.set_exception(e)
+            return
+        finally:
+            if self.latency is not None:
+                self.latency.observe(time.perf_counter() - started)
+
+        for (_, result), ack in zip(batch, acks):
+            if not result.done():
+                result.set_result(ack)
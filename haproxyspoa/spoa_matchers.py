@@ -0,0 +1,243 @@
+import asyncio
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, List, Tuple, Union
+
+Text = Union[str, bytes, bytearray, memoryview]
+Pattern = Union[Text, Tuple[Text, Any]]
+
+_LOWER = bytes.maketrans(b"ABCDEFGHIJKLMNOPQRSTUVWXYZ", b"abcdefghijklmnopqrstuvwxyz")
+
+
+def _as_bytes(data: Text) -> bytes:
+    if isinstance(data, bytes):
+        return data
+    if isinstance(data, str):
+        return data.encode("utf-8")
+    return bytes(data)
+
+
+def _patterns(patterns: Iterable[Pattern]) -> Iterable[Tuple[bytes, Any]]:
+    """Patterns are given as `(pattern, value)` pairs, or alone to be their own value."""
+    for pattern in patterns:
+        if isinstance(pattern, tuple):
+            yield _as_bytes(pattern[0]), pattern[1]
+        else:
+            yield _as_bytes(pattern), pattern
+
+
+class _Missing:
+    def __repr__(self):
+        return "<missing>"
+
+
+_MISSING = _Missing()
+
+
+# Matchers take strings as the `str`, `bytes` or `memoryview` handlers receive, and
+#  compare their UTF-8 bytes, so arguments need not be decoded.  Each of them has a
+#  `match(data, default=None)` method returning the value of the matching pattern.
+
+class ExactMatcher:
+    """Exact match against a set of strings, with a single hash lookup."""
+
+    def __init__(self, patterns: Iterable[Pattern], ignore_case: bool = False):
+        self.ignore_case = ignore_case
+        self.values: Dict[bytes, Any] = {}
+        for pattern, value in _patterns(patterns):
+            self.values[pattern.translate(_LOWER) if ignore_case else pattern] = value
+
+    def match(self, data: Text, default: Any = None) -> Any:
+        data = _as_bytes(data)
+        if self.ignore_case:
+            data = data.translate(_LOWER)
+        return self.values.get(data, default)
+
+    def __contains__(self, data: Text) -> bool:
+        return self.match(data, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self.values)
+
+
+# Keys of a `DomainSuffixMatcher` trie node holding the value of the domain, which
+#  cannot collide with the labels, all bytes.
+_DOMAIN = 0
+_SUBDOMAINS = 1
+
+
+class DomainSuffixMatcher:
+    """
+    Matches host names against domains, in a trie of their labels from the top-level
+    domain down, so a lookup costs one step per label of the host whatever the number
+    of domains.  A pattern `example.com` matches `example.com` and any subdomain of it,
+    `*.example.com` only the subdomains.  When several patterns match, the value of the
+    longest one is returned.
+
+    Host names are compared case-insensitively, ignoring a trailing dot.  Ports must be
+    removed beforehand, e.g. with the `host_only` converter in the SPOE message.
+    """
+
+    def __init__(self, patterns: Iterable[Pattern]):
+        self.root: Dict[Any, Any] = {}
+        self.count = 0
+        for pattern, value in _patterns(patterns):
+            key = _DOMAIN
+            if pattern.startswith(b"*."):
+                key, pattern = _SUBDOMAINS, pattern[2:]
+            node = self.root
+            for label in reversed(pattern.translate(_LOWER).rstrip(b".").split(b".")):
+                node = node.setdefault(label, {})
+            if key not in node:
+                self.count += 1
+            node[key] = value
+
+    def match(self, host: Text, default: Any = None) -> Any:
+        labels = _as_bytes(host).translate(_LOWER).rstrip(b".").split(b".")
+        found = default
+        node = self.root
+        remaining = len(labels)
+        for label in reversed(labels):
+            node = node.get(label)
+            if node is None:
+                break
+            remaining -= 1
+            # On a subdomain, `*.example.com` is more specific than `example.com`.
+            if remaining and _SUBDOMAINS in node:
+                found = node[_SUBDOMAINS]
+            elif _DOMAIN in node:
+                found = node[_DOMAIN]
+        return found
+
+    def __contains__(self, host: Text) -> bool:
+        return self.match(host, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return self.count
+
+
+class SubstringMatcher:
+    """
+    Finds which of many substrings, such as user-agent signatures, occur in a string,
+    with an Aho-Corasick automaton: a single pass over the string, whatever the number
+    of patterns.
+
+    Each state of the automaton only keeps the edges of its trie node and its failure
+    link, so its memory grows with the total length of the patterns, not with the size
+    of the alphabet.
+    """
+
+    def __init__(self, patterns: Iterable[Pattern], ignore_case: bool = False):
+        self.ignore_case = ignore_case
+        # Byte -> next state, for each state.  The root is state 0, and never a target.
+        self.goto: List[Dict[int, int]] = [{}]
+        # Indexes of the patterns ending at each state, the longest first.
+        outputs: List[Tuple[int, ...]] = [()]
+        self.values = []
+        for pattern, value in _patterns(patterns):
+            if not pattern:
+                raise ValueError("Empty patterns are not supported")
+            if ignore_case:
+                pattern = pattern.translate(_LOWER)
+            state = 0
+            for byte in pattern:
+                next_state = self.goto[state].get(byte)
+                if next_state is None:
+                    next_state = self.goto[state][byte] = len(self.goto)
+                    self.goto.append({})
+                    outputs.append(())
+                state = next_state
+            outputs[state] = (len(self.values),)
+            self.values.append(value)
+
+        # Breadth first, so the failure state of a state, always shallower, is complete
+        #  by the time the state is visited.
+        self.failure = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            outputs[state] = outputs[state] + outputs[self.failure[state]]
+            for byte, next_state in self.goto[state].items():
+                self.failure[next_state] = self._step(self.failure[state], byte)
+                queue.append(next_state)
+        self.outputs = outputs
+        # Value of the longest pattern ending at each state, for `match`.
+        self.first = [self.values[output[0]] if output else _MISSING for output in outputs]
+
+    def _step(self, state: int, byte: int) -> int:
+        """The state following `state` on `byte`."""
+        goto = self.goto
+        failure = self.failure
+        next_state = goto[state].get(byte)
+        while next_state is None and state:
+            state = failure[state]
+            next_state = goto[state].get(byte)
+        return next_state or 0
+
+    def _prepare(self, data: Text) -> bytes:
+        data = _as_bytes(data)
+        return data.translate(_LOWER) if self.ignore_case else data
+
+    def match(self, data: Text, default: Any = None) -> Any:
+        """The value of the pattern found first in `data`, or `default`."""
+        goto = self.goto
+        failure = self.failure
+        first = self.first
+        state = 0
+        for byte in self._prepare(data):
+            # `_step`, inlined.
+            next_state = goto[state].get(byte)
+            while next_state is None and state:
+                state = failure[state]
+                next_state = goto[state].get(byte)
+            state = next_state or 0
+            if first[state] is not _MISSING:
+                return first[state]
+        return default
+
+    def findall(self, data: Text) -> List[Any]:
+        """The values of the patterns occurring in `data`, once each, in order of appearance."""
+        goto = self.goto
+        failure = self.failure
+        outputs = self.outputs
+        found = {}
+        state = 0
+        for byte in self._prepare(data):
+            next_state = goto[state].get(byte)
+            while next_state is None and state:
+                state = failure[state]
+                next_state = goto[state].get(byte)
+            state = next_state or 0
+            for index in outputs[state]:
+                found.setdefault(index)
+        return [self.values[index] for index in found]
+
+    def __contains__(self, data: Text) -> bool:
+        return self.match(data, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self.values)
+
+
+Matcher = Union[ExactMatcher, DomainSuffixMatcher, SubstringMatcher]
+
+
+class SwappableMatcher:
+    """
+    Holds the current matcher of a list.  A new matcher is built in a thread and swapped
+    in with a single assignment, e.g. from an `SpoaServer.on_reload` hook, so every
+    lookup sees either the old or the new list in full.
+    """
+
+    def __init__(self, matcher: Matcher):
+        self.matcher = matcher
+
+    def match(self, data: Text, default: Any = None) -> Any:
+        return self.matcher.match(data, default)
+
+    def __contains__(self, data: Text) -> bool:
+        return data in self.matcher
+
+    async def rebuild(self, build: Callable[..., Matcher], *args, **kwargs):
+        """Build a matcher with `build(*args, **kwargs)` in a thread, then swap it in."""
+        loop = asyncio.get_event_loop()
+        self.matcher = await loop.run_in_executor(None, lambda: build(*args, **kwargs))
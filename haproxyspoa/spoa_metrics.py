@@ -0,0 +1,221 @@
+import asyncio
+import bisect
+from typing import Dict, Iterable, List, Optional
+
+from haproxyspoa.logging import logger
+from haproxyspoa.spoa_frame import FrameType
+
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+# Codec work is far quicker than handlers, so it gets finer buckets.
+CODEC_BUCKETS = (
+    0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005,
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01,
+)
+
+
+def label(name: str, value) -> str:
+    """
+    Format a `name="value"` label pair, escaping the value as required by the
+    Prometheus text exposition format.
+    """
+    value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'{name}="{value}"'
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram.  Buckets are allocated up front, so observing a value
+    only increments existing counters.
+    """
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Iterable[float] = LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str = "") -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{label("le", bound)}}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{label("le", "+Inf")}}} {self.count}')
+        braces = f"{{{labels.rstrip(',')}}}" if labels else ""
+        lines.append(f"{name}_sum{braces} {self.sum}")
+        lines.append(f"{name}_count{braces} {self.count}")
+        return lines
+
+
+_FRAME_TYPES = tuple(FrameType)
+_MAX_STATUS_CODE = 100
+
+
+class SpoaMetrics:
+    """
+    Counters describing the activity of a `SpoaServer`.  Everything that can be is
+    preallocated (per frame type, per disconnect status code, per registered message),
+    so recording stays cheap enough to leave enabled under full load.  Gauges such as
+    open connections and in-flight frames are read from the live connections when
+    the metrics are rendered, rather than maintained on every event.
+    """
+
+    def __init__(self):
+        self.frames_in = [0] * 256
+        self.frames_out = [0] * 256
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.haproxy_disconnects = [0] * _MAX_STATUS_CODE
+        self.connections_total = 0
+        self.parse_seconds = Histogram(CODEC_BUCKETS)
+        self.encode_seconds = Histogram(CODEC_BUCKETS)
+        self.handler_seconds: Dict[str, Histogram] = {}
+        self.handler_timeouts: Dict[str, int] = {}
+        self.handler_failures: Dict[str, int] = {}
+        self.notify_timeouts = 0
+        self.notify_shed = {"inflight": 0, "queue_delay": 0}
+        self.connections = set()
+
+    def handler_histogram(self, message_key: str) -> Histogram:
+        histogram = self.handler_seconds.get(message_key)
+        if histogram is None:
+            histogram = self.handler_seconds[message_key] = Histogram(LATENCY_BUCKETS)
+        return histogram
+
+    def handler_timed_out(self, message_key: str):
+        self.handler_timeouts[message_key] = self.handler_timeouts.get(message_key, 0) + 1
+
+    def handler_failed(self, message_key: str):
+        self.handler_failures[message_key] = self.handler_failures.get(message_key, 0) + 1
+
+    def frame_received(self, frame_type: int, size: int):
+        self.frames_in[frame_type] += 1
+        self.bytes_in += size
+
+    def frame_sent(self, frame_type: int, size: int):
+        self.frames_out[frame_type] += 1
+        self.bytes_out += size
+
+    def haproxy_disconnected(self, status_code: int):
+        self.haproxy_disconnects[min(status_code, _MAX_STATUS_CODE - 1)] += 1
+
+    def connection_opened(self, conn):
+        self.connections.add(conn)
+        self.connections_total += 1
+
+    def connection_closed(self, conn):
+        self.connections.discard(conn)
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def header(name: str, kind: str, description: str):
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        header("spoa_frames_received_total", "counter", "Frames received from HAProxy, by frame type.")
+        for frame_type in _FRAME_TYPES:
+            lines.append(f'spoa_frames_received_total{{{label("type", frame_type.name)}}} {self.frames_in[frame_type]}')
+        header("spoa_frames_sent_total", "counter", "Frames sent to HAProxy, by frame type.")
+        for frame_type in _FRAME_TYPES:
+            lines.append(f'spoa_frames_sent_total{{{label("type", frame_type.name)}}} {self.frames_out[frame_type]}')
+
+        header("spoa_received_bytes_total", "counter", "Bytes received from HAProxy, including frame length prefixes.")
+        lines.append(f"spoa_received_bytes_total {self.bytes_in}")
+        header("spoa_sent_bytes_total", "counter", "Bytes sent to HAProxy, including frame length prefixes.")
+        lines.append(f"spoa_sent_bytes_total {self.bytes_out}")
+
+        header("spoa_connections", "gauge", "Currently open HAProxy connections.")
+        lines.append(f"spoa_connections {len(self.connections)}")
+        header("spoa_connections_total", "counter", "HAProxy connections accepted.")
+        lines.append(f"spoa_connections_total {self.connections_total}")
+
+        header("spoa_inflight_notify_frames", "gauge", "NOTIFY frames currently being processed, by connection.")
+        for conn in self.connections:
+            lines.append(f'spoa_inflight_notify_frames{{{label("flow_id", conn.flow_id)}}} {conn.inflight_count}')
+
+        header("spoa_haproxy_disconnects_total", "counter", "DISCONNECT frames received from HAProxy, by status code.")
+        for status_code, count in enumerate(self.haproxy_disconnects):
+            if count:
+                lines.append(f'spoa_haproxy_disconnects_total{{{label("status_code", status_code)}}} {count}')
+
+        header("spoa_handler_duration_seconds", "histogram", "Time spent in handlers, by message name.")
+        for message_key, histogram in self.handler_seconds.items():
+            lines.extend(histogram.render("spoa_handler_duration_seconds", label("message", message_key) + ","))
+
+        header("spoa_notify_timeouts_total", "counter", "NOTIFY frames that ran past their deadline.")
+        lines.append(f"spoa_notify_timeouts_total {self.notify_timeouts}")
+        header("spoa_shed_notify_frames_total", "counter", "NOTIFY frames answered with the shed ACK, by reason.")
+        for reason, count in self.notify_shed.items():
+            lines.append(f'spoa_shed_notify_frames_total{{{label("reason", reason)}}} {count}')
+        header("spoa_handler_timeouts_total", "counter", "Handler invocations abandoned at their deadline, by message name.")
+        for message_key, count in self.handler_timeouts.items():
+            lines.append(f'spoa_handler_timeouts_total{{{label("message", message_key)}}} {count}')
+        header("spoa_handler_failures_total", "counter", "Handler invocations that raised, by message name.")
+        for message_key, count in self.handler_failures.items():
+            lines.append(f'spoa_handler_failures_total{{{label("message", message_key)}}} {count}')
+
+        header("spoa_notify_parse_duration_seconds", "histogram", "Time spent decoding NOTIFY payloads.")
+        lines.extend(self.parse_seconds.render("spoa_notify_parse_duration_seconds"))
+        header("spoa_ack_encode_duration_seconds", "histogram", "Time spent encoding ACK payloads.")
+        lines.extend(self.encode_seconds.render("spoa_ack_encode_duration_seconds"))
+
+        lines.append("")
+        return "\n".join(lines)
+
+
+class MetricsEndpoint:
+    """
+    Minimal HTTP server exposing `SpoaMetrics.render` on `/metrics`, built on asyncio
+    streams so that it needs no dependency beyond the standard library.
+    """
+
+    def __init__(self, metrics: SpoaMetrics):
+        self.metrics = metrics
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str, port: int):
+        self.server = await asyncio.start_server(self._handle_request, host=host, port=port)
+        logger.info(f"Metrics available at http://{host}:{port}/metrics")
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+    async def _handle_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await reader.readline()
+            # Drain the request headers, which are of no interest.
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.metrics.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
@@ -1,33 +1,208 @@
 import io
-from collections import defaultdict
-from typing import Dict
+import sys
+from collections.abc import Mapping
+from typing import Any, Callable, Container, Dict, Iterable, List, Optional, Tuple, Union
 
-from haproxyspoa.spoa_data_types import parse_string, parse_typed_data, write_string, write_typed_autodetect
+from haproxyspoa.spoa_data_types import SINGLE_BYTE_MAX, _checked_end, decode_string, decode_typed_data, \
+    decode_typed_data_raw, decode_varint, parse_string, parse_typed_data, skip_binary, skip_typed_data, write_string, \
+    write_typed_autodetect
 
 
-def parse_list_of_messages(payload: io.BytesIO) -> dict:
+PayloadBuffer = Union[io.BytesIO, bytes, bytearray, memoryview]
+
+
+def payload_view(payload: PayloadBuffer) -> Tuple[memoryview, int]:
+    """A memoryview over the payload, and the offset it starts at."""
+    if isinstance(payload, io.BytesIO):
+        # Compatibility path: consume the remainder of the stream.
+        offset = payload.tell()
+        view = memoryview(payload.getvalue())
+        payload.seek(0, io.SEEK_END)
+        return view, offset
+    return memoryview(payload), 0
+
+
+class StringTable:
+    """
+    Interns the message names and argument keys of NOTIFY frames.  These come from the
+    `spoe-message` configuration, so the same few strings are sent over and over: they
+    are looked up by their raw bytes rather than decoded, and every frame gets the same
+    `str` objects, whose hash is already computed when they are looked up in turn.
+
+    The table starts with the strings the handlers expect, see `add`, and learns the
+    other ones on first sight, up to `max_size` of them.  Strings are UTF-8 encoded, a
+    superset of the ASCII names HAProxy sends.
+    """
+
+    def __init__(self, strings: Iterable[str] = (), max_size: int = 4096):
+        self.strings: Dict[bytes, str] = {}
+        self.max_size = max_size
+        self.add(*strings)
+
+    def add(self, *strings: str):
+        for string in strings:
+            self.strings[string.encode("utf-8")] = sys.intern(string)
+
+    def decode(self, buffer: memoryview, offset: int) -> Tuple[str, int]:
+        """Like `decode_string`, decoding UTF-8, for strings that are likely to be in the table."""
+        # Names and keys are short, their length takes a single byte.
+        length = buffer[offset]
+        if length < SINGLE_BYTE_MAX:
+            offset += 1
+        else:
+            length, offset = decode_varint(buffer, offset)
+        end = _checked_end(buffer, offset, length)
+        raw = buffer[offset:end]
+        # Read-only memoryviews hash and compare like bytes, which saves a copy.
+        string = self.strings.get(raw if buffer.readonly else raw.tobytes())
+        if string is None:
+            string = str(raw, "utf-8")
+            if len(self.strings) < self.max_size:
+                string = self.strings[raw.tobytes()] = sys.intern(string)
+        return string, end
+
+    def __contains__(self, string: str) -> bool:
+        return string.encode("utf-8") in self.strings
+
+    def __len__(self):
+        return len(self.strings)
+
+
+def _decode_typed_data_copy(buffer: memoryview, offset: int) -> Tuple[Any, int]:
+    """Same as `decode_typed_data`, with binaries copied to `bytes`."""
+    value, offset = decode_typed_data(buffer, offset)
+    if isinstance(value, memoryview):
+        value = value.tobytes()
+    return value, offset
+
+
+def parse_list_of_messages(payload: PayloadBuffer, strings: Optional[StringTable] = None) -> dict:
+    """Compatibility counterpart of `decode_list_of_messages`, returning binaries as `bytes`."""
+    view, offset = payload_view(payload)
+    return decode_list_of_messages(view, offset, strings, copy=True)
+
+
+def decode_list_of_messages(
+    buffer: memoryview,
+    offset: int = 0,
+    strings: Optional[StringTable] = None,
+    copy: bool = False,
+) -> dict:
+    """
+    Binary arguments are zero-copy memoryviews into `buffer`, unless `copy` is set.
+
+    :param strings: Table interning the message names and argument keys.
+    """
+    decode_name = strings.decode if strings is not None else decode_string
+    decode_value = _decode_typed_data_copy if copy else decode_typed_data
     messages = {}
+    end = len(buffer)
 
-    while payload.tell() != len(payload.getbuffer()):
-        message_name = parse_string(payload)
-        num_args = int.from_bytes(payload.read(1), byteorder='little', signed=False)
+    while offset != end:
+        message_name, offset = decode_name(buffer, offset)
+        num_args = buffer[offset]
+        offset += 1
 
-        arguments = defaultdict(list)
+        arguments = {}
         for _ in range(num_args):
-            key, value = parse_key_value_pair(payload)
-            arguments[key].append(value)
-
-        # For convenience in the handlers, flatten arguments
-        #  that have only one value mapping to the same key.
-        for argkey in arguments.keys():
-            if len(arguments[argkey]) == 1:
-                arguments[argkey] = arguments[argkey][0]
+            key, offset = decode_name(buffer, offset)
+            value, offset = decode_value(buffer, offset)
+            # For convenience in the handlers, arguments that have only one value
+            #  mapping to the same key are kept flat.  Typed data never decodes to
+            #  a list, so a list here always means a repeated key.
+            if key not in arguments:
+                arguments[key] = value
+            elif isinstance(arguments[key], list):
+                arguments[key].append(value)
+            else:
+                arguments[key] = [arguments[key], value]
 
         messages[message_name] = arguments
 
-    # Hide the default dict implementation
-    for k in messages.keys():
-        messages[k] = dict(messages[k])
+    return messages
+
+
+class MessageArguments(Mapping):
+    """
+    Arguments of a NOTIFY message, decoded only when accessed.  Indexing a message only
+    walks its argument names, recording where each value starts in the frame; values
+    are decoded from there on every access.  Like `decode_list_of_messages`, a
+    repeated key maps to the list of its values.
+    """
+
+    __slots__ = ("buffer", "offsets")
+
+    def __init__(self, buffer: memoryview, offsets: Dict[str, Union[int, List[int]]]):
+        self.buffer = buffer
+        self.offsets = offsets
+
+    def __getitem__(self, key: str):
+        offsets = self.offsets[key]
+        if isinstance(offsets, int):
+            return decode_typed_data(self.buffer, offsets)[0]
+        return [decode_typed_data(self.buffer, offset)[0] for offset in offsets]
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, key):
+        return key in self.offsets
+
+    def decode(self, key: str, convert: Callable[[int, Any], Any]):
+        """
+        Decode the argument `key` with `convert`, which receives the data type and the
+        value as returned by `decode_typed_data_raw`.
+        """
+        offsets = self.offsets[key]
+        if isinstance(offsets, int):
+            data_type, value, _ = decode_typed_data_raw(self.buffer, offsets)
+            return convert(data_type, value)
+        return [convert(*decode_typed_data_raw(self.buffer, offset)[:2]) for offset in offsets]
+
+    def __repr__(self):
+        return f"MessageArguments({dict(self)!r})"
+
+
+def index_list_of_messages(
+    buffer: memoryview,
+    offset: int = 0,
+    wanted: Optional[Container[str]] = None,
+    strings: Optional[StringTable] = None,
+) -> Dict[str, MessageArguments]:
+    """
+    Lazy counterpart of `decode_list_of_messages`.  Messages whose name is not in
+    `wanted` are skipped over without decoding any of their arguments.
+    """
+    decode_name = strings.decode if strings is not None else decode_string
+    messages = {}
+    end = len(buffer)
+
+    while offset != end:
+        message_name, offset = decode_name(buffer, offset)
+        num_args = buffer[offset]
+        offset += 1
+
+        if wanted is not None and message_name not in wanted:
+            for _ in range(num_args):
+                offset = skip_typed_data(buffer, skip_binary(buffer, offset))
+            continue
+
+        offsets = {}
+        for _ in range(num_args):
+            key, offset = decode_name(buffer, offset)
+            previous = offsets.get(key)
+            if previous is None:
+                offsets[key] = offset
+            elif isinstance(previous, list):
+                previous.append(offset)
+            else:
+                offsets[key] = [previous, offset]
+            offset = skip_typed_data(buffer, offset)
+
+        messages[message_name] = MessageArguments(buffer, offsets)
 
     return messages
 
@@ -64,11 +239,20 @@ def write_list_of_actions(actions: list) -> bytes:
     return buffer.getvalue()
 
 
-def parse_kv_list(payload: io.BytesIO):
+def parse_kv_list(payload: PayloadBuffer) -> dict:
+    """Compatibility counterpart of `decode_kv_list`, returning binaries as `bytes`."""
+    view, offset = payload_view(payload)
+    return decode_kv_list(view, offset, copy=True)
+
+
+def decode_kv_list(buffer: memoryview, offset: int = 0, copy: bool = False) -> dict:
+    """Binary values are zero-copy memoryviews into `buffer`, unless `copy` is set."""
+    decode_value = _decode_typed_data_copy if copy else decode_typed_data
     kv_list = {}
-    while payload.tell() != len(payload.getbuffer()):
-        key = parse_string(payload)
-        value = parse_typed_data(payload)
+    end = len(buffer)
+    while offset != end:
+        key, offset = decode_string(buffer, offset)
+        value, offset = decode_value(buffer, offset)
         kv_list[key] = value
     return kv_list
 
@@ -0,0 +1,287 @@
+import array
+import asyncio
+import bisect
+import ipaddress
+import json
+import mmap
+import struct
+import sys
+from typing import Any, Iterable, List, Optional, Sequence, Tuple, Union
+
+from haproxyspoa.spoa_data_types import PackedAddress
+
+
+Address = Union[bytes, bytearray, memoryview, PackedAddress, ipaddress.IPv4Address, ipaddress.IPv6Address, str]
+Network = Union[str, ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+_MAGIC = b"SPOAPFX3"
+# Magic, IPv4 range count, IPv6 range count, length of the JSON encoded values, and
+#  padding to a multiple of 8 bytes, so that the 64-bit columns following it are aligned.
+_HEADER = struct.Struct("<8sIIIxxxx")
+_LOW_64 = (1 << 64) - 1
+
+
+def _packed(address: Address) -> bytes:
+    if isinstance(address, bytes):
+        return address
+    if isinstance(address, (bytearray, memoryview)):
+        return bytes(address)
+    if isinstance(address, str):
+        return ipaddress.ip_address(address).packed
+    return address.packed
+
+
+class _Ranges:
+    """
+    Disjoint address ranges of one family, sorted by their first address, stored as
+    parallel columns of unsigned integers so that both in-memory arrays and memory-mapped
+    files are searched by the C implementation of `bisect`.  IPv4 addresses fit in the
+    `hi` columns; IPv6 addresses are split into their high and low 64-bit halves.
+    """
+
+    __slots__ = ("start_hi", "start_lo", "end_hi", "end_lo", "value_ids")
+
+    def __init__(
+        self,
+        start_hi: Sequence[int],
+        end_hi: Sequence[int],
+        value_ids: Sequence[int],
+        start_lo: Optional[Sequence[int]] = None,
+        end_lo: Optional[Sequence[int]] = None,
+    ):
+        self.start_hi = start_hi
+        self.start_lo = start_lo
+        self.end_hi = end_hi
+        self.end_lo = end_lo
+        self.value_ids = value_ids
+
+    def __len__(self):
+        return len(self.start_hi)
+
+    def find(self, hi: int, lo: int = 0) -> int:
+        """Return the value id of the range containing the address, or -1."""
+        i = bisect.bisect_right(self.start_hi, hi)
+        if self.start_lo is not None:
+            # Among the ranges starting with the same high half, pick by the low half.
+            first = bisect.bisect_left(self.start_hi, hi, 0, i)
+            if first < i:
+                j = bisect.bisect_right(self.start_lo, lo, first, i)
+                i = j if j > first else first
+        i -= 1
+        if i < 0:
+            return -1
+        end_hi = self.end_hi[i]
+        if hi < end_hi or (hi == end_hi and (self.end_lo is None or lo <= self.end_lo[i])):
+            return self.value_ids[i]
+        return -1
+
+    def columns(self) -> List[Sequence[int]]:
+        if self.start_lo is None:
+            return [self.start_hi, self.end_hi]
+        return [self.start_hi, self.start_lo, self.end_hi, self.end_lo]
+
+
+def _flatten(prefixes: List[Tuple[int, int, int]]) -> List[Tuple[int, int, int]]:
+    """
+    Turn possibly nested (start, end, value id) prefixes into disjoint ranges, each
+    carrying the value of the longest prefix covering it.  Adjacent ranges with the same
+    value are merged.
+    """
+    # Wider prefixes first when they start at the same address, so that they end up
+    #  below the narrower ones on the stack.
+    prefixes.sort(key=lambda p: (p[0], -p[1]))
+    ranges = []
+
+    def emit(start: int, end: int, value_id: int):
+        if start > end:
+            return
+        if ranges and ranges[-1][2] == value_id and ranges[-1][1] + 1 == start:
+            ranges[-1] = (ranges[-1][0], end, value_id)
+        else:
+            ranges.append((start, end, value_id))
+
+    stack = []  # (end, value id) of the prefixes covering `position`
+    position = 0
+    for start, end, value_id in prefixes:
+        while stack and stack[-1][0] < start:
+            top_end, top_value = stack.pop()
+            emit(position, top_end, top_value)
+            position = top_end + 1
+        if stack:
+            emit(position, start - 1, stack[-1][1])
+        stack.append((end, value_id))
+        position = start
+    while stack:
+        top_end, top_value = stack.pop()
+        emit(position, top_end, top_value)
+        position = top_end + 1
+    return ranges
+
+
+def _column_bytes(column: Sequence[int], typecode: str) -> bytes:
+    values = array.array(typecode, column)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _column_view(chunk: memoryview, typecode: str) -> Sequence[int]:
+    if sys.byteorder == "little":
+        return chunk.cast(typecode)
+    values = array.array(typecode, chunk.tobytes())
+    values.byteswap()
+    return values
+
+
+class PrefixIndex:
+    """
+    Longest-prefix-match index over IPv4 and IPv6 networks, e.g. for IP reputation lists.
+
+    Prefixes are flattened into disjoint, sorted address ranges, so a lookup is a binary
+    search.  Lookups take the packed bytes handlers receive with `ip_decoding="packed"`
+    or `"compact"` as they are, as well as `ipaddress` objects.
+
+    An index can be saved to a compact file and loaded back with `mmap`, so that the
+    worker processes of an agent share a single copy of it through the page cache.
+    """
+
+    def __init__(self, ipv4: _Ranges, ipv6: _Ranges, values: List[Any]):
+        self.ipv4 = ipv4
+        self.ipv6 = ipv6
+        self.values = values
+
+    @staticmethod
+    def build(prefixes: Iterable[Tuple[Network, Any]]) -> 'PrefixIndex':
+        """
+        Build an index from `(network, value)` pairs.  When several networks contain an
+        address, the value of the longest one is found; for the same network given twice,
+        the last value wins.  Host bits set in a network are ignored.  Values must be
+        hashable, and JSON serializable for the index to be saved.
+        """
+        values = []
+        value_ids = {}
+        per_family = {4: [], 6: []}
+        for network, value in prefixes:
+            if isinstance(network, str):
+                network = ipaddress.ip_network(network, strict=False)
+            key = (type(value), value)
+            value_id = value_ids.get(key)
+            if value_id is None:
+                value_id = value_ids[key] = len(values)
+                values.append(value)
+            per_family[network.version].append(
+                (int(network.network_address), int(network.broadcast_address), value_id)
+            )
+
+        ipv4 = _flatten(per_family[4])
+        ipv6 = _flatten(per_family[6])
+        return PrefixIndex(
+            _Ranges(
+                array.array("I", [start for start, _, _ in ipv4]),
+                array.array("I", [end for _, end, _ in ipv4]),
+                array.array("I", [value_id for _, _, value_id in ipv4]),
+            ),
+            _Ranges(
+                array.array("Q", [start >> 64 for start, _, _ in ipv6]),
+                array.array("Q", [end >> 64 for _, end, _ in ipv6]),
+                array.array("I", [value_id for _, _, value_id in ipv6]),
+                start_lo=array.array("Q", [start & _LOW_64 for start, _, _ in ipv6]),
+                end_lo=array.array("Q", [end & _LOW_64 for _, end, _ in ipv6]),
+            ),
+            values,
+        )
+
+    def _find(self, address: Address) -> int:
+        packed = _packed(address)
+        if len(packed) == 4:
+            return self.ipv4.find(int.from_bytes(packed, byteorder='big'))
+        value = int.from_bytes(packed, byteorder='big')
+        return self.ipv6.find(value >> 64, value & _LOW_64)
+
+    def lookup(self, address: Address, default: Any = None) -> Any:
+        value_id = self._find(address)
+        if value_id < 0:
+            return default
+        return self.values[value_id]
+
+    def __contains__(self, address: Address) -> bool:
+        return self._find(address) >= 0
+
+    def __len__(self):
+        """Number of disjoint ranges in the index."""
+        return len(self.ipv4) + len(self.ipv6)
+
+    def save(self, path: str):
+        """
+        Write the index to `path`.  After the header come the little-endian columns of the
+        IPv6 ranges (64-bit), of the IPv4 ranges (32-bit), the 32-bit value ids of both,
+        and finally the values as a JSON list.  The header takes 24 bytes and wider columns
+        come first, which keeps every column aligned in the mapping.
+        """
+        encoded_values = json.dumps(self.values).encode("utf-8")
+        with open(path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, len(self.ipv4), len(self.ipv6), len(encoded_values)))
+            for column in self.ipv6.columns():
+                f.write(_column_bytes(column, "Q"))
+            for column in self.ipv4.columns() + [self.ipv4.value_ids, self.ipv6.value_ids]:
+                f.write(_column_bytes(column, "I"))
+            f.write(encoded_values)
+
+    @staticmethod
+    def load(path: str) -> 'PrefixIndex':
+        """
+        Memory-map an index written by `save`.  The mapping stays open for as long as the
+        index is referenced.
+        """
+        with open(path, "rb") as f:
+            view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+        if len(view) < _HEADER.size or view[:len(_MAGIC)] != _MAGIC:
+            raise ValueError(f"{path} is not a prefix index")
+        _, ipv4_count, ipv6_count, values_length = _HEADER.unpack_from(view, 0)
+        offset = _HEADER.size
+
+        def column(count: int, typecode: str) -> Sequence[int]:
+            nonlocal offset
+            length = count * (8 if typecode == "Q" else 4)
+            chunk = view[offset:offset + length]
+            if len(chunk) != length:
+                raise ValueError(f"{path} is truncated")
+            offset += length
+            return _column_view(chunk, typecode)
+
+        ipv6_start_hi, ipv6_start_lo, ipv6_end_hi, ipv6_end_lo = (column(ipv6_count, "Q") for _ in range(4))
+        ipv4_start, ipv4_end = column(ipv4_count, "I"), column(ipv4_count, "I")
+        ipv4_ids, ipv6_ids = column(ipv4_count, "I"), column(ipv6_count, "I")
+        values = json.loads(view[offset:offset + values_length].tobytes())
+        return PrefixIndex(
+            _Ranges(ipv4_start, ipv4_end, ipv4_ids),
+            _Ranges(ipv6_start_hi, ipv6_end_hi, ipv6_ids, start_lo=ipv6_start_lo, end_lo=ipv6_end_lo),
+            values,
+        )
+
+
+class SwappablePrefixIndex:
+    """
+    Holds the current `PrefixIndex` of an agent.  A new index is built or loaded in a
+    thread and swapped in with a single assignment, so the event loop never waits on it
+    and every lookup sees either the old or the new index in full.  The old index is
+    released once the last handler still using it is done with it.
+    """
+
+    def __init__(self, index: Optional[PrefixIndex] = None):
+        self.index = index if index is not None else PrefixIndex.build(())
+
+    def lookup(self, address: Address, default: Any = None) -> Any:
+        return self.index.lookup(address, default)
+
+    def __contains__(self, address: Address) -> bool:
+        return address in self.index
+
+    async def load(self, path: str):
+        loop = asyncio.get_event_loop()
+        self.index = await loop.run_in_executor(None, PrefixIndex.load, path)
+
+    async def build(self, prefixes: Iterable[Tuple[Network, Any]]):
+        loop = asyncio.get_event_loop()
+        self.index = await loop.run_in_executor(None, PrefixIndex.build, prefixes)
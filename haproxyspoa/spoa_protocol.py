@@ -0,0 +1,184 @@
+import asyncio
+import collections
+from typing import Awaitable, Callable, Optional
+
+from haproxyspoa.spoa_errors import SpoaProtocolError
+from haproxyspoa.spoa_frame import Frame, check_frame_length
+
+
+DEFAULT_MAX_BUFFERED_FRAMES = 256
+
+
+class SpoaProtocol(asyncio.Protocol):
+    """
+    Low-level alternative to the StreamReader/StreamWriter based connection handling.
+
+    Every complete frame contained in a `data_received` chunk is cut out in one pass
+    and queued for the connection, so reading a frame does not cost two `readexactly`
+    awaits.  Outgoing data written during a single loop iteration is coalesced into
+    one `transport.writelines` call.  The protocol exposes the small subset of the
+    StreamWriter interface used by `Frame.write_frame` (`write`, `drain`, `close`),
+    so it can stand in for the writer of a `SpoaConnection`.
+    """
+
+    def __init__(
+        self,
+        on_connection: Callable[['SpoaProtocol'], Awaitable[None]],
+        max_buffered_frames: int = DEFAULT_MAX_BUFFERED_FRAMES,
+    ):
+        self._on_connection = on_connection
+        self._max_buffered_frames = max_buffered_frames
+        self._resume_threshold = max_buffered_frames // 2
+
+        self.transport: Optional[asyncio.Transport] = None
+        self._loop = None
+        self._task = None
+
+        # Holds the trailing partial frame between `data_received` calls.  It is
+        #  cleared rather than reallocated, so its storage is reused.
+        self._recv_buffer = bytearray()
+        self._frames = collections.deque()
+        self._frame_waiter: Optional[asyncio.Future] = None
+        self._reading_paused = False
+        self._eof = False
+        self._exception: Optional[BaseException] = None
+        self._read_error: Optional[SpoaProtocolError] = None
+        # Updated by `read_frame` once the connection has negotiated its limit.
+        self.max_frame_size: Optional[int] = None
+
+        self._pending_writes = []
+        self._flush_scheduled = False
+        self._writing_paused = False
+        self._drain_waiter: Optional[asyncio.Future] = None
+
+    # asyncio.Protocol callbacks
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        self._loop = asyncio.get_event_loop()
+        self._task = asyncio.ensure_future(self._on_connection(self))
+
+    def data_received(self, data: bytes):
+        if self._read_error is not None:
+            return
+        if self._recv_buffer:
+            self._recv_buffer += data
+            consumed = self._cut_frames(self._recv_buffer, copy=True)
+            del self._recv_buffer[:consumed]
+        else:
+            # Fast path: frames fully contained in this chunk are sliced out of it
+            #  without copying, only a trailing partial frame is buffered.
+            consumed = self._cut_frames(data, copy=False)
+            if consumed != len(data):
+                self._recv_buffer += memoryview(data)[consumed:]
+
+        if len(self._frames) >= self._max_buffered_frames and not self._reading_paused:
+            self._reading_paused = True
+            self.transport.pause_reading()
+
+    def eof_received(self):
+        self._eof = True
+        self._wake_frame_waiter()
+
+    def connection_lost(self, exc: Optional[Exception]):
+        self._eof = True
+        self._exception = exc
+        self._wake_frame_waiter()
+
+        if self._drain_waiter is not None and not self._drain_waiter.done():
+            if exc is None:
+                self._drain_waiter.set_result(None)
+            else:
+                self._drain_waiter.set_exception(exc)
+
+    def pause_writing(self):
+        self._writing_paused = True
+
+    def resume_writing(self):
+        self._writing_paused = False
+        if self._drain_waiter is not None and not self._drain_waiter.done():
+            self._drain_waiter.set_result(None)
+
+    # Reading
+
+    def _cut_frames(self, data, copy: bool) -> int:
+        view = memoryview(data)
+        offset = 0
+        available = len(view)
+
+        while available - offset >= 4:
+            frame_length = int.from_bytes(view[offset:offset + 4], byteorder='big', signed=False)
+            try:
+                check_frame_length(frame_length, self.max_frame_size)
+            except SpoaProtocolError as e:
+                # Surface the error once the frames preceding it have been consumed,
+                #  and stop buffering anything else from this connection.
+                self._read_error = e
+                self.transport.pause_reading()
+                self._wake_frame_waiter()
+                return len(view)
+            frame_end = offset + 4 + frame_length
+            if frame_end > available:
+                break
+            frame_bytes = view[offset + 4:frame_end]
+            self._frames.append(Frame.from_bytes(bytes(frame_bytes) if copy else frame_bytes))
+            offset = frame_end
+
+        if self._frames:
+            self._wake_frame_waiter()
+        return offset
+
+    def _wake_frame_waiter(self):
+        if self._frame_waiter is not None and not self._frame_waiter.done():
+            self._frame_waiter.set_result(None)
+
+    async def read_frame(self, max_frame_size: Optional[int] = None) -> Frame:
+        if max_frame_size is not None:
+            self.max_frame_size = max_frame_size
+        while not self._frames:
+            if self._read_error is not None:
+                raise self._read_error
+            if self._exception is not None:
+                raise self._exception
+            if self._eof:
+                raise asyncio.IncompleteReadError(bytes(self._recv_buffer), None)
+            self._frame_waiter = self._loop.create_future()
+            try:
+                await self._frame_waiter
+            finally:
+                self._frame_waiter = None
+
+        frame = self._frames.popleft()
+        if self._reading_paused and len(self._frames) <= self._resume_threshold:
+            self._reading_paused = False
+            self.transport.resume_reading()
+        return frame
+
+    # Writing (StreamWriter-compatible subset)
+
+    def write(self, data: bytes):
+        self._pending_writes.append(data)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._loop.call_soon(self._flush)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        if not self._pending_writes or self.transport.is_closing():
+            self._pending_writes.clear()
+            return
+        self.transport.writelines(self._pending_writes)
+        self._pending_writes.clear()
+
+    async def drain(self):
+        if self._exception is not None:
+            raise self._exception
+        if not self._writing_paused:
+            return
+        if self._drain_waiter is None or self._drain_waiter.done():
+            self._drain_waiter = self._loop.create_future()
+        await self._drain_waiter
+
+    def close(self):
+        self._flush()
+        self.transport.close()
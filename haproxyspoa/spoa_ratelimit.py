@@ -0,0 +1,210 @@
+import array
+import math
+import time
+from typing import Any, NamedTuple, Optional
+
+from haproxyspoa.payloads.ack import AckPayload
+
+_HASH_MASK = (1 << 64) - 1
+# Spreads consecutive hashes, such as those of small integers, over the sets.
+_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+
+
+class RateLimitAlgorithm:
+    # Approximate sliding window: the count of the current fixed window, plus the count
+    #  of the previous one weighted by how much of it the sliding window still covers.
+    SLIDING_WINDOW = "sliding_window"
+    # Token bucket holding up to `limit` tokens, refilled at `limit / window` per second.
+    TOKEN_BUCKET = "token_bucket"
+
+    ALL = (SLIDING_WINDOW, TOKEN_BUCKET)
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    # Requests counted in the current window, or tokens in use for a token bucket.
+    rate: float
+
+
+class RateLimiter:
+    """
+    Rate limiter tracking up to `capacity` keys, such as source addresses, in a few
+    flat arrays rather than with a Python object per key: a key only leaves a 64-bit
+    hash behind, and 28 bytes per tracked key are allocated upfront.
+
+    The table is set-associative: a key lives in one of the `ways` slots of its set.
+    When these are all taken, an idle key (whose count has fallen back to zero) or
+    else the least recently seen one is evicted, in constant time.  Two distinct keys
+    sharing their 64-bit hash share their count.
+
+        limiter = RateLimiter(limit=100, window=10)
+
+        @agent.handler("rate-limit")
+        async def rate_limit(src: bytes):
+            return limiter.verdict(src)
+
+    :param limit: Requests allowed per `window` seconds.
+    :param algorithm: One of `RateLimitAlgorithm`.
+    :param count_rejected: Whether rejected requests count towards the rate, which
+        keeps clients that do not back off limited.
+    """
+
+    def __init__(
+        self,
+        limit: float,
+        window: float,
+        algorithm: str = RateLimitAlgorithm.SLIDING_WINDOW,
+        capacity: int = 1 << 20,
+        ways: int = 8,
+        count_rejected: bool = False,
+    ):
+        if limit <= 0 or window <= 0:
+            raise ValueError("limit and window must be positive")
+        if algorithm not in RateLimitAlgorithm.ALL:
+            raise ValueError(f"Unknown algorithm `{algorithm}`, expected one of {', '.join(RateLimitAlgorithm.ALL)}")
+        if ways < 1 or capacity < ways:
+            raise ValueError("capacity must be at least `ways`, itself at least 1")
+
+        self.limit = limit
+        self.window = window
+        self.algorithm = algorithm
+        self.sliding = algorithm == RateLimitAlgorithm.SLIDING_WINDOW
+        self.refill_rate = limit / window
+        self.count_rejected = count_rejected
+        self.ways = ways
+        self.sets = -(-capacity // ways)
+        self.capacity = self.sets * ways
+        # Times are kept relative to this origin, so that they fit in doubles comfortably.
+        self.origin = time.monotonic()
+        # Keys evicted while still counting towards their limit.
+        self.evictions = 0
+
+        self.hashes = array.array("Q", bytes(8 * self.capacity))
+        # Sliding window: number of the current window, from 1.  Token bucket: time of
+        #  the last update.  0 for a slot that was never used.
+        self.stamps = array.array("d", bytes(8 * self.capacity))
+        # Sliding window: count of the current window.  Token bucket: tokens in use.
+        self.current = array.array("f", bytes(4 * self.capacity))
+        self.previous = array.array("f", bytes(4 * self.capacity))
+        # Number of the `decay` calls already applied to the slot.
+        self.epochs = array.array("I", bytes(4 * self.capacity))
+        # Cumulated log of the decay factors, indexed by epoch.
+        self.decay_logs = [0.0]
+
+    @property
+    def size(self) -> int:
+        """Bytes allocated for the table."""
+        return sum(column.itemsize * len(column) for column in (
+            self.hashes, self.stamps, self.current, self.previous, self.epochs,
+        ))
+
+    def _slot(self, key: Any, stamp: float) -> int:
+        """The slot of the key, claiming one if the key is not tracked yet."""
+        key_hash = (hash(key) * _HASH_MULTIPLIER) & _HASH_MASK or 1
+        hashes = self.hashes
+        stamps = self.stamps
+        start = (key_hash % self.sets) * self.ways
+        oldest = start
+        for slot in range(start, start + self.ways):
+            if hashes[slot] == key_hash:
+                return slot
+            if stamps[slot] < stamps[oldest]:
+                oldest = slot
+
+        if hashes[oldest] and self._usage(oldest, stamp) > 0:
+            self.evictions += 1
+        hashes[oldest] = key_hash
+        stamps[oldest] = 0.0
+        self.current[oldest] = 0.0
+        self.previous[oldest] = 0.0
+        self.epochs[oldest] = len(self.decay_logs) - 1
+        return oldest
+
+    def _usage(self, slot: int, stamp: float) -> float:
+        """Rate of the slot at `stamp`, ignoring pending decays."""
+        if self.sliding:
+            elapsed_windows = stamp - self.stamps[slot]
+            if elapsed_windows >= 2:
+                return 0.0
+            if elapsed_windows >= 1:
+                return self.current[slot]
+            return self.current[slot] + self.previous[slot]
+        return max(0.0, self.current[slot] - (stamp - self.stamps[slot]) * self.refill_rate)
+
+    def _apply_decay(self, slot: int):
+        epoch = len(self.decay_logs) - 1
+        if self.epochs[slot] != epoch:
+            scale = math.exp(self.decay_logs[epoch] - self.decay_logs[self.epochs[slot]])
+            self.current[slot] *= scale
+            self.previous[slot] *= scale
+            self.epochs[slot] = epoch
+
+    def check(self, key: Any, cost: float = 1, now: Optional[float] = None) -> RateLimitResult:
+        """
+        Count a request of `cost` for `key`, and tell whether it is within the limit.
+        `now` defaults to `time.monotonic()`.
+        """
+        now = (time.monotonic() if now is None else now) - self.origin
+        if self.sliding:
+            window_number = now / self.window
+            current_window = math.floor(window_number) + 1
+            slot = self._slot(key, current_window)
+            self._apply_decay(slot)
+            elapsed_windows = current_window - self.stamps[slot]
+            if elapsed_windows:
+                self.previous[slot] = self.current[slot] if elapsed_windows == 1 else 0.0
+                self.current[slot] = 0.0
+                self.stamps[slot] = current_window
+            # The share of the previous window still covered by the sliding window.
+            weight = current_window - window_number
+            rate = self.previous[slot] * weight + self.current[slot]
+        else:
+            slot = self._slot(key, now)
+            self._apply_decay(slot)
+            rate = max(0.0, self.current[slot] - (now - self.stamps[slot]) * self.refill_rate)
+            self.stamps[slot] = now
+
+        allowed = rate + cost <= self.limit
+        if allowed or self.count_rejected:
+            rate += cost
+            if self.sliding:
+                self.current[slot] += cost
+        if not self.sliding:
+            self.current[slot] = rate
+        return RateLimitResult(allowed, rate)
+
+    def verdict(
+        self,
+        key: Any,
+        ack: Optional[AckPayload] = None,
+        cost: float = 1,
+        limited_var: str = "rate_limited",
+        rate_var: Optional[str] = "rate",
+    ) -> AckPayload:
+        """
+        Check a request for `key`, and add the verdict to `ack`: `limited_var` is set to
+        1 when the request is over the limit, 0 otherwise, and `rate_var` to the rate,
+        rounded, unless None.
+        """
+        result = self.check(key, cost)
+        if ack is None:
+            ack = AckPayload()
+        ack.set_txn_var(limited_var, 0 if result.allowed else 1)
+        if rate_var is not None:
+            ack.set_txn_var(rate_var, round(result.rate))
+        return ack
+
+    def decay(self, factor: float):
+        """
+        Scale the rate of every key by `factor`, e.g. 0.5 to forgive half of the requests
+        seen so far.  Applied lazily, as each key is next checked, so it takes constant time.
+        """
+        if not 0 < factor <= 1:
+            raise ValueError("factor must be in (0, 1], use `reset` to forget every key")
+        self.decay_logs.append(self.decay_logs[-1] + math.log(factor))
+
+    def reset(self):
+        """Forget every key."""
+        for column in (self.hashes, self.stamps, self.current, self.previous, self.epochs):
+            column[:] = array.array(column.typecode, bytes(column.itemsize * len(column)))
+        self.decay_logs = [0.0]
@@ -0,0 +1,201 @@
+import inspect
+import ipaddress
+import typing
+from typing import Any, Callable, Dict, Mapping
+
+from haproxyspoa.spoa_data_types import IPDecoding, PackedAddress, SpopDataTypes, StringDecoding
+from haproxyspoa.spoa_payloads import MessageArguments
+
+
+# Converters receive the data type and the value returned by `decode_typed_data_raw`,
+#  in which strings, binaries and addresses are still memoryviews into the frame.
+
+def convert_rich(data_type: int, value: Any) -> Any:
+    """Same representation as `decode_typed_data`."""
+    if data_type == SpopDataTypes.STRING:
+        return str(value, "ascii")
+    elif data_type == SpopDataTypes.IPV4:
+        return ipaddress.IPv4Address(bytes(value))
+    elif data_type == SpopDataTypes.IPV6:
+        return ipaddress.IPv6Address(bytes(value))
+    return value
+
+
+def convert_bytes(data_type: int, value: Any) -> Any:
+    """Strings, binaries and addresses as bytes; addresses in their packed form."""
+    if isinstance(value, memoryview):
+        return value.tobytes()
+    return value
+
+
+def convert_memoryview(data_type: int, value: Any) -> Any:
+    """Strings, binaries and addresses as zero-copy views into the frame."""
+    return value
+
+
+def _is_address(data_type: int) -> bool:
+    return data_type == SpopDataTypes.IPV4 or data_type == SpopDataTypes.IPV6
+
+
+def convert_int(data_type: int, value: Any) -> Any:
+    """Addresses as integers, as `int(ipaddress.ip_address(...))` would give."""
+    if _is_address(data_type):
+        return int.from_bytes(value, byteorder='big')
+    return convert_rich(data_type, value)
+
+
+def convert_packed(data_type: int, value: Any) -> Any:
+    """Addresses as packed bytes, everything else as `convert_rich`."""
+    if _is_address(data_type):
+        return value.tobytes()
+    return convert_rich(data_type, value)
+
+
+def convert_packed_address(data_type: int, value: Any) -> Any:
+    """Addresses as `PackedAddress`."""
+    if _is_address(data_type):
+        return PackedAddress(value)
+    return convert_rich(data_type, value)
+
+
+_ADDRESS_CONVERTERS = {
+    IPDecoding.IPADDRESS: convert_rich,
+    IPDecoding.PACKED: convert_packed,
+    IPDecoding.INT: convert_int,
+    IPDecoding.COMPACT: convert_packed_address,
+}
+
+
+def address_converter(ip_decoding: str) -> Callable[[int, Any], Any]:
+    """The converter decoding addresses as `ip_decoding`, one of `IPDecoding`."""
+    try:
+        return _ADDRESS_CONVERTERS[ip_decoding]
+    except KeyError:
+        raise ValueError(f"Unknown IP decoding `{ip_decoding}`, expected one of {', '.join(IPDecoding.ALL)}")
+
+
+_STRING_DECODERS: Dict[str, Callable[[memoryview], Any]] = {
+    StringDecoding.LATIN_1: lambda value: str(value, "latin-1"),
+    StringDecoding.UTF_8: lambda value: str(value, "utf-8", "surrogateescape"),
+    StringDecoding.BYTES: lambda value: value.tobytes(),
+}
+
+
+def value_converter(
+    ip_decoding: str = IPDecoding.IPADDRESS,
+    string_decoding: str = StringDecoding.ASCII,
+) -> Callable[[int, Any], Any]:
+    """
+    The converter decoding addresses as `ip_decoding`, one of `IPDecoding`, and strings
+    as `string_decoding`, one of `StringDecoding`.
+    """
+    convert_address = address_converter(ip_decoding)
+    if string_decoding == StringDecoding.ASCII:
+        return convert_address
+    try:
+        decode = _STRING_DECODERS[string_decoding]
+    except KeyError:
+        raise ValueError(
+            f"Unknown string decoding `{string_decoding}`, expected one of {', '.join(StringDecoding.ALL)}"
+        )
+
+    def convert(data_type: int, value: Any) -> Any:
+        if data_type == SpopDataTypes.STRING:
+            return decode(value)
+        return convert_address(data_type, value)
+    return convert
+
+
+# Maps the annotation of a handler parameter to the converter decoding it.  Parameters
+#  without an annotation listed here get the same values as `decode_typed_data`, except
+#  for addresses and strings which follow the `ip_decoding` and `string_decoding` of the
+#  schema.
+ARGUMENT_CONVERTERS: Dict[Any, Callable[[int, Any], Any]] = {
+    bytes: convert_bytes,
+    memoryview: convert_memoryview,
+}
+
+# Annotations selecting how addresses are decoded, overriding the `ip_decoding` of the
+#  schema.  Strings still follow its `string_decoding`.
+ADDRESS_ANNOTATIONS: Dict[Any, str] = {
+    int: IPDecoding.INT,
+    PackedAddress: IPDecoding.COMPACT,
+    ipaddress.IPv4Address: IPDecoding.IPADDRESS,
+    ipaddress.IPv6Address: IPDecoding.IPADDRESS,
+}
+
+
+class MessageSchema:
+    """
+    The arguments a handler takes and how each one is decoded, read from the signature
+    of the handler function:
+
+        async def handle_earth_to_mars(src: IPv4Address, req_host: str, body: memoryview): ...
+
+    Only the declared arguments are decoded, the others sent with the message are
+    skipped, unless the function takes `**kwargs`.
+    """
+
+    def __init__(
+        self,
+        converters: Dict[str, Callable[[int, Any], Any]],
+        accepts_any: bool = False,
+        default: Callable[[int, Any], Any] = convert_rich,
+    ):
+        """
+        :param default: Converter of the arguments received through `**kwargs`.
+        """
+        self.converters = converters
+        self.accepts_any = accepts_any
+        self.default = default
+
+    @staticmethod
+    def from_function(
+        fn: Callable,
+        ip_decoding: str = IPDecoding.IPADDRESS,
+        string_decoding: str = StringDecoding.ASCII,
+    ) -> 'MessageSchema':
+        """
+        :param ip_decoding: How addresses are decoded for parameters whose annotation
+            does not call for a specific representation, one of `IPDecoding`.
+        :param string_decoding: How strings are decoded for parameters not annotated
+            `bytes` or `memoryview`, one of `StringDecoding`.
+        """
+        default = value_converter(ip_decoding, string_decoding)
+        address_converters = {
+            annotation: value_converter(annotation_ip_decoding, string_decoding)
+            for annotation, annotation_ip_decoding in ADDRESS_ANNOTATIONS.items()
+        }
+        try:
+            hints = typing.get_type_hints(fn)
+        except Exception:
+            # Unresolvable forward references, fall back to the default decoding.
+            hints = {}
+
+        converters = {}
+        accepts_any = False
+        for name, parameter in inspect.signature(fn).parameters.items():
+            if parameter.kind == inspect.Parameter.VAR_KEYWORD:
+                accepts_any = True
+            elif parameter.kind in (inspect.Parameter.POSITIONAL_OR_KEYWORD, inspect.Parameter.KEYWORD_ONLY):
+                hint = hints.get(name)
+                converters[name] = ARGUMENT_CONVERTERS.get(hint) or address_converters.get(hint, default)
+        return MessageSchema(converters, accepts_any, default)
+
+    def extract(self, arguments: Mapping[str, Any]) -> Dict[str, Any]:
+        """Decode the arguments of a message into the keyword arguments of the handler."""
+        if not isinstance(arguments, MessageArguments):
+            # Already decoded, e.g. by `parse_list_of_messages`.
+            if self.accepts_any:
+                return dict(arguments)
+            return {name: arguments[name] for name in self.converters if name in arguments}
+
+        kwargs = {
+            name: arguments.decode(name, convert)
+            for name, convert in self.converters.items() if name in arguments
+        }
+        if self.accepts_any:
+            for key in arguments:
+                if key not in kwargs:
+                    kwargs[key] = arguments.decode(key, self.default)
+        return kwargs
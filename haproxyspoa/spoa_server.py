@@ -1,7 +1,14 @@
 import asyncio
 import functools
+import importlib
+import logging
+import random
+import signal
+import sys
+import time
 from collections import defaultdict
-from typing import List
+from types import ModuleType
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Union
 
 from haproxyspoa.logging import logger, FlowIdLoggerAdapter
 from haproxyspoa.payloads.ack import AckPayload
@@ -10,34 +17,213 @@ from haproxyspoa.payloads.agent_hello import AgentHelloPayload, AgentCapabilitie
 from haproxyspoa.payloads.haproxy_disconnect import HaproxyDisconnectPayload
 from haproxyspoa.payloads.haproxy_hello import HaproxyHelloPayload
 from haproxyspoa.payloads.notify import NotifyPayload
+from haproxyspoa.spoa_admission import AdmissionController
+from haproxyspoa.spoa_backends import BackendConnection, BackendPool
+from haproxyspoa.spoa_cache import TTLCache
+from haproxyspoa.spoa_data_types import IPDecoding, StringDecoding
+from haproxyspoa.spoa_errors import FrameTooBigError, SpoaProtocolError
+from haproxyspoa.spoa_fragments import DEFAULT_FRAGMENT_MEMORY_BUDGET, FragmentReassembler
 from haproxyspoa.spoa_frame import Frame, AgentHelloFrame, FrameType
+from haproxyspoa.spoa_handlers import BatchHandler, ExecutorPools, Handler
+from haproxyspoa.spoa_metrics import MetricsEndpoint, SpoaMetrics
+from haproxyspoa.spoa_payloads import StringTable
+from haproxyspoa.spoa_protocol import SpoaProtocol
+from haproxyspoa.spoa_shared import SharedStore
+from haproxyspoa.spoa_supervisor import WorkerSupervisor
 
 import secrets
 
 
+DEFAULT_MAX_INFLIGHT_FRAMES = 64
+
+
 class SpoaConnection:
 
-    def __init__(self, writer: asyncio.StreamWriter, handlers):
-        self.logger = FlowIdLoggerAdapter(logger, {"flow_id": secrets.token_hex(4)})
+    def __init__(
+        self,
+        writer: asyncio.StreamWriter,
+        handlers,
+        pipelining: bool = False,
+        max_inflight_frames: int = DEFAULT_MAX_INFLIGHT_FRAMES,
+        fragmentation: bool = False,
+        fragment_memory_budget: int = DEFAULT_FRAGMENT_MEMORY_BUDGET,
+        max_frame_size: int = AgentHelloPayload.DEFAULT_MAX_FRAME_SIZE,
+        metrics: Optional[SpoaMetrics] = None,
+        notify_timeout: Optional[float] = None,
+        timeout_ack: Optional[AckPayload] = None,
+        partial_ack_on_timeout: bool = True,
+        admission: Optional[AdmissionController] = None,
+        log_sample_rate: float = 1.0,
+        strings: Optional[StringTable] = None,
+    ):
+        self.flow_id = secrets.token_hex(4)
+        self.logger = FlowIdLoggerAdapter(logger, {"flow_id": self.flow_id})
         self.handlers = handlers
+        self.metrics = metrics if metrics is not None else SpoaMetrics()
         self.writer = writer
+        self.pipelining = pipelining
+        # Bounds the number of NOTIFY frames being processed concurrently on this
+        #  connection when running in pipelined/async mode.  Once exhausted, we stop
+        #  reading from the socket until an in-flight frame has been acknowledged.
+        self.inflight = asyncio.Semaphore(max_inflight_frames)
+        self.pending_notifies = set()
+        self.inflight_count = 0
+        # Several ACKs may now be produced concurrently, so writes are serialized.
+        self.write_lock = asyncio.Lock()
+        self.fragments = FragmentReassembler(
+            memory_budget=fragment_memory_budget,
+            allow_interlacing=pipelining,
+        ) if fragmentation else None
+        # Starts out as the server's own limit, and is lowered to HAProxy's
+        #  during the hello handshake if that is smaller.
+        self.max_frame_size = max_frame_size
+        self.notify_timeout = notify_timeout
+        self.timeout_ack = timeout_ack
+        self.partial_ack_on_timeout = partial_ack_on_timeout
+        self.admission = admission if admission is not None else AdmissionController()
+        # Set when the agent shuts down: no further frame is read, and the connection is
+        #  closed once its pending NOTIFY frames are acknowledged.
+        self.draining = False
+        # Whether the connection is waiting for its next frame, and can be interrupted.
+        self.reading = False
+        self.log_sample_rate = log_sample_rate
+        self.strings = strings
 
-    async def handle_haproxy_notify(self, frame: Frame):
-        self.logger.debug("Incoming `notify` frame from HAProxy")
-        notify_payload = NotifyPayload(frame.payload)
+    def frame_logger(self, frame: Frame) -> Optional[FlowIdLoggerAdapter]:
+        """
+        Logger for the per-frame DEBUG logs of `frame`, carrying its stream and frame ids,
+        or None when DEBUG is disabled or the frame is not part of the logged sample.
+        """
+        if not logger.isEnabledFor(logging.DEBUG):
+            return None
+        if self.log_sample_rate < 1.0 and random.random() >= self.log_sample_rate:
+            return None
+        return FlowIdLoggerAdapter(logger, {
+            "flow_id": self.flow_id,
+            "stream_id": frame.headers.stream_id,
+            "frame_id": frame.headers.frame_id,
+        })
 
-        response_futures = []
-        for msg_key, msg_val in notify_payload.messages.items():
-            self.logger.info(f"Received request on key '{msg_key}'")
-            for handler in self.handlers[msg_key]:
-                response_futures.append(handler(**notify_payload.messages[msg_key]))
+    async def write_frame(self, frame: Frame):
+        async with self.write_lock:
+            size = await frame.write_frame(self.writer, self.max_frame_size)
+        self.metrics.frame_sent(frame.headers.type, size)
+
+    async def receive_haproxy_notify(self, frame: Frame):
+        """
+        Process a NOTIFY or FRAGMENT frame that may be part of a fragmented payload,
+        dispatching the reassembled NOTIFY once its last fragment arrives.
+        """
+        if self.fragments is not None:
+            frame = self.fragments.feed(frame)
+        elif not frame.headers.is_haproxy_notify():
+            # Fragmentation was not advertised, so HAProxy should never send these.
+            return
+        if frame is not None:
+            await self.dispatch_haproxy_notify(frame, asyncio.get_event_loop().time())
+
+    async def dispatch_haproxy_notify(self, frame: Frame, received_at: Optional[float] = None):
+        """
+        Process a NOTIFY frame according to the negotiated mode.  Without pipelining
+        the frame is handled to completion before returning.  With pipelining, the frame
+        is handed off to its own task and its ACK is written whenever it is ready, possibly
+        out of order; HAProxy matches it back up using the stream-id/frame-id.
+
+        Frames over the admission limits are acknowledged right away with the shed ACK.
+        """
+        if received_at is None:
+            received_at = asyncio.get_event_loop().time()
+        if not self.admission.try_admit(len(self.pending_notifies)):
+            await self.shed_haproxy_notify(frame, "inflight")
+            return
+
+        if not self.pipelining:
+            try:
+                await self.handle_haproxy_notify(frame, received_at)
+            finally:
+                self.admission.release()
+            return
+
+        try:
+            await self.inflight.acquire()
+        except BaseException:
+            self.admission.release()
+            raise
+        task = asyncio.ensure_future(self.handle_haproxy_notify(frame, received_at))
+        self.pending_notifies.add(task)
+        task.add_done_callback(self._on_notify_done)
+
+    def _on_notify_done(self, task: asyncio.Future):
+        self.pending_notifies.discard(task)
+        self.inflight.release()
+        self.admission.release()
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.error("Failed to process `notify` frame", exc_info=task.exception())
+
+    async def finish_pending_notifies(self):
+        while self.pending_notifies:
+            await asyncio.gather(*self.pending_notifies, return_exceptions=True)
+
+    async def cancel_pending_notifies(self):
+        for task in list(self.pending_notifies):
+            task.cancel()
+        if self.pending_notifies:
+            await asyncio.gather(*self.pending_notifies, return_exceptions=True)
+
+    async def handle_haproxy_notify(self, frame: Frame, received_at: Optional[float] = None):
+        loop = asyncio.get_event_loop()
+        if received_at is None:
+            received_at = loop.time()
+        if self.admission.should_shed_on_start(loop.time() - received_at):
+            await self.shed_haproxy_notify(frame, "queue_delay")
+            return
+
+        deadline = None
+        if self.notify_timeout is not None:
+            deadline = received_at + self.notify_timeout
+        self.inflight_count += 1
+        try:
+            await self._handle_haproxy_notify(frame, deadline)
+        finally:
+            self.inflight_count -= 1
 
-        self.logger.info(f"Found {len(response_futures)} matching handlers, awaiting response...")
-        ack_payloads = await asyncio.gather(*response_futures)
+    async def shed_haproxy_notify(self, frame: Frame, reason: str):
+        """Acknowledge a NOTIFY frame with the shed ACK, without running any handler."""
+        self.metrics.notify_shed[reason] += 1
+        frame_logger = self.frame_logger(frame)
+        if frame_logger is not None:
+            frame_logger.debug("Shedding `notify` frame (%s)", reason)
+        await self.write_frame(Frame(
+            frame_type=FrameType.ACK,
+            stream_id=frame.headers.stream_id,
+            frame_id=frame.headers.frame_id,
+            flags=1,
+            payload=self.admission.shed_payload,
+        ))
+
+    async def _handle_haproxy_notify(self, frame: Frame, deadline: Optional[float]):
+        frame_logger = self.frame_logger(frame)
+        parse_started = time.perf_counter()
+        notify_payload = NotifyPayload(frame.payload, wanted=self.handlers, strings=self.strings)
+        self.metrics.parse_seconds.observe(time.perf_counter() - parse_started)
+
+        ack_payloads, timed_out = await self._run_handlers(notify_payload, deadline, frame_logger)
+        if timed_out:
+            self.metrics.notify_timeouts += 1
+            if frame_logger is not None:
+                frame_logger.debug("Processing ran past its deadline")
+            if not self.partial_ack_on_timeout:
+                ack_payloads = []
+            if self.timeout_ack is not None:
+                ack_payloads.append(self.timeout_ack)
+
+        encode_started = time.perf_counter()
         ack = AckPayload.create_from_all(*ack_payloads)
-        payload = ack.to_bytes()
+        payload = ack.encode()
+        self.metrics.encode_seconds.observe(time.perf_counter() - encode_started)
 
-        self.logger.info(f"Responding with combined payload of {len(payload.getbuffer())} bytes")
+        if frame_logger is not None:
+            frame_logger.debug("Responding with combined payload of %d bytes", len(payload))
 
         ack_frame = Frame(
             frame_type=FrameType.ACK,
@@ -46,83 +232,589 @@ class SpoaConnection:
             flags=1,
             payload=payload
         )
-        await ack_frame.write_frame(self.writer)
+        try:
+            await self.write_frame(ack_frame)
+        except FrameTooBigError as e:
+            # Still acknowledge the frame so that HAProxy is not left waiting on it.
+            self.logger.error(
+                "Dropping the actions of ACK for stream %d: %s", frame.headers.stream_id, e,
+                extra={"stream_id": frame.headers.stream_id, "frame_id": frame.headers.frame_id},
+            )
+            ack_frame.payload = b""
+            await self.write_frame(ack_frame)
+
+    async def _run_handlers(
+        self,
+        notify_payload: NotifyPayload,
+        deadline: Optional[float],
+        frame_logger: Optional[FlowIdLoggerAdapter] = None,
+    ):
+        """
+        Run every handler matching the messages of a NOTIFY frame.  Returns the ACK
+        payloads of the handlers that completed, and whether any handler was cut short
+        by the frame's deadline or its own timeout.  Handlers still running once the
+        deadline passes are cancelled, since HAProxy no longer waits for their result.
+        A handler that raises is logged and contributes no actions, so the frame is
+        still acknowledged with the results of the others.
+        """
+        loop = asyncio.get_event_loop()
+        if deadline is not None and deadline <= loop.time():
+            # The frame already spent its whole budget waiting to be processed.
+            return [], True
+
+        tasks = []
+        for msg_key, msg_val in notify_payload.messages.items():
+            if frame_logger is not None:
+                frame_logger.debug("Received request on key '%s'", msg_key)
+            for handler in self.handlers[msg_key]:
+                try:
+                    invocation = handler.invoke(msg_val)
+                except Exception as e:
+                    self._log_handler_failure(msg_key, e)
+                    continue
+                tasks.append((msg_key, asyncio.ensure_future(invocation)))
+
+        if frame_logger is not None:
+            frame_logger.debug("Found %d matching handlers, awaiting response...", len(tasks))
+        if not tasks:
+            return [], False
+
+        timeout = None if deadline is None else deadline - loop.time()
+        try:
+            _, pending = await asyncio.wait([task for _, task in tasks], timeout=timeout)
+        except asyncio.CancelledError:
+            for _, task in tasks:
+                task.cancel()
+            raise
+        for task in pending:
+            task.cancel()
+
+        ack_payloads = []
+        timed_out = bool(pending)
+        for msg_key, task in tasks:
+            if task in pending:
+                self.metrics.handler_timed_out(msg_key)
+            elif isinstance(task.exception(), asyncio.TimeoutError):
+                timed_out = True
+                self.metrics.handler_timed_out(msg_key)
+            elif task.exception() is not None:
+                self._log_handler_failure(msg_key, task.exception())
+            else:
+                ack_payloads.append(task.result())
+        return ack_payloads, timed_out
 
-    async def send_agent_disconnect(self):
-        self.logger.info("Agent is now dropping connection")
+    def _log_handler_failure(self, msg_key: str, error: BaseException):
+        self.metrics.handler_failed(msg_key)
+        self.logger.error("Handler for message `%s` failed", msg_key, exc_info=error)
+
+    async def send_agent_disconnect(
+        self,
+        status_code: DisconnectStatusCode = DisconnectStatusCode.NORMAL,
+        message: str = "",
+    ):
+        self.logger.debug("Agent is now dropping connection")
         disconnect_frame = Frame(
             frame_type=FrameType.AGENT_DISCONNECT,
             flags=1,
             stream_id=0,
             frame_id=0,
-            payload=AgentDisconnectPayload().to_buffer()
+            payload=AgentDisconnectPayload(status_code, message).to_buffer()
         )
-        await disconnect_frame.write_frame(self.writer)
+        await self.write_frame(disconnect_frame)
 
     async def handle_haproxy_disconnect(self, frame: Frame):
         payload = HaproxyDisconnectPayload(frame.payload)
+        self.metrics.haproxy_disconnected(payload.status_code())
         if payload.status_code() != DisconnectStatusCode.NORMAL:
-            self.logger.info(f"Haproxy is disconnecting us with status code {payload.status_code()} - `{payload.message()}`")
+            self.logger.info(
+                "Haproxy is disconnecting us with status code %d - `%s`", payload.status_code(), payload.message()
+            )
+
+    async def handle_hello_handshake(self, frame: Frame) -> HaproxyHelloPayload:
+        haproxy_hello = HaproxyHelloPayload(frame.payload)
+
+        haproxy_max_frame_size = haproxy_hello.max_frame_size()
+        if haproxy_max_frame_size is None:
+            raise SpoaProtocolError(DisconnectStatusCode.MAX_FRAME_SIZE_VALUE_NOT_FOUND)
+        self.max_frame_size = min(self.max_frame_size, haproxy_max_frame_size)
+        if self.max_frame_size < AgentHelloPayload.MINIMUM_MAX_FRAME_SIZE:
+            raise SpoaProtocolError(
+                DisconnectStatusCode.MAX_FRAME_SIZE_TOO_BIG_OR_TOO_SMALL,
+                f"max-frame-size of {haproxy_max_frame_size} is below the minimum of "
+                f"{AgentHelloPayload.MINIMUM_MAX_FRAME_SIZE}",
+            )
+        if self.fragments is not None:
+            self.fragments.initial_capacity = self.max_frame_size
 
-    async def handle_hello_handshake(self, frame: Frame):
         capabilities = AgentCapabilities()
-        self.logger.info(f"Received `hello handshake`, responding with agent capabilities of: '{capabilities}'")
+        if self.pipelining:
+            capabilities.support_pipelining().support_async()
+        if self.fragments is not None:
+            capabilities.support_fragmentation()
+        self.logger.debug("Received `hello handshake`, responding with agent capabilities of: '%s'", capabilities)
         agent_hello_frame = AgentHelloFrame(
             payload=AgentHelloPayload(
+                max_frame_size=self.max_frame_size,
                 capabilities=capabilities,
             ),
             stream_id=frame.headers.stream_id,
             frame_id=frame.headers.frame_id,
         )
-        await agent_hello_frame.write_frame(self.writer)
+        await self.write_frame(agent_hello_frame)
+        return haproxy_hello
 
 
 class SpoaServer:
 
-    def __init__(self):
+    def __init__(
+        self,
+        pipelining: bool = False,
+        max_inflight_frames: int = DEFAULT_MAX_INFLIGHT_FRAMES,
+        transport: str = "stream",
+        fragmentation: bool = False,
+        fragment_memory_budget: int = DEFAULT_FRAGMENT_MEMORY_BUDGET,
+        max_frame_size: int = AgentHelloPayload.DEFAULT_MAX_FRAME_SIZE,
+        thread_workers: Optional[int] = None,
+        process_workers: Optional[int] = None,
+        metrics_port: Optional[int] = None,
+        metrics_host: str = "0.0.0.0",
+        notify_timeout: Optional[float] = None,
+        timeout_ack: Optional[AckPayload] = None,
+        partial_ack_on_timeout: bool = True,
+        max_inflight: Optional[int] = None,
+        max_connection_inflight: Optional[int] = None,
+        max_queue_delay: Optional[float] = None,
+        shed_ack: Optional[AckPayload] = None,
+        ip_decoding: str = IPDecoding.IPADDRESS,
+        string_decoding: str = StringDecoding.ASCII,
+        shutdown_timeout: float = 30.0,
+        reload_modules: Iterable[str] = (),
+        log_sample_rate: float = 1.0,
+    ):
+        """
+        :param pipelining: Advertise the `pipelining` and `async` capabilities and
+            process each NOTIFY frame in its own task, so a slow handler does not hold
+            up the other streams multiplexed over the same HAProxy connection.
+        :param max_inflight_frames: Upper bound on the NOTIFY frames concurrently being
+            processed on a single connection when pipelining is enabled.
+        :param transport: Either `"stream"` to use asyncio streams, or `"protocol"` to use
+            the lower overhead `SpoaProtocol`, which batches frame reads and writes.
+        :param fragmentation: Advertise the `fragmentation` capability, allowing HAProxy to
+            split large NOTIFY payloads over several frames.  Handlers always receive the
+            reassembled payload.
+        :param fragment_memory_budget: Maximum number of bytes a single connection may
+            hold in partially reassembled payloads.
+        :param max_frame_size: Largest frame the agent accepts or sends.  The effective limit
+            of each connection is the smaller of this and the value HAProxy announces in its
+            hello; `AgentHelloPayload.GENEROUS_MAX_FRAME_SIZE` allows larger batches per frame.
+        :param thread_workers: Size of the pool running `executor="thread"` handlers.
+        :param process_workers: Size of the pool running `executor="process"` handlers.
+        :param metrics_port: Serve the metrics collected in `self.metrics` over HTTP on this
+            port, in the Prometheus text format.  With several workers, worker `i` serves
+            its own metrics on `metrics_port + i`.
+        :param metrics_host: Address the metrics endpoint binds to.
+        :param notify_timeout: Deadline, in seconds from its arrival, for processing a NOTIFY
+            frame.  Match it to the `timeout processing` of the SPOE agent: past it, HAProxy
+            has given up on the frame, so the handlers still running are cancelled and
+            the frame is acknowledged right away.
+        :param timeout_ack: Actions added to the ACK of a frame that ran past its deadline,
+            e.g. `AckPayload().set_txn_var("timeout", True)`.
+        :param partial_ack_on_timeout: Whether the ACK of a frame that ran past its deadline
+            keeps the actions of the handlers that did complete.  If not, only `timeout_ack`
+            is sent.
+        :param max_inflight: Upper bound on the NOTIFY frames being processed across all
+            connections of the worker.  Frames past it are shed rather than queued.
+        :param max_connection_inflight: Upper bound on the NOTIFY frames being processed on a
+            single connection before further frames are shed.  Unlike `max_inflight_frames`,
+            which stops reading from the connection, this answers HAProxy right away.
+        :param max_queue_delay: Shed a NOTIFY frame that waited longer than this many seconds,
+            after being read, for its processing to start.
+        :param shed_ack: ACK sent for shed frames, `AckPayload().set_txn_var("shed", 1)` by
+            default, so that the SPOE rules can decide to fail open or closed on `txn.<var-prefix>.shed`.
+        :param ip_decoding: How IPV4/IPV6 arguments are decoded for handler parameters without
+            a more specific annotation, one of `IPDecoding`.  `"compact"` gives `PackedAddress`
+            objects, much cheaper than `ipaddress` ones when the address is only used as a key.
+        :param string_decoding: How string arguments are decoded for handler parameters not
+            annotated `bytes` or `memoryview`, one of `StringDecoding`.  The default, `"ascii"`,
+            fails on the non-ASCII bytes some clients send in headers.
+        :param shutdown_timeout: On SIGTERM/SIGINT, the agent stops accepting connections and
+            waits this many seconds for the in-flight NOTIFY frames to be acknowledged, before
+            disconnecting from HAProxy.
+        :param reload_modules: Names of the modules registering handlers, reloaded on SIGHUP,
+            see `reload`.
+        :param log_sample_rate: Fraction of the NOTIFY frames whose per-frame DEBUG logs are
+            written.  These logs are skipped entirely unless the DEBUG level is enabled.
+        """
+        if max_inflight_frames < 1:
+            raise ValueError("max_inflight_frames must be at least 1")
+        if transport not in ("stream", "protocol"):
+            raise ValueError(f"Unknown transport `{transport}`, expected `stream` or `protocol`")
+        if ip_decoding not in IPDecoding.ALL:
+            raise ValueError(f"Unknown IP decoding `{ip_decoding}`, expected one of {', '.join(IPDecoding.ALL)}")
+        if string_decoding not in StringDecoding.ALL:
+            raise ValueError(
+                f"Unknown string decoding `{string_decoding}`, expected one of {', '.join(StringDecoding.ALL)}"
+            )
+        if max_frame_size < AgentHelloPayload.MINIMUM_MAX_FRAME_SIZE:
+            raise ValueError(f"max_frame_size must be at least {AgentHelloPayload.MINIMUM_MAX_FRAME_SIZE}")
+        if not 0.0 <= log_sample_rate <= 1.0:
+            raise ValueError("log_sample_rate must be between 0 and 1")
         self.handlers = defaultdict(list)
+        # Message names and argument keys, filled as handlers are registered.
+        self.strings = StringTable()
+        self.pipelining = pipelining
+        self.max_inflight_frames = max_inflight_frames
+        self.transport = transport
+        self.fragmentation = fragmentation
+        self.fragment_memory_budget = fragment_memory_budget
+        self.max_frame_size = max_frame_size
+        self.pools = ExecutorPools(thread_workers=thread_workers, process_workers=process_workers)
+        self.metrics = SpoaMetrics()
+        self.metrics_port = metrics_port
+        self.metrics_host = metrics_host
+        self.notify_timeout = notify_timeout
+        self.timeout_ack = timeout_ack.freeze() if timeout_ack is not None else None
+        self.partial_ack_on_timeout = partial_ack_on_timeout
+        self.ip_decoding = ip_decoding
+        self.string_decoding = string_decoding
+        self.admission = AdmissionController(
+            max_inflight=max_inflight,
+            max_connection_inflight=max_connection_inflight,
+            max_queue_delay=max_queue_delay,
+            shed_ack=shed_ack,
+        )
+        self.shutdown_timeout = shutdown_timeout
+        self.reload_modules = list(reload_modules)
+        self.reload_hooks = []
+        # Open connections -> the task serving each of them.
+        self.connections: Dict[SpoaConnection, asyncio.Task] = {}
+        self.log_sample_rate = log_sample_rate
+        self.backend_pools: List[BackendPool] = []
 
-    def handler(self, message_key: str):
+    def handler(
+        self,
+        message_key: str,
+        executor: Optional[str] = None,
+        concurrency: Optional[int] = None,
+        cache: Optional[TTLCache] = None,
+        timeout: Optional[float] = None,
+    ):
+        """
+        Register a handler for the SPOE message `message_key`.
+
+        :param executor: Where the handler runs, one of `HandlerExecutor`.  Coroutine
+            functions always run on the event loop.  Plain functions default to
+            `"thread"`, so blocking calls do not stall the loop; use `"process"` for
+            CPU-bound work (the function and its return value must be picklable), or
+            `"inline"` for cheap functions that are fine to call on the loop.
+        :param concurrency: Maximum number of concurrent invocations of this handler.
+        :param cache: Cache the serialized `AckPayload` returned by the handler, keyed on
+            the message arguments.  Concurrent calls with the same arguments share one
+            handler invocation.  Hit/miss counters are available from `cache.stats()`.
+        :param timeout: Seconds after which this handler is abandoned.  The ACK is then
+            built as if the frame's deadline had passed, see `notify_timeout`.
+        """
         def _handler(fn):
-            @functools.wraps(fn)
-            def wrapper(*args, **kwargs):
-                return fn(*args, **kwargs)
-            self.handlers[message_key].append(wrapper)
-            return wrapper
+            self._add_handler(message_key, Handler(
+                fn,
+                self.pools,
+                executor=executor,
+                concurrency=concurrency,
+                cache=cache,
+                timeout=timeout,
+                latency=self.metrics.handler_histogram(message_key),
+                ip_decoding=self.ip_decoding,
+                string_decoding=self.string_decoding,
+            ))
+            return fn
         return _handler
 
+    def batch_handler(
+        self,
+        message_key: str,
+        max_batch: int = 256,
+        max_wait: float = 0.001,
+        timeout: Optional[float] = None,
+    ):
+        """
+        Register a handler for the SPOE message `message_key` that processes the messages
+        of concurrent NOTIFY frames together, e.g. with a single round trip to a backend:
+
+            @agent.batch_handler("check-ip", max_batch=256, max_wait=0.001)
+            async def check_ip(batch: List[dict]) -> List[AckPayload]: ...
+
+        Each dict holds the arguments of one message.  The function runs on the event loop.
+
+        :param max_batch: Largest number of messages passed in a single call.
+        :param max_wait: Seconds a message may wait for a batch to fill up.
+        :param timeout: Seconds after which a message is abandoned, see `handler`.
+        """
+        def _handler(fn):
+            self._add_handler(message_key, BatchHandler(
+                fn,
+                max_batch=max_batch,
+                max_wait=max_wait,
+                timeout=timeout,
+                latency=self.metrics.handler_histogram(message_key),
+                ip_decoding=self.ip_decoding,
+                string_decoding=self.string_decoding,
+            ))
+            return fn
+        return _handler
+
+    def _add_handler(self, message_key: str, handler: Union[Handler, BatchHandler]):
+        # Keyed by the interned name, the very object the parsed frames hold, so that
+        #  dispatching a message compares by identity.
+        message_key = sys.intern(message_key)
+        self.strings.add(message_key, *handler.schema.converters)
+        self.handlers[message_key].append(handler)
+
+    def backend_pool(self, connect: Callable[[], Awaitable[BackendConnection]], **kwargs) -> BackendPool:
+        """
+        Create a `BackendPool` of connections to an external store, for the handlers to
+        share.  Its connections are opened when the agent starts, and closed once it has
+        shut down.  Keyword arguments are passed on to `BackendPool`.
+
+            store = agent.backend_pool(connect_to_store, max_connections=4, pipelining=32, timeout=0.05)
+
+            @agent.handler("check")
+            async def check(src: str):
+                return AckPayload().set_txn_var("score", await store.call(("GET", src)))
+        """
+        pool = BackendPool(connect, **kwargs)
+        self.backend_pools.append(pool)
+        return pool
+
+    def shared_store(self, **kwargs) -> SharedStore:
+        """
+        Create a `SharedStore`, whose state every connection and worker process of the
+        agent shares.  Call it before `run`, so that the workers inherit it.  Keyword
+        arguments are passed on to `SharedStore`.
+
+            counters = agent.shared_store(slots=1 << 20, key_size=16, value_size=0)
+
+            @agent.handler("count-requests")
+            async def count_requests(src: bytes):
+                return AckPayload().set_txn_var("requests", counters.incr(src, ttl=60))
+        """
+        return SharedStore(**kwargs)
+
+    def on_reload(self, fn: Callable):
+        """
+        Register a function, plain or coroutine, called by `reload` once the handler modules
+        are reloaded, e.g. to load fresh copies of the data shared by the handlers.
+        """
+        self.reload_hooks.append(fn)
+        return fn
+
+    async def reload(self, *modules: Union[str, ModuleType]):
+        """
+        Reload the given handler modules and run the `on_reload` hooks, while connections
+        stay open.  The handlers registered by these modules are replaced by the ones they
+        register once reloaded; frames already being processed finish with the previous
+        handlers.  If a module fails to reload, the previous handlers are kept.
+        """
+        modules = [importlib.import_module(m) if isinstance(m, str) else m for m in modules]
+        names = {module.__name__ for module in modules}
+
+        previous = self.handlers
+        self.handlers = defaultdict(list)
+        for message_key, handlers in previous.items():
+            kept = [handler for handler in handlers if handler.fn.__module__ not in names]
+            if kept:
+                self.handlers[message_key] = kept
+        try:
+            for module in modules:
+                importlib.reload(module)
+        except BaseException:
+            self.handlers = previous
+            raise
+
+        for conn in self.connections:
+            conn.handlers = self.handlers
+        if modules:
+            # Process pool workers hold the previous version of the modules.
+            self.pools.shutdown(wait=False)
+            logger.info(f"Reloaded handlers from {', '.join(sorted(names))}")
+
+        for hook in self.reload_hooks:
+            result = hook()
+            if asyncio.iscoroutine(result):
+                await result
+
+    async def _reload_on_signal(self):
+        try:
+            await self.reload(*self.reload_modules)
+        except Exception:
+            logger.exception("Reload failed, keeping the current handlers")
+
+    async def shutdown(self, timeout: Optional[float] = None):
+        """
+        Gracefully close every connection: stop reading frames, wait for the NOTIFY frames
+        being processed to be acknowledged, then send HAProxy a NORMAL disconnect.  After
+        `timeout` seconds, connections still busy are closed without waiting further.
+        """
+        for conn, task in self.connections.items():
+            conn.draining = True
+            if conn.reading:
+                task.cancel()
+        tasks = list(self.connections.values())
+        if not tasks:
+            return
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"Closing {len(pending)} connections still busy after the shutdown timeout")
+            await asyncio.wait(pending)
+
     async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
-        conn = SpoaConnection(writer, self.handlers)
+        await self.serve_connection(functools.partial(Frame.read_frame, reader), writer)
+
+    async def handle_protocol_connection(self, protocol: SpoaProtocol):
+        await self.serve_connection(protocol.read_frame, protocol)
+
+    async def serve_connection(self, read_frame: Callable[[int], Awaitable[Frame]], writer):
+        """
+        Drive a single HAProxy connection.  `read_frame` yields the next inbound frame,
+        rejecting it if it exceeds the max-frame-size it is called with, and `writer` is
+        anything providing the StreamWriter `write`/`drain`/`close` calls, which lets the
+        stream based and protocol based transports share this logic.
+        """
+        conn = SpoaConnection(
+            writer,
+            self.handlers,
+            pipelining=self.pipelining,
+            max_inflight_frames=self.max_inflight_frames,
+            fragmentation=self.fragmentation,
+            fragment_memory_budget=self.fragment_memory_budget,
+            max_frame_size=self.max_frame_size,
+            metrics=self.metrics,
+            notify_timeout=self.notify_timeout,
+            timeout_ack=self.timeout_ack,
+            partial_ack_on_timeout=self.partial_ack_on_timeout,
+            admission=self.admission,
+            log_sample_rate=self.log_sample_rate,
+            strings=self.strings,
+        )
+
+        self.metrics.connection_opened(conn)
+        self.connections[conn] = asyncio.current_task()
+        try:
+            try:
+                await self._serve_frames(conn, read_frame)
+            except asyncio.CancelledError:
+                # Interrupted while waiting for a frame, by `shutdown`.
+                if not conn.draining:
+                    raise
+            if conn.draining:
+                await conn.finish_pending_notifies()
+                await conn.send_agent_disconnect(DisconnectStatusCode.NORMAL, "Agent is shutting down")
+        except SpoaProtocolError as e:
+            conn.logger.error("Terminating connection: %s", e)
+            await conn.send_agent_disconnect(e.status_code, e.message)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            conn.logger.debug("HAProxy closed the connection")
+        finally:
+            del self.connections[conn]
+            self.metrics.connection_closed(conn)
+            await conn.cancel_pending_notifies()
+            writer.close()
 
-        haproxy_hello_frame = await Frame.read_frame(reader)
+    async def _serve_frames(self, conn: SpoaConnection, read_frame: Callable[[int], Awaitable[Frame]]):
+        async def next_frame() -> Frame:
+            conn.reading = True
+            try:
+                frame = await read_frame(conn.max_frame_size)
+            finally:
+                conn.reading = False
+            conn.metrics.frame_received(frame.headers.type, frame.size)
+            return frame
+
+        haproxy_hello_frame = await next_frame()
 
         if not haproxy_hello_frame.headers.is_haproxy_hello():
-            conn.logger.error(f"""
-                Expected a `hello` frame from HAProxy,
-                but received unexpected frame of type {haproxy_hello_frame.headers.frame_type}
-            """.strip())
+            conn.logger.error(
+                "Expected a `hello` frame from HAProxy, but received unexpected frame of type %d",
+                haproxy_hello_frame.headers.type,
+            )
             await conn.send_agent_disconnect()
             return
-        await conn.handle_hello_handshake(haproxy_hello_frame)
+        haproxy_hello = await conn.handle_hello_handshake(haproxy_hello_frame)
 
-        if HaproxyHelloPayload(haproxy_hello_frame.payload).healthcheck():
-            conn.logger.info("Health check, immediately disconnecting")
+        if haproxy_hello.healthcheck():
+            conn.logger.debug("Health check, immediately disconnecting")
             return
 
-        while True:
-            frame = await Frame.read_frame(reader)
+        while not conn.draining:
+            frame = await next_frame()
 
             if frame.headers.is_haproxy_disconnect():
                 await conn.handle_haproxy_disconnect(frame)
                 await conn.send_agent_disconnect()
                 return
-            elif frame.headers.is_haproxy_notify():
-                await conn.handle_haproxy_notify(frame)
+            elif frame.headers.is_haproxy_notify() or frame.headers.is_fragmented_or_unset():
+                await conn.receive_haproxy_notify(frame)
+
+    async def _start_server(self, host: str, port: int, reuse_port: bool = False):
+        if self.transport == "protocol":
+            loop = asyncio.get_event_loop()
+            return await loop.create_server(
+                lambda: SpoaProtocol(self.handle_protocol_connection),
+                host=host,
+                port=port,
+                reuse_port=reuse_port or None,
+            )
+        return await asyncio.start_server(self.handle_connection, host=host, port=port, reuse_port=reuse_port or None)
+
+    async def _run(self, host: str = "0.0.0.0", port: int = 9002, reuse_port: bool = False, worker_index: int = 0):
+        metrics_endpoint = MetricsEndpoint(self.metrics)
+        if self.metrics_port is not None:
+            await metrics_endpoint.start(self.metrics_host, self.metrics_port + worker_index)
+
+        loop = asyncio.get_event_loop()
+        stopping = asyncio.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stopping.set)
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(self._reload_on_signal()))
+
+        server = None
+        try:
+            for pool in self.backend_pools:
+                await pool.start()
+            server = await self._start_server(host, port, reuse_port=reuse_port)
+            logger.info(f"HAProxy SPO Agent listening at {host}:{port}")
+            await stopping.wait()
+            logger.info("Shutting down, no longer accepting connections")
+            server.close()
+            await self.shutdown(self.shutdown_timeout)
+            await server.wait_closed()
+        finally:
+            if server is not None:
+                server.close()
+            for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                loop.remove_signal_handler(signum)
+            for pool in self.backend_pools:
+                await pool.close()
+            metrics_endpoint.close()
+            self.pools.shutdown(wait=False)
+
+    def run(self, host: str = "0.0.0.0", port: int = 9002, workers: int = 1):
+        """
+        :param workers: Number of processes to serve from.  With more than one worker,
+            the agent forks `workers` processes that each bind `host:port` with
+            SO_REUSEPORT and run their own event loop, and the calling process supervises
+            them, restarting crashed workers and forwarding SIGTERM and SIGHUP.  Handlers
+            must be registered before calling `run`.
+
+        SIGTERM and SIGINT shut the agent down gracefully, see `shutdown`, and SIGHUP
+        reloads the `reload_modules`.
+        """
+        if workers == 1:
+            asyncio.run(self._run(host, port))
+            return
 
-    async def _run(self, host: str = "0.0.0.0", port: int = 9002):
-        server = await asyncio.start_server(self.handle_connection, host=host, port=port, )
-        logger.info(f"HAProxy SPO Agent listening at {host}:{port}")
-        await server.serve_forever()
+        WorkerSupervisor(functools.partial(self._run_worker, host, port), workers).run()
 
-    def run(self, *args, **kwargs):
-        asyncio.run(self._run(*args, **kwargs))
+    def _run_worker(self, host: str, port: int, worker_index: int):
+        asyncio.run(self._run(host, port, reuse_port=True, worker_index=worker_index))
@@ -0,0 +1,254 @@
+import mmap
+import multiprocessing
+import time
+from typing import Any, Optional, Union
+
+Key = Union[str, bytes, bytearray, memoryview]
+Value = Union[int, str, bytes]
+
+# Type of the value held by a slot, in its `meta` column.
+_INT = 0
+_BYTES = 1
+_STR = 2
+
+_MAX_KEY_SIZE = 255
+_MAX_VALUE_SIZE = 65535
+
+
+def _key_bytes(key: Key) -> bytes:
+    if isinstance(key, str):
+        return key.encode("utf-8")
+    return bytes(key)
+
+
+_HASH_MASK = (1 << 64) - 1
+
+
+class SharedStore:
+    """
+    Key/value and counter store in shared memory, for state such as per-source
+    counters or reputation scores that every connection and every worker process of an
+    agent sees, at the cost of a few microseconds per operation.
+
+    The store is a fixed-size hash table in an anonymous shared mapping: create it
+    before the worker processes are forked, e.g. with `SpoaServer.shared_store`, and
+    its memory footprint never grows.  The table is split into `stripes`, each guarded
+    by its own inter-process lock, and a key lives in one of `probes` slots of its
+    stripe.  When these are all taken by other keys, the entry expiring first is
+    evicted to make room, so the store behaves as a bounded cache.
+
+    Keys are strings or bytes of up to `key_size` bytes, values are integers or strings
+    or bytes of up to `value_size` bytes.
+    """
+
+    def __init__(
+        self,
+        slots: int = 65536,
+        key_size: int = 64,
+        value_size: int = 64,
+        stripes: int = 64,
+        probes: int = 8,
+    ):
+        if stripes < 1 or slots < stripes:
+            raise ValueError("slots must be at least the number of stripes, itself at least 1")
+        if not 1 <= key_size <= _MAX_KEY_SIZE:
+            raise ValueError(f"key_size must be between 1 and {_MAX_KEY_SIZE}")
+        if not 0 <= value_size <= _MAX_VALUE_SIZE:
+            raise ValueError(f"value_size must be between 0 and {_MAX_VALUE_SIZE}")
+
+        self.stripe_slots = slots // stripes
+        self.stripes = stripes
+        self.slots = self.stripe_slots * stripes
+        self.key_size = key_size
+        self.value_size = value_size
+        self.probes = max(1, min(probes, self.stripe_slots))
+        self.locks = [multiprocessing.Lock() for _ in range(stripes)]
+        # Entries evicted by this process to make room for new keys.
+        self.evictions = 0
+
+        # Fixed-width columns first, so that each of them stays aligned.
+        self.size = self.slots * (8 + 8 + 8 + 4 + key_size + value_size)
+        self.memory = mmap.mmap(-1, self.size)
+        view = memoryview(self.memory)
+        offset = 0
+
+        def column(width: int, typecode: Optional[str] = None):
+            nonlocal offset
+            chunk = view[offset:offset + self.slots * width]
+            offset += self.slots * width
+            return chunk.cast(typecode) if typecode is not None else chunk
+
+        # Key hashes, 0 for an empty slot.
+        self.hashes = column(8, "Q")
+        # Expiry on the `time.monotonic` clock, shared by all processes; 0 for none.
+        self.expires = column(8, "d")
+        self.numbers = column(8, "q")
+        # Key length | value type << 8 | value length << 16.
+        self.meta = column(4, "I")
+        self.keys_offset = offset
+        self.keys = column(key_size)
+        self.values = column(value_size)
+
+    def _is_live(self, slot: int, now: float) -> bool:
+        if self.hashes[slot] == 0:
+            return False
+        expires = self.expires[slot]
+        return expires == 0.0 or expires > now
+
+    def _window(self, key_hash: int) -> range:
+        """
+        Positions, within the stripe of the key, of the slots where it may live, starting
+        with its home slot.  Wrap them with `% self.stripe_slots`.
+        """
+        home = (key_hash // self.stripes) % self.stripe_slots
+        return range(home, home + self.probes)
+
+    def _find(self, key: bytes, key_hash: int, base: int, now: float) -> int:
+        """The slot holding the live entry for the key, or -1.  Call with the stripe locked."""
+        hashes = self.hashes
+        stripe_slots = self.stripe_slots
+        for position in self._window(key_hash):
+            slot = base + position % stripe_slots
+            if hashes[slot] == key_hash:
+                start = self.keys_offset + slot * self.key_size
+                # Slicing the mapping compares faster than slicing `self.keys`.
+                if self.memory[start:start + (self.meta[slot] & 0xFF)] == key:
+                    expires = self.expires[slot]
+                    if expires == 0.0 or expires > now:
+                        return slot
+        return -1
+
+    def _claim(self, key: bytes, key_hash: int, base: int, now: float) -> int:
+        """A slot for a new entry, evicting another one if needed.  Call with the stripe locked."""
+        victim = -1
+        victim_expires = float("inf")
+        for position in self._window(key_hash):
+            slot = base + position % self.stripe_slots
+            if not self._is_live(slot, now):
+                victim = slot
+                break
+            expires = self.expires[slot] or float("inf")
+            if victim < 0 or expires < victim_expires:
+                victim, victim_expires = slot, expires
+        else:
+            self.evictions += 1
+
+        start = victim * self.key_size
+        self.keys[start:start + len(key)] = key
+        self.hashes[victim] = key_hash
+        self.meta[victim] = len(key)
+        return victim
+
+    def _write(self, slot: int, value: Value):
+        key_length = self.meta[slot] & 0xFF
+        if isinstance(value, int) and not isinstance(value, bool):
+            self.numbers[slot] = value
+            self.meta[slot] = key_length | _INT << 8
+            return
+        if isinstance(value, str):
+            kind, value = _STR, value.encode("utf-8")
+        else:
+            kind, value = _BYTES, bytes(value)
+        start = slot * self.value_size
+        self.values[start:start + len(value)] = value
+        self.meta[slot] = key_length | kind << 8 | len(value) << 16
+
+    def _read(self, slot: int) -> Value:
+        meta = self.meta[slot]
+        kind = (meta >> 8) & 0xFF
+        if kind == _INT:
+            return self.numbers[slot]
+        start = slot * self.value_size
+        value = self.values[start:start + (meta >> 16)].tobytes()
+        return value.decode("utf-8") if kind == _STR else value
+
+    def _prepare(self, key: Key):
+        """The key as bytes, its hash, and the lock and first slot of its stripe."""
+        key = _key_bytes(key)
+        if len(key) > self.key_size:
+            raise ValueError(f"Key of {len(key)} bytes exceeds the key size of {self.key_size}")
+        # The store is only shared with forked processes, which share the salt of the
+        #  built-in hash.  Zero marks empty slots.
+        key_hash = hash(key) & _HASH_MASK or 1
+        stripe = key_hash % self.stripes
+        return key, key_hash, self.locks[stripe], stripe * self.stripe_slots
+
+    def _check_value(self, value: Value):
+        if isinstance(value, int) and not isinstance(value, bool):
+            if not -2 ** 63 <= value < 2 ** 63:
+                raise OverflowError("Integer values must fit in 64-bit signed integers")
+            return
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        elif not isinstance(value, (bytes, bytearray, memoryview)):
+            raise TypeError(f"Unsupported value of type {type(value).__name__}, expected int, str or bytes")
+        if len(value) > self.value_size:
+            raise ValueError(f"Value of {len(value)} bytes exceeds the value size of {self.value_size}")
+
+    def get(self, key: Key, default: Any = None) -> Any:
+        key, key_hash, lock, base = self._prepare(key)
+        with lock:
+            slot = self._find(key, key_hash, base, time.monotonic())
+            if slot < 0:
+                return default
+            return self._read(slot)
+
+    def set(self, key: Key, value: Value, ttl: Optional[float] = None):
+        """Store `value`, expiring after `ttl` seconds if given."""
+        self._check_value(value)
+        key, key_hash, lock, base = self._prepare(key)
+        with lock:
+            now = time.monotonic()
+            slot = self._find(key, key_hash, base, now)
+            if slot < 0:
+                slot = self._claim(key, key_hash, base, now)
+            self._write(slot, value)
+            self.expires[slot] = now + ttl if ttl is not None else 0.0
+
+    def incr(self, key: Key, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """
+        Atomically add `amount` to the integer stored at `key`, starting from 0, and
+        return the new value.  `ttl` applies when the counter is created, so that it
+        counts over a fixed window.  Values wrap to 64-bit signed integers.
+        """
+        key, key_hash, lock, base = self._prepare(key)
+        with lock:
+            now = time.monotonic()
+            slot = self._find(key, key_hash, base, now)
+            if slot < 0:
+                slot = self._claim(key, key_hash, base, now)
+                value = amount
+                self.expires[slot] = now + ttl if ttl is not None else 0.0
+            elif (self.meta[slot] >> 8) & 0xFF != _INT:
+                raise TypeError(f"Value at {key!r} is not an integer")
+            else:
+                value = self.numbers[slot] + amount
+            value = (value + 2 ** 63) % 2 ** 64 - 2 ** 63
+            self._write(slot, value)
+            return value
+
+    def delete(self, key: Key) -> bool:
+        key, key_hash, lock, base = self._prepare(key)
+        with lock:
+            slot = self._find(key, key_hash, base, time.monotonic())
+            if slot < 0:
+                return False
+            self.hashes[slot] = 0
+            return True
+
+    def __contains__(self, key: Key) -> bool:
+        key, key_hash, lock, base = self._prepare(key)
+        with lock:
+            return self._find(key, key_hash, base, time.monotonic()) >= 0
+
+    def __len__(self):
+        """Number of live entries, counted by scanning the whole table."""
+        now = time.monotonic()
+        return sum(1 for slot in range(self.slots) if self._is_live(slot, now))
+
+    def clear(self):
+        for stripe, lock in enumerate(self.locks):
+            with lock:
+                start = stripe * self.stripe_slots
+                for slot in range(start, start + self.stripe_slots):
+                    self.hashes[slot] = 0
@@ -0,0 +1,110 @@
+import os
+import signal
+import socket
+import time
+from typing import Callable, Dict, Tuple
+
+from haproxyspoa.logging import logger, stop_logging
+
+
+class WorkerSupervisor:
+    """
+    Runs `target` in `workers` forked processes and keeps them alive.
+
+    Each worker is expected to bind its own listening socket with SO_REUSEPORT, so the
+    kernel balances incoming HAProxy connections between them.  Workers that exit
+    unexpectedly are restarted, while SIGTERM/SIGINT received by the supervisor are
+    forwarded to every worker before waiting for them to exit.  SIGHUP is forwarded too,
+    so that every worker reloads its handlers, see `SpoaServer.reload`.
+
+    `target` is called with the index of the worker, from 0 to `workers - 1`; a
+    restarted worker reuses the index of the one it replaces.
+
+    Because workers are forked, everything set up before `run` is called, such as the
+    handlers registered through `SpoaServer.handler`, is inherited by every worker.
+    """
+
+    def __init__(self, target: Callable[[int], None], workers: int, restart_delay: float = 1.0):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        if not hasattr(os, "fork"):
+            raise RuntimeError("Multi-process workers require os.fork, which is unavailable on this platform")
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise RuntimeError("Multi-process workers require SO_REUSEPORT, which is unavailable on this platform")
+
+        self.target = target
+        self.workers = workers
+        self.restart_delay = restart_delay
+        # Worker pid -> (worker index, start time)
+        self.children: Dict[int, Tuple[int, float]] = {}
+        self.stopping = False
+
+    def _spawn(self, index: int):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGHUP, signal.SIG_DFL)
+            exit_code = 0
+            try:
+                self.target(index)
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                logger.exception(f"Worker {os.getpid()} crashed")
+                exit_code = 1
+            finally:
+                # os._exit skips the atexit handlers, which flush the logs.
+                stop_logging()
+                os._exit(exit_code)
+
+        self.children[pid] = (index, time.monotonic())
+        logger.info(f"Started worker {pid}")
+
+    def _forward_signal(self, signum, _frame):
+        if signum == signal.SIGHUP:
+            forwarded = signal.SIGHUP
+        else:
+            self.stopping = True
+            forwarded = signal.SIGTERM
+        for pid in list(self.children):
+            try:
+                os.kill(pid, forwarded)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        previous_handlers = {
+            signum: signal.signal(signum, self._forward_signal)
+            for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP)
+        }
+        try:
+            for index in range(self.workers):
+                self._spawn(index)
+
+            while self.children:
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
+                    break
+
+                child = self.children.pop(pid, None)
+                if child is None or self.stopping:
+                    continue
+                index, started_at = child
+
+                logger.error(f"Worker {pid} exited unexpectedly ({_describe_status(status)}), restarting")
+                # Avoid spinning if a worker crashes right after starting.
+                if time.monotonic() - started_at < self.restart_delay:
+                    time.sleep(self.restart_delay)
+                if not self.stopping:
+                    self._spawn(index)
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+
+def _describe_status(status: int) -> str:
+    if os.WIFSIGNALED(status):
+        return f"killed by signal {os.WTERMSIG(status)}"
+    return f"exit code {os.WEXITSTATUS(status)}"
@@ -1,5 +1,5 @@
 import pathlib
-from setuptools import setup, find_packages
+from setuptools import Extension, setup, find_packages
 
 README = (pathlib.Path(__file__).parent / "README.md").read_text()
 
@@ -24,7 +24,11 @@ setup(
         "Topic :: Internet :: WWW/HTTP",
         "Framework :: AsyncIO",
     ],
-    packages=find_packages(exclude=("example", "tests")),
+    packages=find_packages(exclude=("example", "tests", "benchmarks", "benchmarks.*")),
     # include_package_data=True,
     install_requires=[],
+    # Falls back to the pure-Python codec when no compiler is available.
+    ext_modules=[
+        Extension("haproxyspoa._speedups", sources=["haproxyspoa/_speedups.c"], optional=True),
+    ],
 )
@@ -0,0 +1,33 @@
+import unittest
+
+from haproxyspoa.payloads.ack import AckPayload, ActionVarScope
+
+
+class TestAckEncoding(unittest.TestCase):
+
+    def test_set_var_encoding(self):
+        ack = AckPayload().set_txn_var("score", 5).set_var(ActionVarScope.SESSION, "name", "abc")
+        self.assertEqual(
+            bytes(ack.encode()),
+            b'\x01\x03\x02\x05score\x04\x05'
+            b'\x01\x03\x01\x04name\x08\x03abc',
+        )
+        self.assertEqual(ack.to_bytes().getvalue(), bytes(ack.encode()))
+
+    def test_template_matches_regular_payload(self):
+        template = AckPayload.template().set_txn_var("blocked").set_var(ActionVarScope.REQUEST, "score")
+        expected = AckPayload().set_txn_var("blocked", "yes").set_var(ActionVarScope.REQUEST, "score", 12)
+
+        self.assertEqual(template.fill("yes", 12).encode(), expected.encode())
+        with self.assertRaises(ValueError):
+            template.fill("yes")
+
+    def test_frozen_payloads_combine(self):
+        frozen = AckPayload().set_txn_var("a", 1).freeze()
+        combined = AckPayload.create_from_all(frozen, AckPayload().set_txn_var("b", 2))
+        expected = AckPayload().set_txn_var("a", 1).set_txn_var("b", 2)
+        self.assertEqual(combined.encode(), expected.encode())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import asyncio
+import unittest
+
+from haproxyspoa.spoa_backends import BackendConnection, BackendPool, FakeBackend, PipelinedStreamConnection
+
+
+class TestBackendPool(unittest.IsolatedAsyncioTestCase):
+
+    async def pool(self, backend: FakeBackend, **kwargs) -> BackendPool:
+        pool = BackendPool(backend.connect, **kwargs)
+        await pool.start()
+        self.addAsyncCleanup(pool.close)
+        return pool
+
+    async def test_pipelined_calls_share_connections(self):
+        backend = FakeBackend(latency=0.01)
+        pool = await self.pool(backend, max_connections=4, pipelining=8)
+        await asyncio.gather(*(pool.call(("INCR", "hits")) for _ in range(16)))
+        self.assertEqual(backend.data["hits"], 16)
+        self.assertEqual(backend.connections_opened, 2)
+
+    async def test_calls_wait_past_max_connections(self):
+        backend = FakeBackend(latency=0.01)
+        pool = await self.pool(backend, max_connections=2)
+        calls = [asyncio.ensure_future(pool.call(("GET", "key"))) for _ in range(6)]
+        await asyncio.sleep(0)
+        self.assertEqual(pool.stats(), {"connections": 2, "inflight": 2})
+        await asyncio.gather(*calls)
+        self.assertEqual(backend.connections_opened, 2)
+        self.assertEqual(pool.stats()["inflight"], 0)
+
+    async def test_timeout(self):
+        pool = await self.pool(FakeBackend(latency=1), timeout=0.01)
+        with self.assertRaises(asyncio.TimeoutError):
+            await pool.call(("GET", "key"))
+        self.assertEqual(pool.stats()["inflight"], 0)
+
+    async def test_closed_connections_are_replaced(self):
+        backend = FakeBackend(data={"key": "value"})
+        pool = await self.pool(backend, min_connections=1)
+        self.assertEqual(backend.connections_opened, 1)
+        await pool.connections[0].connection.close()
+        self.assertEqual(await pool.call(("GET", "key")), "value")
+        self.assertEqual(backend.connections_opened, 2)
+
+    async def test_idle_connections_are_closed(self):
+        backend = FakeBackend(latency=0.01)
+        pool = await self.pool(backend, max_connections=3, keepalive=0.02)
+        await asyncio.gather(*(pool.call(("GET", "key")) for _ in range(3)))
+        self.assertEqual(pool.stats()["connections"], 3)
+        await asyncio.sleep(0.1)
+        self.assertEqual(pool.stats()["connections"], 0)
+
+    async def test_closed_pool_fails_calls(self):
+        pool = await self.pool(FakeBackend())
+        await pool.close()
+        with self.assertRaises(ConnectionError):
+            await pool.call(("GET", "key"))
+
+    def test_connections_must_implement_call(self):
+        class Incomplete(BackendConnection):
+            pass
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+
+class TestPipelinedStreamConnection(unittest.IsolatedAsyncioTestCase):
+
+    async def test_responses_match_requests(self):
+        async def serve(reader, writer):
+            # Echoes upper-cased lines, slowly, so that requests pile up.
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                await asyncio.sleep(0.005)
+                writer.write(line.upper())
+
+        server = await asyncio.start_server(serve, "127.0.0.1", 0)
+        self.addAsyncCleanup(server.wait_closed)
+        self.addCleanup(server.close)
+        port = server.sockets[0].getsockname()[1]
+
+        async def read_line(reader):
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError("Connection closed")
+            return line.decode().strip()
+
+        connect = PipelinedStreamConnection.connector(
+            "127.0.0.1", port, lambda request: f"{request}\n".encode(), read_line,
+        )
+        pool = BackendPool(connect, max_connections=1, pipelining=16, timeout=1)
+        self.addAsyncCleanup(pool.close)
+
+        slow = asyncio.ensure_future(asyncio.wait_for(pool.call("first"), 0.001))
+        results = await asyncio.gather(*(pool.call(f"key{i}") for i in range(10)))
+        self.assertEqual(results, [f"KEY{i}" for i in range(10)])
+        with self.assertRaises(asyncio.TimeoutError):
+            await slow
+
+
+if __name__ == '__main__':
+    unittest.main()
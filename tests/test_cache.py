@@ -0,0 +1,81 @@
+import asyncio
+import unittest
+
+from haproxyspoa.payloads.ack import AckPayload
+from haproxyspoa.spoa_cache import TTLCache, make_cache_key
+from haproxyspoa.spoa_handlers import ExecutorPools, Handler
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLCache(unittest.IsolatedAsyncioTestCase):
+
+    def test_expiry_and_lru_eviction(self):
+        clock = FakeClock()
+        cache = TTLCache(maxsize=2, ttl=10, clock=clock)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)  # Evicts "b", the least recently used
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.evictions, 1)
+
+        clock.now = 11
+        self.assertIsNone(cache.get("a"))
+
+    def test_key_copies_binary_arguments(self):
+        key = make_cache_key({"src": memoryview(b"\x0a\x00\x00\x01"), "hdr": ["a", "b"]})
+        self.assertEqual(key, (("hdr", ("a", "b")), ("src", b"\x0a\x00\x00\x01")))
+        hash(key)
+
+    async def test_handler_results_are_cached_and_misses_coalesced(self):
+        calls = 0
+        release = asyncio.Event()
+
+        async def reputation(src: str):
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return AckPayload().set_txn_var("reputation", 42)
+
+        cache = TTLCache(maxsize=16, ttl=60)
+        handler = Handler(reputation, ExecutorPools(), cache=cache)
+
+        pending = [asyncio.ensure_future(handler(src="10.0.0.1")) for _ in range(5)]
+        await asyncio.sleep(0)
+        release.set()
+        acks = await asyncio.gather(*pending)
+        await handler(src="10.0.0.1")
+
+        self.assertEqual(calls, 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+        self.assertEqual(cache.stats()["coalesced"], 4)
+        self.assertEqual(cache.stats()["hits"], 1)
+        expected = AckPayload().set_txn_var("reputation", 42).to_bytes().getvalue()
+        self.assertTrue(all(ack.to_bytes().getvalue() == expected for ack in acks))
+
+    async def test_shared_cache_keeps_handlers_apart(self):
+        cache = TTLCache(maxsize=16, ttl=60)
+
+        async def reputation(src: str):
+            return AckPayload().set_txn_var("reputation", 42)
+
+        async def country(src: str):
+            return AckPayload().set_txn_var("country", "fr")
+
+        first = await Handler(reputation, ExecutorPools(), cache=cache)(src="10.0.0.1")
+        second = await Handler(country, ExecutorPools(), cache=cache)(src="10.0.0.1")
+        self.assertEqual(second.to_bytes().getvalue(), AckPayload().set_txn_var("country", "fr").to_bytes().getvalue())
+        self.assertNotEqual(first.to_bytes().getvalue(), second.to_bytes().getvalue())
+        self.assertEqual(cache.stats()["misses"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
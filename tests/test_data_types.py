@@ -0,0 +1,137 @@
+import ipaddress
+import pickle
+import random
+import unittest
+from unittest import mock
+
+from haproxyspoa import spoa_data_types
+from haproxyspoa.spoa_data_types import PackedAddress, SpopDataTypes, decode_typed_data, write_typed_autodetect
+
+
+def random_uint64(rng: random.Random) -> int:
+    # Spread the samples evenly over the encoded lengths rather than over the values,
+    #  which would almost only produce 10-byte varints.
+    return rng.getrandbits(rng.randint(1, 64))
+
+
+class CodecRoundTrip:
+    """Round-trip checks run against each codec backend, see the subclasses."""
+
+    SAMPLES = 5000
+
+    def setUp(self):
+        self.rng = random.Random(0x5EED)
+
+    def test_varint_boundaries(self):
+        for value in (0, 1, 239, 240, 255, 2287, 2288, 2 ** 32 - 1, 2 ** 63, 2 ** 64 - 1):
+            encoded = spoa_data_types.write_varint(value)
+            self.assertEqual(spoa_data_types.decode_varint(memoryview(encoded), 0), (value, len(encoded)))
+
+    def test_varint_round_trip(self):
+        for _ in range(self.SAMPLES):
+            value = random_uint64(self.rng)
+            prefix = bytes(self.rng.randint(0, 3))
+            encoded = prefix + spoa_data_types.write_varint(value) + b"\xff"
+            self.assertEqual(
+                spoa_data_types.decode_varint(memoryview(encoded), len(prefix)),
+                (value, len(encoded) - 1),
+            )
+
+    def test_signed_round_trip(self):
+        for _ in range(self.SAMPLES):
+            value = self.rng.randint(-2 ** 63, 2 ** 63 - 1)
+            encoded = spoa_data_types.write_typed_int64(value)
+            self.assertEqual(spoa_data_types.decode_typed_data(memoryview(encoded), 0), (value, len(encoded)))
+
+            value = self.rng.randint(-2 ** 31, 2 ** 31 - 1)
+            encoded = spoa_data_types.write_typed_int32(value)
+            self.assertEqual(spoa_data_types.decode_typed_data(memoryview(encoded), 0), (value, len(encoded)))
+
+    def test_integers_wrap_to_their_width(self):
+        encoded = memoryview(spoa_data_types.write_varint(2 ** 64 - 1))
+        self.assertEqual(spoa_data_types.decode_int32(encoded, 0)[0], -1)
+        self.assertEqual(spoa_data_types.decode_int64(encoded, 0)[0], -1)
+        self.assertEqual(spoa_data_types.decode_uint32(encoded, 0)[0], 2 ** 32 - 1)
+        self.assertEqual(spoa_data_types.decode_uint64(encoded, 0)[0], 2 ** 64 - 1)
+
+        encoded = memoryview(spoa_data_types.write_varint(2 ** 31))
+        self.assertEqual(spoa_data_types.decode_int32(encoded, 0)[0], -2 ** 31)
+        self.assertEqual(spoa_data_types.decode_uint32(encoded, 0)[0], 2 ** 31)
+
+    def test_unsigned_round_trip(self):
+        for _ in range(self.SAMPLES):
+            value = random_uint64(self.rng)
+            encoded = bytes([SpopDataTypes.UINT64]) + spoa_data_types.write_varint(value)
+            self.assertEqual(spoa_data_types.decode_typed_data(memoryview(encoded), 0), (value, len(encoded)))
+
+    def test_truncated_varint(self):
+        encoded = spoa_data_types.write_varint(2 ** 40)
+        for length in range(len(encoded)):
+            with self.assertRaises(IndexError):
+                spoa_data_types.decode_varint(memoryview(encoded[:length]), 0)
+
+    def test_negative_varint(self):
+        with self.assertRaises(OverflowError):
+            spoa_data_types.write_varint(-1)
+
+
+class TestPurePythonCodec(CodecRoundTrip, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.multiple(spoa_data_types, **spoa_data_types.PURE_PYTHON_CODEC)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pure_python_codec_is_used(self):
+        self.assertIs(spoa_data_types.write_varint, spoa_data_types.PURE_PYTHON_CODEC["write_varint"])
+
+
+@unittest.skipUnless(spoa_data_types.ACCELERATED, "the _speedups extension is not built")
+class TestAcceleratedCodec(CodecRoundTrip, unittest.TestCase):
+
+    def test_matches_pure_python_encoding(self):
+        pure_write_varint = spoa_data_types.PURE_PYTHON_CODEC["write_varint"]
+        for _ in range(self.SAMPLES):
+            value = random_uint64(self.rng)
+            self.assertEqual(spoa_data_types.write_varint(value), pure_write_varint(value))
+
+    def test_values_beyond_64_bits(self):
+        with self.assertRaises(OverflowError):
+            spoa_data_types.write_varint(2 ** 64)
+        encoded = spoa_data_types.PURE_PYTHON_CODEC["write_varint"](2 ** 64)
+        with self.assertRaises(OverflowError):
+            spoa_data_types.decode_varint(memoryview(encoded), 0)
+
+
+class TestPackedAddress(unittest.TestCase):
+
+    def test_conversions(self):
+        for text in ("192.168.1.23", "2001:db8::1", "::ffff:1.2.3.4"):
+            address = ipaddress.ip_address(text)
+            packed = PackedAddress(address.packed)
+            self.assertEqual(packed.version, address.version)
+            self.assertEqual(packed.to_ipaddress(), address)
+            self.assertEqual(int(packed), int(address))
+            self.assertEqual(str(packed), str(address))
+
+    def test_hashable_key(self):
+        a = PackedAddress(memoryview(b"\x0a\x00\x00\x01"))
+        b = PackedAddress(b"\x0a\x00\x00\x01")
+        self.assertEqual(a, b)
+        self.assertEqual({a: 1}[b], 1)
+        self.assertNotEqual(a, PackedAddress(b"\x0a\x00\x00\x02"))
+        self.assertEqual(pickle.loads(pickle.dumps(a)), a)
+        with self.assertRaises(ValueError):
+            PackedAddress(b"\x00" * 5)
+
+    def test_written_as_typed_address(self):
+        for text in ("192.168.1.23", "2001:db8::1"):
+            address = ipaddress.ip_address(text)
+            encoded = write_typed_autodetect(PackedAddress(address.packed))
+            self.assertEqual(encoded, write_typed_autodetect(address))
+            self.assertEqual(decode_typed_data(memoryview(encoded), 0), (address, len(encoded)))
+
+
+if __name__ == '__main__':
+    unittest.main()
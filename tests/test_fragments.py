@@ -0,0 +1,63 @@
+import unittest
+
+from haproxyspoa.payloads.agent_disconnect import DisconnectStatusCode
+from haproxyspoa.spoa_errors import SpoaProtocolError
+from haproxyspoa.spoa_fragments import FragmentReassembler
+from haproxyspoa.spoa_frame import Frame, FrameFlags, FrameType
+
+
+def make_frame(frame_type: int, flags: int, payload: bytes, stream_id: int = 1, frame_id: int = 1) -> Frame:
+    return Frame(frame_type, flags, stream_id, frame_id, memoryview(payload))
+
+
+class TestFragmentReassembler(unittest.TestCase):
+
+    def test_unfragmented_notify_passes_through(self):
+        reassembler = FragmentReassembler()
+        frame = make_frame(FrameType.HAPROXY_NOTIFY, FrameFlags.FIN, b"whole")
+        self.assertIs(reassembler.feed(frame), frame)
+
+    def test_reassembles_fragments_into_single_notify(self):
+        reassembler = FragmentReassembler(initial_capacity=4)
+        self.assertIsNone(reassembler.feed(make_frame(FrameType.HAPROXY_NOTIFY, 0, b"first ")))
+        self.assertIsNone(reassembler.feed(make_frame(FrameType.FRAGMENT, 0, b"second ")))
+        frame = reassembler.feed(make_frame(FrameType.FRAGMENT, FrameFlags.FIN, b"third"))
+
+        self.assertEqual(frame.headers.type, FrameType.HAPROXY_NOTIFY)
+        self.assertEqual(bytes(frame.payload), b"first second third")
+        self.assertEqual(len(reassembler), 0)
+        self.assertEqual(reassembler.bytes_reserved, 0)
+
+    def test_abort_discards_partial_payload(self):
+        reassembler = FragmentReassembler()
+        reassembler.feed(make_frame(FrameType.HAPROXY_NOTIFY, 0, b"partial"))
+        self.assertIsNone(reassembler.feed(make_frame(FrameType.FRAGMENT, FrameFlags.FIN | FrameFlags.ABORT, b"")))
+        self.assertEqual((len(reassembler), reassembler.bytes_reserved), (0, 0))
+
+    def test_memory_budget_is_enforced(self):
+        reassembler = FragmentReassembler(memory_budget=10, initial_capacity=4)
+        reassembler.feed(make_frame(FrameType.HAPROXY_NOTIFY, 0, b"12345678"))
+        with self.assertRaises(SpoaProtocolError) as ctx:
+            reassembler.feed(make_frame(FrameType.FRAGMENT, 0, b"12345678"))
+        self.assertEqual(ctx.exception.status_code, DisconnectStatusCode.RESOURCE_ALLOCATION_ERROR)
+
+    def test_interlacing_requires_pipelining(self):
+        reassembler = FragmentReassembler()
+        reassembler.feed(make_frame(FrameType.HAPROXY_NOTIFY, 0, b"a", stream_id=1))
+        with self.assertRaises(SpoaProtocolError) as ctx:
+            reassembler.feed(make_frame(FrameType.HAPROXY_NOTIFY, 0, b"b", stream_id=2))
+        self.assertEqual(ctx.exception.status_code, DisconnectStatusCode.INVALID_INTERLACED_FRAMES)
+
+        reassembler = FragmentReassembler(allow_interlacing=True)
+        reassembler.feed(make_frame(FrameType.HAPROXY_NOTIFY, 0, b"a", stream_id=1))
+        reassembler.feed(make_frame(FrameType.HAPROXY_NOTIFY, 0, b"b", stream_id=2))
+        self.assertEqual(len(reassembler), 2)
+
+    def test_unknown_fragment_is_rejected(self):
+        with self.assertRaises(SpoaProtocolError) as ctx:
+            FragmentReassembler().feed(make_frame(FrameType.FRAGMENT, FrameFlags.FIN, b"orphan"))
+        self.assertEqual(ctx.exception.status_code, DisconnectStatusCode.FRAME_ID_NOT_FOUND)
+
+
+if __name__ == '__main__':
+    unittest.main()
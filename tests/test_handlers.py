@@ -0,0 +1,93 @@
+import asyncio
+import os
+import threading
+import unittest
+
+from haproxyspoa.payloads.ack import AckPayload
+from haproxyspoa.spoa_handlers import BatchHandler, ExecutorPools, Handler, HandlerExecutor
+
+
+def score_in_process(payload: bytes):
+    return AckPayload().set_txn_var("score", len(payload)).set_txn_var("pid", os.getpid())
+
+
+class TestHandlerExecution(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.pools = ExecutorPools(thread_workers=2, process_workers=1)
+        self.addCleanup(self.pools.shutdown)
+
+    async def test_sync_handler_defaults_to_thread_pool(self):
+        def lookup(src: str):
+            return AckPayload().set_txn_var("thread", threading.get_ident())
+
+        handler = Handler(lookup, self.pools)
+        self.assertEqual(handler.executor, HandlerExecutor.THREAD)
+        ack = await handler(src="10.0.0.1")
+        self.assertNotEqual(ack.actions[0].value, threading.get_ident())
+
+    async def test_process_handler_receives_copied_arguments(self):
+        handler = Handler(score_in_process, self.pools, executor=HandlerExecutor.PROCESS)
+        ack = await handler(payload=memoryview(b"abcdef"))
+        self.assertEqual(ack.actions[0].value, 6)
+        self.assertNotEqual(ack.actions[1].value, os.getpid())
+
+    async def test_concurrency_limit(self):
+        running = 0
+        peak = 0
+
+        async def slow():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return AckPayload()
+
+        handler = Handler(slow, self.pools, concurrency=2)
+        await asyncio.gather(*(handler() for _ in range(10)))
+        self.assertEqual(peak, 2)
+
+    def test_coroutines_cannot_be_offloaded(self):
+        async def handler():
+            return AckPayload()
+
+        with self.assertRaises(ValueError):
+            Handler(handler, self.pools, executor=HandlerExecutor.THREAD)
+
+
+class TestBatchHandler(unittest.IsolatedAsyncioTestCase):
+
+    async def test_full_batch_is_flushed_right_away(self):
+        batches = []
+
+        async def score(batch):
+            batches.append([call["n"] for call in batch])
+            return [AckPayload().set_txn_var("n", call["n"]) for call in batch]
+
+        handler = BatchHandler(score, max_batch=3, max_wait=60)
+        acks = await asyncio.wait_for(asyncio.gather(*(handler.invoke({"n": n}) for n in range(6))), 1)
+        self.assertEqual(batches, [[0, 1, 2], [3, 4, 5]])
+        self.assertEqual([ack.actions[0].value for ack in acks], list(range(6)))
+
+    async def test_partial_batch_is_flushed_after_max_wait(self):
+        def score(batch):
+            return [AckPayload() for _ in batch]
+
+        handler = BatchHandler(score, max_batch=100, max_wait=0.01)
+        calls = [handler.invoke({}) for _ in range(2)]
+        self.assertEqual(len(handler.queued), 2)
+        await asyncio.wait_for(asyncio.gather(*calls), 1)
+        self.assertEqual(handler.queued, [])
+
+    async def test_errors_reach_every_call(self):
+        async def wrong_count(batch):
+            return [AckPayload()]
+
+        handler = BatchHandler(wrong_count, max_wait=0)
+        results = await asyncio.gather(handler.invoke({}), handler.invoke({}), return_exceptions=True)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import io
+import json
+import logging
+import subprocess
+import sys
+import unittest
+
+from haproxyspoa.logging import FlowIdLoggerAdapter, JsonFormatter, NonBlockingQueueHandler, TextFormatter, \
+    configure_logging, logger, stop_logging
+from haproxyspoa.spoa_frame import Frame, FrameType
+from haproxyspoa.spoa_server import SpoaConnection
+
+
+def make_record(adapter: logging.LoggerAdapter, msg: str, *args, **kwargs) -> logging.LogRecord:
+    msg, kwargs = adapter.process(msg, kwargs)
+    return adapter.logger.makeRecord(adapter.logger.name, logging.INFO, __file__, 0, msg, args, None, **kwargs)
+
+
+class TestFormatters(unittest.TestCase):
+
+    def test_json_includes_ids(self):
+        adapter = FlowIdLoggerAdapter(logger, {"flow_id": "cafe"})
+        record = make_record(adapter, "Got %d handlers", 2, extra={"stream_id": 3, "frame_id": 1})
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry["message"], "Got 2 handlers")
+        self.assertEqual((entry["flow_id"], entry["stream_id"], entry["frame_id"]), ("cafe", 3, 1))
+        self.assertEqual(entry["level"], "INFO")
+
+    def test_text_prefixes_ids(self):
+        adapter = FlowIdLoggerAdapter(logger, {"flow_id": "cafe"})
+        self.assertTrue(TextFormatter().format(make_record(adapter, "hello")).endswith("[cafe] hello"))
+        record = make_record(adapter, "hello", extra={"stream_id": 3, "frame_id": 1})
+        self.assertTrue(TextFormatter().format(record).endswith("[cafe] [3:1] hello"))
+
+
+class TestNonBlockingLogging(unittest.TestCase):
+
+    def test_records_past_the_queue_size_are_dropped(self):
+        handler = NonBlockingQueueHandler(max_queue_size=2)
+        for _ in range(5):
+            handler.handle(logging.makeLogRecord({"msg": "x"}))
+        self.assertEqual((handler.queue.qsize(), handler.dropped), (2, 3))
+
+    def test_configure_logging(self):
+        stream = io.StringIO()
+        name = "haproxyspoa.tests.configured"
+        configure_logging(json_output=True, stream=stream, logger_name=name)
+        target = logging.getLogger(name)
+        self.addCleanup(target.handlers.clear)
+        target.info("processed %s", "frame", extra={"flow_id": "cafe"})
+        stop_logging()
+        entry = json.loads(stream.getvalue())
+        self.assertEqual((entry["message"], entry["flow_id"]), ("processed frame", "cafe"))
+
+    def test_import_leaves_logging_unconfigured(self):
+        output = subprocess.check_output([
+            sys.executable, "-c",
+            "import logging, haproxyspoa.spoa_server; print(len(logging.getLogger().handlers))",
+        ])
+        self.assertEqual(output.strip(), b"0")
+
+
+class TestFrameLogger(unittest.TestCase):
+
+    def setUp(self):
+        self.frame = Frame(frame_type=FrameType.HAPROXY_NOTIFY, stream_id=3, frame_id=1, flags=1, payload=b"")
+        level = logger.level
+        self.addCleanup(logger.setLevel, level)
+
+    def test_disabled_unless_debug(self):
+        logger.setLevel(logging.INFO)
+        self.assertIsNone(SpoaConnection(None, {}).frame_logger(self.frame))
+
+    def test_sampling(self):
+        logger.setLevel(logging.DEBUG)
+        frame_logger = SpoaConnection(None, {}).frame_logger(self.frame)
+        self.assertEqual((frame_logger.extra["stream_id"], frame_logger.extra["frame_id"]), (3, 1))
+        self.assertIsNone(SpoaConnection(None, {}, log_sample_rate=0.0).frame_logger(self.frame))
+
+
+if __name__ == '__main__':
+    unittest.main()
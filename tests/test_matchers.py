@@ -0,0 +1,88 @@
+import random
+import unittest
+
+from haproxyspoa.spoa_matchers import DomainSuffixMatcher, ExactMatcher, SubstringMatcher, SwappableMatcher
+
+
+class TestExactMatcher(unittest.TestCase):
+
+    def test_match(self):
+        matcher = ExactMatcher(["blocked.example", ("api.example", "api")])
+        self.assertEqual(matcher.match(b"blocked.example"), "blocked.example")
+        self.assertEqual(matcher.match(memoryview(b"api.example")), "api")
+        self.assertIsNone(matcher.match("Blocked.example"))
+        self.assertNotIn(bytearray(b"other"), matcher)
+
+    def test_ignore_case(self):
+        matcher = ExactMatcher(["Blocked.Example"], ignore_case=True)
+        self.assertIn(b"BLOCKED.example", matcher)
+
+
+class TestDomainSuffixMatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.matcher = DomainSuffixMatcher([
+            ("example.com", "example"),
+            ("*.ads.example.com", "ads"),
+            ("com", "tld"),
+        ])
+
+    def test_longest_suffix_wins(self):
+        self.assertEqual(self.matcher.match(b"example.com"), "example")
+        self.assertEqual(self.matcher.match(b"www.example.com"), "example")
+        self.assertEqual(self.matcher.match(b"x.ads.example.com"), "ads")
+        self.assertEqual(self.matcher.match(b"other.com"), "tld")
+        self.assertIsNone(self.matcher.match(b"example.org"))
+
+    def test_wildcard_only_matches_subdomains(self):
+        self.assertEqual(self.matcher.match(b"ads.example.com"), "example")
+
+    def test_wildcard_beats_domain_on_subdomains(self):
+        matcher = DomainSuffixMatcher([("example.com", "apex"), ("*.example.com", "sub")])
+        self.assertEqual(matcher.match(b"example.com"), "apex")
+        self.assertEqual(matcher.match(b"www.example.com"), "sub")
+        self.assertEqual(matcher.match(b"a.b.example.com"), "sub")
+
+    def test_normalization(self):
+        self.assertEqual(self.matcher.match(memoryview(b"WWW.Example.COM.")), "example")
+        self.assertNotIn(b"notexample.org", self.matcher)
+        self.assertEqual(len(self.matcher), 3)
+
+
+class TestSubstringMatcher(unittest.TestCase):
+
+    def test_overlapping_patterns(self):
+        matcher = SubstringMatcher(["he", "she", "his", "hers"])
+        self.assertEqual(matcher.findall(b"ushers"), ["she", "he", "hers"])
+        self.assertEqual(matcher.match(b"ushers"), "she")
+        self.assertIsNone(matcher.match(b"nothing"))
+
+    def test_ignore_case(self):
+        matcher = SubstringMatcher([("curl/", "curl"), ("Googlebot", "google")], ignore_case=True)
+        self.assertEqual(matcher.match(memoryview(b"Mozilla/5.0 (compatible; googlebot/2.1)")), "google")
+        self.assertIn("CURL/8.0", matcher)
+
+    def test_matches_naive_search(self):
+        rng = random.Random(0x5EED)
+        patterns = ["".join(rng.choice("abc") for _ in range(rng.randint(1, 5))) for _ in range(50)]
+        matcher = SubstringMatcher(patterns)
+        for _ in range(200):
+            text = "".join(rng.choice("abcd") for _ in range(rng.randint(0, 30)))
+            self.assertEqual(
+                set(matcher.findall(text.encode())),
+                {pattern for pattern in patterns if pattern in text},
+            )
+
+
+class TestSwappableMatcher(unittest.IsolatedAsyncioTestCase):
+
+    async def test_rebuild(self):
+        hosts = SwappableMatcher(DomainSuffixMatcher(["old.example"]))
+        self.assertIn(b"www.old.example", hosts)
+        await hosts.rebuild(DomainSuffixMatcher, ["new.example"])
+        self.assertNotIn(b"www.old.example", hosts)
+        self.assertEqual(hosts.match(b"new.example"), "new.example")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,8 +2,9 @@ import io
 import ipaddress
 import unittest
 
-from haproxyspoa.spoa_data_types import write_string, write_typed_autodetect
-from haproxyspoa.spoa_payloads import write_kv_list, parse_kv_list, parse_list_of_messages
+from haproxyspoa.spoa_data_types import write_string, write_typed_autodetect, write_varint, decode_varint, \
+    decode_typed_data, parse_typed_data, parse_varint, parse_int32, parse_int64
+from haproxyspoa.spoa_payloads import write_kv_list, parse_kv_list, parse_list_of_messages, decode_list_of_messages
 
 
 class TestPayloadParsing(unittest.TestCase):
@@ -42,6 +43,50 @@ class TestPayloadParsing(unittest.TestCase):
             }
         })
 
+    def test_memoryview_decoder_matches_stream_parser(self):
+        for value in (0, 1, 239, 240, 2047, 2048, 16380, 2 ** 32 - 1, 2 ** 63):
+            encoded = write_varint(value)
+            self.assertEqual(decode_varint(memoryview(encoded), 0), (value, len(encoded)))
+
+        encoded = write_typed_autodetect(b"\x00\x01binary\xff") + write_typed_autodetect("trailer")
+        view = memoryview(encoded)
+        value, offset = decode_typed_data(view, 0)
+        self.assertIsInstance(value, memoryview)
+        self.assertEqual(value.obj, encoded)  # Zero-copy slice of the original buffer
+        self.assertEqual(bytes(value), b"\x00\x01binary\xff")
+        self.assertEqual(decode_typed_data(view, offset), ("trailer", len(encoded)))
+
+        stream = io.BytesIO(encoded)
+        self.assertEqual(parse_typed_data(stream), b"\x00\x01binary\xff")
+        self.assertEqual(parse_typed_data(stream), "trailer")
+
+    def test_repeated_argument_keys_are_collected(self):
+        payload = write_string("headers") + bytes([3]) + write_string("h") + write_typed_autodetect("a") \
+            + write_string("h") + write_typed_autodetect("b") + write_string("h") + write_typed_autodetect("c")
+
+        self.assertEqual(parse_list_of_messages(payload), {"headers": {"h": ["a", "b", "c"]}})
+
+    def test_stream_parser_wraps_integers(self):
+        for value in (-1, -2 ** 31, 2 ** 31 - 1):
+            encoded = write_varint(value & 0xFFFFFFFFFFFFFFFF)
+            self.assertEqual(parse_int32(io.BytesIO(encoded)), value)
+            self.assertEqual(parse_int64(io.BytesIO(encoded)), value)
+        self.assertEqual(parse_varint(io.BytesIO(write_varint(2 ** 40))), 2 ** 40)
+        with self.assertRaises(ValueError):
+            parse_typed_data(io.BytesIO(write_typed_autodetect(b"binary")[:-1]))
+
+    def test_binary_round_trip(self):
+        for value in (b"\x00binary", bytearray(b"\x00binary"), memoryview(b"..\x00binary")[2:]):
+            with self.subTest(type=type(value).__name__):
+                encoded = write_typed_autodetect(value)
+                self.assertEqual(bytes(decode_typed_data(memoryview(encoded), 0)[0]), b"\x00binary")
+
+        payload = write_string("check") + bytes([1]) + write_string("body") + write_typed_autodetect(b"\xff")
+        # The compatibility parser copies binaries, the decoder does not.
+        self.assertEqual(parse_list_of_messages(payload), {"check": {"body": b"\xff"}})
+        self.assertIsInstance(parse_list_of_messages(payload)["check"]["body"], bytes)
+        self.assertIsInstance(decode_list_of_messages(memoryview(payload))["check"]["body"], memoryview)
+
 
 if __name__ == '__main__':
     unittest.main()
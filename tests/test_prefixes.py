@@ -0,0 +1,103 @@
+import ipaddress
+import os
+import random
+import tempfile
+import unittest
+
+from haproxyspoa.spoa_data_types import PackedAddress
+from haproxyspoa.spoa_prefixes import PrefixIndex, SwappablePrefixIndex
+
+
+def random_prefixes(rng: random.Random, count: int, version: int):
+    bits = 32 if version == 4 else 128
+    prefixes = []
+    for i in range(count):
+        # A narrow address space, so that prefixes nest and overlap a lot.
+        prefix_length = rng.randint(bits - 12, bits)
+        address = (0x0A << (bits - 8)) | rng.getrandbits(12) << (bits - 20)
+        prefixes.append((ipaddress.ip_network((address, prefix_length), strict=False), f"v{i % 7}"))
+    return prefixes
+
+
+def brute_force_lookup(prefixes, address):
+    best = None
+    for network, value in prefixes:
+        if address in network and (best is None or network.prefixlen >= best[0].prefixlen):
+            best = (network, value)
+    return best[1] if best is not None else None
+
+
+class TestPrefixIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(1234)
+        self.prefixes = random_prefixes(self.rng, 300, 4) + random_prefixes(self.rng, 300, 6)
+        self.index = PrefixIndex.build(self.prefixes)
+
+    def sample_addresses(self):
+        for network, _ in self.prefixes[::5]:
+            yield network.network_address
+            yield network.broadcast_address
+            if int(network.broadcast_address) < 2 ** network.max_prefixlen - 1:
+                yield network.broadcast_address + 1
+        yield ipaddress.ip_address("192.168.0.1")
+        yield ipaddress.ip_address("2001:db8::1")
+
+    def test_longest_prefix_match(self):
+        for address in self.sample_addresses():
+            expected = brute_force_lookup(self.prefixes, address)
+            self.assertEqual(self.index.lookup(address), expected, address)
+            self.assertEqual(self.index.lookup(address.packed), expected)
+            self.assertEqual(self.index.lookup(PackedAddress(address.packed)), expected)
+
+    def test_nested_and_repeated_prefixes(self):
+        index = PrefixIndex.build([
+            ("10.0.0.0/8", "wide"),
+            ("10.1.0.0/16", "narrow"),
+            ("10.1.2.3/32", "host"),
+            ("10.1.2.3", "host-again"),
+            ("0.0.0.0/0", "default"),
+        ])
+        self.assertEqual(index.lookup("10.1.2.3"), "host-again")
+        self.assertEqual(index.lookup("10.1.2.4"), "narrow")
+        self.assertEqual(index.lookup("10.2.0.0"), "wide")
+        self.assertEqual(index.lookup("11.0.0.0"), "default")
+        self.assertEqual(index.lookup("::1", "none"), "none")
+        self.assertIn(memoryview(ipaddress.ip_address("10.1.2.3").packed), index)
+
+    def test_saved_index_is_memory_mapped(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "prefixes.idx")
+            self.index.save(path)
+            loaded = PrefixIndex.load(path)
+
+            self.assertEqual(len(loaded), len(self.index))
+            for address in self.sample_addresses():
+                self.assertEqual(loaded.lookup(address.packed), self.index.lookup(address.packed))
+
+    def test_rejects_other_files(self):
+        with tempfile.NamedTemporaryFile(suffix=".idx") as f:
+            f.write(b"not an index at all, not even close")
+            f.flush()
+            with self.assertRaises(ValueError):
+                PrefixIndex.load(f.name)
+
+
+class TestSwappablePrefixIndex(unittest.IsolatedAsyncioTestCase):
+
+    async def test_swap(self):
+        holder = SwappablePrefixIndex()
+        self.assertIsNone(holder.lookup("10.0.0.1"))
+
+        await holder.build([("10.0.0.0/8", "private")])
+        self.assertEqual(holder.lookup("10.0.0.1"), "private")
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "prefixes.idx")
+            PrefixIndex.build([("10.0.0.0/8", "reloaded")]).save(path)
+            await holder.load(path)
+        self.assertEqual(holder.lookup("10.0.0.1"), "reloaded")
+
+
+if __name__ == '__main__':
+    unittest.main()
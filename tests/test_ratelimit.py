@@ -0,0 +1,91 @@
+import unittest
+
+from haproxyspoa.payloads.ack import AckPayload
+from haproxyspoa.spoa_ratelimit import RateLimitAlgorithm, RateLimiter
+
+
+class TestSlidingWindow(unittest.TestCase):
+
+    def setUp(self):
+        self.limiter = RateLimiter(limit=3, window=10)
+        self.origin = self.limiter.origin
+
+    def check(self, key, at: float):
+        return self.limiter.check(key, now=self.origin + at)
+
+    def test_limit_within_window(self):
+        self.assertEqual([self.check("a", 0.1 * i).allowed for i in range(5)], [True, True, True, False, False])
+        self.assertTrue(self.check("b", 1).allowed)
+
+    def test_previous_window_is_weighted(self):
+        for i in range(3):
+            self.check("a", i)
+        # 80% of the previous window is still covered: 2.4 requests.
+        result = self.check("a", 12)
+        self.assertFalse(result.allowed)
+        self.assertAlmostEqual(result.rate, 2.4, places=5)
+        self.assertTrue(self.check("a", 17).allowed)
+        # Two windows later, everything was forgotten.
+        self.assertAlmostEqual(self.check("a", 35).rate, 1.0)
+
+    def test_decay(self):
+        for i in range(3):
+            self.check("a", i)
+        self.limiter.decay(0.5)
+        result = self.check("a", 5)
+        self.assertTrue(result.allowed)
+        self.assertAlmostEqual(result.rate, 2.5)
+
+    def test_reset(self):
+        for i in range(4):
+            self.check("a", i)
+        self.limiter.reset()
+        self.assertAlmostEqual(self.check("a", 5).rate, 1.0)
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_refill(self):
+        limiter = RateLimiter(limit=2, window=2, algorithm=RateLimitAlgorithm.TOKEN_BUCKET)
+        origin = limiter.origin
+        self.assertEqual([limiter.check("a", now=origin + 0.1 * i).allowed for i in range(3)], [True, True, False])
+        # One token per second.
+        result = limiter.check("a", now=origin + 1.2)
+        self.assertTrue(result.allowed)
+        self.assertFalse(limiter.check("a", now=origin + 1.3).allowed)
+
+    def test_counting_rejected_requests(self):
+        limiter = RateLimiter(limit=2, window=2, algorithm=RateLimitAlgorithm.TOKEN_BUCKET, count_rejected=True)
+        origin = limiter.origin
+        for i in range(6):
+            limiter.check("a", now=origin)
+        self.assertFalse(limiter.check("a", now=origin + 2.5).allowed)
+
+
+class TestTable(unittest.TestCase):
+
+    def test_bounded_capacity(self):
+        limiter = RateLimiter(limit=1, window=10, capacity=64, ways=4)
+        size = limiter.size
+        for i in range(10000):
+            limiter.check(i.to_bytes(4, byteorder='big'), now=limiter.origin + i * 1e-4)
+        self.assertEqual(limiter.size, size)
+        self.assertGreater(limiter.evictions, 0)
+        # The most recently seen keys are the ones kept.
+        self.assertFalse(limiter.check((9999).to_bytes(4, byteorder='big'), now=limiter.origin + 1).allowed)
+
+    def test_verdict(self):
+        limiter = RateLimiter(limit=1, window=10)
+        self.assertEqual(
+            bytes(limiter.verdict("a").encode()),
+            bytes(AckPayload().set_txn_var("rate_limited", 0).set_txn_var("rate", 1).encode()),
+        )
+        ack = limiter.verdict("a", AckPayload().set_txn_var("seen", 1), rate_var=None)
+        self.assertEqual(
+            bytes(ack.encode()),
+            bytes(AckPayload().set_txn_var("seen", 1).set_txn_var("rate_limited", 1).encode()),
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import ipaddress
+import unittest
+from unittest import mock
+
+from haproxyspoa import spoa_payloads
+from haproxyspoa.payloads.notify import NotifyPayload
+from haproxyspoa.spoa_data_types import IPDecoding, PackedAddress, SpopDataTypes, StringDecoding, write_binary, \
+    write_string, write_typed_autodetect
+from haproxyspoa.spoa_payloads import MessageArguments, StringTable, parse_list_of_messages
+from haproxyspoa.spoa_schema import MessageSchema
+
+
+def encode_message(name: str, args: list) -> bytes:
+    payload = write_string(name) + bytes([len(args)])
+    for key, value in args:
+        payload += write_string(key) + write_typed_autodetect(value)
+    return payload
+
+
+SRC = ipaddress.IPv4Address("192.168.1.23")
+PAYLOAD = encode_message("ignored", [("body", b"x" * 64), ("n", 7)]) \
+    + encode_message("check", [("src", SRC), ("host", "example.com"), ("h", "a"), ("h", "b"), ("body", b"\x00\xff")])
+
+
+class TestLazyArguments(unittest.TestCase):
+
+    def test_lazy_arguments_match_eager_parsing(self):
+        messages = NotifyPayload(PAYLOAD).messages
+        self.assertIsInstance(messages["check"], MessageArguments)
+        self.assertEqual(messages, parse_list_of_messages(PAYLOAD))
+
+    def test_unwanted_messages_are_skipped(self):
+        with mock.patch.object(spoa_payloads, "decode_typed_data", wraps=spoa_payloads.decode_typed_data) as decode:
+            messages = NotifyPayload(PAYLOAD, wanted={"check"}).messages
+            self.assertEqual(list(messages), ["check"])
+            self.assertEqual(list(messages["check"]), ["src", "host", "h", "body"])
+            decode.assert_not_called()
+
+            self.assertEqual(messages["check"]["host"], "example.com")
+            self.assertEqual(decode.call_count, 1)
+
+
+class TestStringTable(unittest.TestCase):
+
+    def test_known_strings_are_shared(self):
+        strings = StringTable(["check", "host"])
+        first = NotifyPayload(PAYLOAD, strings=strings).messages
+        # Reassembled payloads are writable buffers.
+        second = NotifyPayload(bytearray(PAYLOAD), strings=strings).messages
+        self.assertEqual(first, parse_list_of_messages(PAYLOAD))
+        self.assertEqual(parse_list_of_messages(PAYLOAD, strings), parse_list_of_messages(PAYLOAD))
+
+        # Including "src" and "h", learned on first sight.
+        self.assertIn("src", strings)
+        for name, other in zip([*first, *first["check"]], [*second, *second["check"]]):
+            self.assertIs(name, other)
+
+    def test_non_ascii_strings(self):
+        strings = StringTable(["prüfen"])
+        self.assertIn("prüfen", strings)
+        payload = write_string("check") + bytes([1]) + write_binary("größe".encode("utf-8")) \
+            + write_typed_autodetect(1)
+        self.assertEqual(NotifyPayload(payload, strings=strings).messages["check"]["größe"], 1)
+        self.assertIn("größe", strings)
+
+    def test_max_size(self):
+        strings = StringTable(["check"], max_size=2)
+        NotifyPayload(PAYLOAD, strings=strings)
+        self.assertEqual(len(strings), 2)
+        self.assertIn("ignored", strings)
+        self.assertNotIn("host", strings)
+        self.assertEqual(NotifyPayload(PAYLOAD, strings=strings).messages["check"]["host"], "example.com")
+
+
+class TestMessageSchema(unittest.TestCase):
+
+    def extract(self, fn) -> dict:
+        return MessageSchema.from_function(fn).extract(NotifyPayload(PAYLOAD).messages["check"])
+
+    def test_only_declared_arguments_are_decoded(self):
+        def handler(src: ipaddress.IPv4Address, host: str, missing: str = "default"):
+            pass
+
+        self.assertEqual(self.extract(handler), {"src": SRC, "host": "example.com"})
+
+    def test_annotations_select_representation(self):
+        def handler(src: int, host: bytes, body: memoryview, h):
+            pass
+
+        kwargs = self.extract(handler)
+        self.assertEqual(kwargs["src"], int(SRC))
+        self.assertEqual(kwargs["host"], b"example.com")
+        self.assertIsInstance(kwargs["body"], memoryview)
+        self.assertEqual(bytes(kwargs["body"]), b"\x00\xff")
+        self.assertEqual(kwargs["h"], ["a", "b"])
+
+    def test_var_keyword_receives_everything(self):
+        def handler(src: bytes, **kwargs):
+            pass
+
+        kwargs = self.extract(handler)
+        self.assertEqual(kwargs["src"], SRC.packed)
+        self.assertEqual(set(kwargs), {"src", "host", "h", "body"})
+
+    def test_ip_decoding(self):
+        def handler(src, host: str):
+            pass
+
+        arguments = NotifyPayload(PAYLOAD).messages["check"]
+        expected = {
+            IPDecoding.IPADDRESS: SRC,
+            IPDecoding.PACKED: SRC.packed,
+            IPDecoding.INT: int(SRC),
+            IPDecoding.COMPACT: PackedAddress(SRC.packed),
+        }
+        for ip_decoding, src in expected.items():
+            with self.subTest(ip_decoding=ip_decoding):
+                kwargs = MessageSchema.from_function(handler, ip_decoding=ip_decoding).extract(arguments)
+                self.assertEqual(kwargs, {"src": src, "host": "example.com"})
+
+    def test_string_decoding(self):
+        def handler(ua, raw: bytes):
+            pass
+
+        header = "Mozilla/5.0 (Gerät)".encode("utf-8")
+        string = bytes([SpopDataTypes.STRING]) + write_binary(header)
+        payload = write_string("check") + bytes([2]) + write_string("ua") + string + write_string("raw") + string
+        arguments = NotifyPayload(payload).messages["check"]
+        expected = {
+            StringDecoding.LATIN_1: header.decode("latin-1"),
+            StringDecoding.UTF_8: "Mozilla/5.0 (Gerät)",
+            StringDecoding.BYTES: header,
+        }
+        for string_decoding, ua in expected.items():
+            with self.subTest(string_decoding=string_decoding):
+                kwargs = MessageSchema.from_function(handler, string_decoding=string_decoding).extract(arguments)
+                self.assertEqual(kwargs, {"ua": ua, "raw": header})
+        with self.assertRaises(UnicodeDecodeError):
+            MessageSchema.from_function(handler).extract(arguments)
+
+        # Annotations selecting an address representation keep the string decoding.
+        def annotated(ua: PackedAddress):
+            pass
+
+        schema = MessageSchema.from_function(annotated, string_decoding=StringDecoding.UTF_8)
+        self.assertEqual(schema.extract(arguments), {"ua": "Mozilla/5.0 (Gerät)"})
+
+        invalid = NotifyPayload(
+            write_string("check") + bytes([1]) + write_string("ua") + bytes([SpopDataTypes.STRING]) + write_binary(b"\xff")
+        ).messages["check"]
+        ua = MessageSchema.from_function(handler, string_decoding=StringDecoding.UTF_8).extract(invalid)["ua"]
+        self.assertEqual(ua.encode("utf-8", "surrogateescape"), b"\xff")
+
+    def test_annotation_overrides_ip_decoding(self):
+        def handler(src: ipaddress.IPv4Address, **kwargs):
+            pass
+
+        kwargs = MessageSchema.from_function(handler, ip_decoding=IPDecoding.COMPACT).extract(
+            NotifyPayload(encode_message("check", [("src", SRC), ("dst", SRC)])).messages["check"]
+        )
+        self.assertEqual(kwargs, {"src": SRC, "dst": PackedAddress(SRC.packed)})
+
+    def test_already_decoded_arguments(self):
+        def handler(host: str):
+            pass
+
+        arguments = parse_list_of_messages(PAYLOAD)["check"]
+        self.assertEqual(MessageSchema.from_function(handler).extract(arguments), {"host": "example.com"})
+
+
+if __name__ == '__main__':
+    unittest.main()
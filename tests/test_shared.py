@@ -0,0 +1,95 @@
+import os
+import time
+import unittest
+
+from haproxyspoa.spoa_shared import SharedStore
+
+
+class TestSharedStore(unittest.TestCase):
+
+    def test_values(self):
+        store = SharedStore(slots=256, stripes=4)
+        store.set("count", 3)
+        store.set("name", "mars")
+        store.set(b"\x0a\x00\x00\x01", b"\x00\xff")
+        self.assertEqual(store.get("count"), 3)
+        self.assertEqual(store.get("name"), "mars")
+        self.assertEqual(store.get(memoryview(b"\x0a\x00\x00\x01")), b"\x00\xff")
+        self.assertIsNone(store.get("missing"))
+        self.assertEqual(len(store), 3)
+
+        store.set("name", "earth")
+        self.assertEqual(store.get("name"), "earth")
+        self.assertTrue(store.delete("name"))
+        self.assertNotIn("name", store)
+        self.assertFalse(store.delete("name"))
+
+    def test_incr(self):
+        store = SharedStore(slots=256, stripes=4)
+        self.assertEqual(store.incr("hits"), 1)
+        self.assertEqual(store.incr("hits", 5), 6)
+        self.assertEqual(store.incr("hits", -7), -1)
+        store.set("name", "mars")
+        with self.assertRaises(TypeError):
+            store.incr("name")
+
+    def test_limits(self):
+        store = SharedStore(slots=256, stripes=4, key_size=4, value_size=4)
+        with self.assertRaises(ValueError):
+            store.set("too long", 1)
+        with self.assertRaises(ValueError):
+            store.set("key", "too long")
+        with self.assertRaises(OverflowError):
+            store.set("key", 2 ** 63)
+        with self.assertRaises(TypeError):
+            store.set("key", 1.5)
+
+    def test_ttl(self):
+        store = SharedStore(slots=256, stripes=4)
+        store.incr("window", ttl=0.05)
+        # The TTL of a counter is only set when it is created.
+        self.assertEqual(store.incr("window", ttl=10), 2)
+        time.sleep(0.06)
+        self.assertIsNone(store.get("window"))
+        self.assertEqual(store.incr("window"), 1)
+
+    def test_bounded_footprint(self):
+        store = SharedStore(slots=64, stripes=2, probes=4)
+        size = store.size
+        for i in range(1000):
+            store.set(f"key{i}", i)
+        self.assertEqual(store.size, size)
+        self.assertLessEqual(len(store), 64)
+        self.assertEqual(store.get("key999"), 999)
+        self.assertGreater(store.evictions, 0)
+
+    def test_expired_entries_are_evicted_first(self):
+        store = SharedStore(slots=4, stripes=1, probes=4)
+        store.set("short", 1, ttl=0.01)
+        for i in range(3):
+            store.set(f"key{i}", i)
+        time.sleep(0.02)
+        store.set("new", 1)
+        self.assertEqual(store.evictions, 0)
+        self.assertEqual([store.get(f"key{i}") for i in range(3)], [0, 1, 2])
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires os.fork")
+    def test_shared_across_processes(self):
+        store = SharedStore(slots=256, stripes=4)
+        children = []
+        for _ in range(3):
+            pid = os.fork()
+            if pid == 0:
+                for _ in range(1000):
+                    store.incr("hits")
+                os._exit(0)
+            children.append(pid)
+        for _ in range(1000):
+            store.incr("hits")
+        for pid in children:
+            os.waitpid(pid, 0)
+        self.assertEqual(store.get("hits"), 4000)
+
+
+if __name__ == '__main__':
+    unittest.main()
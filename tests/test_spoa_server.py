@@ -0,0 +1,587 @@
+import asyncio
+import importlib
+import ipaddress
+import os
+import shutil
+import sys
+import tempfile
+import textwrap
+import unittest
+
+from haproxyspoa.payloads.ack import AckPayload
+from haproxyspoa.payloads.agent_disconnect import DisconnectStatusCode
+from haproxyspoa.payloads.agent_hello import AgentHelloPayload
+from haproxyspoa.spoa_data_types import SpopDataTypes, StringDecoding, write_binary, write_string, \
+    write_typed_autodetect, write_typed_uint32, write_varint
+from haproxyspoa.spoa_frame import Frame, FrameType
+from haproxyspoa.spoa_metrics import MetricsEndpoint, SpoaMetrics
+from haproxyspoa.spoa_payloads import write_kv_list, parse_kv_list
+from haproxyspoa.spoa_server import SpoaServer
+
+
+def encode_frame(frame_type: int, stream_id: int, frame_id: int, payload: bytes, flags: int = 1) -> bytes:
+    body = bytes([frame_type]) + flags.to_bytes(4, byteorder='big') \
+        + write_varint(stream_id) + write_varint(frame_id) + payload
+    return len(body).to_bytes(4, byteorder='big') + body
+
+
+def encode_haproxy_hello(capabilities: str = "pipelining,async", max_frame_size: int = 16380) -> bytes:
+    return encode_frame(FrameType.HAPROXY_HELLO, 0, 0, write_kv_list({
+        "supported-versions": write_typed_autodetect("2.0"),
+        "max-frame-size": write_typed_uint32(max_frame_size),
+        "capabilities": write_typed_autodetect(capabilities),
+    }))
+
+
+def encode_notify_payload(message_name: str, args: dict) -> bytes:
+    return write_string(message_name) + bytes([len(args)]) + write_kv_list({
+        k: write_typed_autodetect(v) for k, v in args.items()
+    })
+
+
+def encode_notify(stream_id: int, frame_id: int, message_name: str, args: dict) -> bytes:
+    return encode_frame(FrameType.HAPROXY_NOTIFY, stream_id, frame_id, encode_notify_payload(message_name, args))
+
+
+class SpoaServerTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def start(self, agent: SpoaServer):
+        server = await agent._start_server(host="127.0.0.1", port=0)
+        self.addAsyncCleanup(server.wait_closed)
+        self.addCleanup(server.close)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        self.addCleanup(writer.close)
+        return reader, writer
+
+    async def handshake(self, reader, writer, **kwargs):
+        writer.write(encode_haproxy_hello(**kwargs))
+        frame = await Frame.read_frame(reader)
+        self.assertEqual(frame.headers.type, FrameType.AGENT_HELLO)
+        return parse_kv_list(frame.payload)
+
+
+class TestNotify(SpoaServerTestCase):
+
+    async def test_binary_argument_is_echoed_back(self):
+        agent = SpoaServer()
+
+        @agent.handler("echo")
+        async def echo(body):
+            return AckPayload().set_txn_var("body", body)
+
+        reader, writer = await self.start(agent)
+        await self.handshake(reader, writer)
+        writer.write(encode_notify(1, 1, "echo", {"body": b"\x00\xffpayload"}))
+        frame = await asyncio.wait_for(Frame.read_frame(reader), 1)
+        self.assertEqual(bytes(frame.payload), bytes(AckPayload().set_txn_var("body", b"\x00\xffpayload").encode()))
+
+    async def test_failing_handler_still_acks(self):
+        for pipelining in (False, True):
+            with self.subTest(pipelining=pipelining):
+                agent = SpoaServer(pipelining=pipelining)
+
+                @agent.handler("check")
+                async def ok():
+                    return AckPayload().set_txn_var("ok", 1)
+
+                @agent.handler("check")
+                async def broken():
+                    raise RuntimeError("Handler bug")
+
+                reader, writer = await self.start(agent)
+                await self.handshake(reader, writer)
+                with self.assertLogs(level="ERROR"):
+                    for stream_id in (1, 2):
+                        writer.write(encode_notify(stream_id, 1, "check", {}))
+                        frame = await asyncio.wait_for(Frame.read_frame(reader), 1)
+                        self.assertEqual(frame.headers.type, FrameType.ACK)
+                        self.assertEqual(frame.headers.stream_id, stream_id)
+                        self.assertEqual(bytes(frame.payload), bytes(AckPayload().set_txn_var("ok", 1).encode()))
+                self.assertEqual(agent.metrics.handler_failures, {"check": 2})
+
+
+class TestPipelining(SpoaServerTestCase):
+
+    async def test_hello_only_advertises_pipelining_when_enabled(self):
+        reader, writer = await self.start(SpoaServer())
+        hello = await self.handshake(reader, writer)
+        self.assertEqual(hello["capabilities"], "")
+
+        reader, writer = await self.start(SpoaServer(pipelining=True))
+        hello = await self.handshake(reader, writer)
+        self.assertEqual(set(hello["capabilities"].split(",")), {"pipelining", "async"})
+
+    async def test_slow_handler_does_not_block_other_streams(self):
+        agent = SpoaServer(pipelining=True)
+        release = asyncio.Event()
+
+        @agent.handler("check")
+        async def check(src: ipaddress.IPv4Address, slow: bool):
+            if slow:
+                await release.wait()
+            return AckPayload().set_txn_var("src", str(src))
+
+        reader, writer = await self.start(agent)
+        await self.handshake(reader, writer)
+
+        writer.write(encode_notify(1, 1, "check", {"src": ipaddress.IPv4Address("10.0.0.1"), "slow": True}))
+        writer.write(encode_notify(2, 1, "check", {"src": ipaddress.IPv4Address("10.0.0.2"), "slow": False}))
+
+        first = await asyncio.wait_for(Frame.read_frame(reader), 1)
+        self.assertEqual((first.headers.type, first.headers.stream_id), (FrameType.ACK, 2))
+
+        release.set()
+        second = await asyncio.wait_for(Frame.read_frame(reader), 1)
+        self.assertEqual((second.headers.type, second.headers.stream_id), (FrameType.ACK, 1))
+
+
+class TestProtocolTransport(SpoaServerTestCase):
+
+    async def test_frames_split_and_coalesced_across_chunks(self):
+        agent = SpoaServer(transport="protocol", pipelining=True)
+
+        @agent.handler("echo")
+        async def echo(value: str):
+            return AckPayload().set_txn_var("echo", value)
+
+        reader, writer = await self.start(agent)
+        hello = await self.handshake(reader, writer)
+        self.assertIn("pipelining", hello["capabilities"])
+
+        data = b"".join(encode_notify(stream_id, 1, "echo", {"value": f"v{stream_id}"}) for stream_id in range(1, 51))
+        # Deliver several frames per chunk, with frame boundaries falling mid-chunk.
+        for start in range(0, len(data), 37):
+            writer.write(data[start:start + 37])
+            await writer.drain()
+
+        acked = set()
+        for _ in range(50):
+            frame = await asyncio.wait_for(Frame.read_frame(reader), 1)
+            self.assertEqual(frame.headers.type, FrameType.ACK)
+            acked.add(frame.headers.stream_id)
+        self.assertEqual(acked, set(range(1, 51)))
+
+    def test_rejects_unknown_transport(self):
+        with self.assertRaises(ValueError):
+            SpoaServer(transport="carrier-pigeon")
+
+
+class TestFragmentation(SpoaServerTestCase):
+
+    async def test_handler_receives_reassembled_payload(self):
+        agent = SpoaServer(fragmentation=True)
+
+        @agent.handler("inspect")
+        async def inspect(body: bytes):
+            return AckPayload().set_txn_var("body_length", len(body))
+
+        reader, writer = await self.start(agent)
+        hello = await self.handshake(reader, writer, capabilities="fragmentation")
+        self.assertEqual(hello["capabilities"], "fragmentation")
+
+        payload = encode_notify_payload("inspect", {"body": b"x" * 40000})
+        chunks = [payload[i:i + 16000] for i in range(0, len(payload), 16000)]
+        writer.write(encode_frame(FrameType.HAPROXY_NOTIFY, 5, 1, chunks[0], flags=0))
+        for chunk in chunks[1:-1]:
+            writer.write(encode_frame(FrameType.FRAGMENT, 5, 1, chunk, flags=0))
+        writer.write(encode_frame(FrameType.FRAGMENT, 5, 1, chunks[-1], flags=1))
+
+        ack = await asyncio.wait_for(Frame.read_frame(reader), 1)
+        self.assertEqual((ack.headers.type, ack.headers.stream_id), (FrameType.ACK, 5))
+        self.assertIn(b"body_length", bytes(ack.payload))
+
+    async def test_budget_overrun_disconnects(self):
+        agent = SpoaServer(fragmentation=True, fragment_memory_budget=1024)
+        reader, writer = await self.start(agent)
+        await self.handshake(reader, writer, capabilities="fragmentation")
+
+        writer.write(encode_frame(FrameType.HAPROXY_NOTIFY, 5, 1, b"x" * 2048, flags=0))
+        frame = await asyncio.wait_for(Frame.read_frame(reader), 1)
+        self.assertEqual(frame.headers.type, FrameType.AGENT_DISCONNECT)
+        self.assertEqual(parse_kv_list(frame.payload)["status-code"], DisconnectStatusCode.RESOURCE_ALLOCATION_ERROR)
+
+
+class TestMaxFrameSize(SpoaServerTestCase):
+
+    async def test_negotiates_smallest_max_frame_size(self):
+        reader, writer = await self.start(SpoaServer(max_frame_size=AgentHelloPayload.GENEROUS_MAX_FRAME_SIZE))
+        hello = await self.handshake(reader, writer, max_frame_size=32768)
+        self.assertEqual(hello["max-frame-size"], 32768)
+
+        reader, writer = await self.start(SpoaServer(max_frame_size=4096))
+        hello = await self.handshake(reader, writer, max_frame_size=32768)
+        self.assertEqual(hello["max-frame-size"], 4096)
+
+    async def test_oversized_inbound_frame_disconnects(self):
+        for transport in ("stream", "protocol"):
+            with self.subTest(transport=transport):
+                reader, writer = await self.start(SpoaServer(transport=transport))
+                await self.handshake(reader, writer, max_frame_size=1024)
+
+                writer.write(encode_notify(1, 1, "check", {"body": b"x" * 2048}))
+                frame = await asyncio.wait_for(Frame.read_frame(reader), 1)
+                self.assertEqual(frame.headers.type, FrameType.AGENT_DISCONNECT)
+                self.assertEqual(parse_kv_list(frame.payload)["status-code"], DisconnectStatusCode.FRAME_TOO_BIG)
+
+    async def test_oversized_ack_is_refused(self):
+        agent = SpoaServer()
+
+        @agent.handler("check")
+        async def check(size: int):
+            return AckPayload().set_txn_var("blob", b"x" * size)
+
+        reader, writer = await self.start(agent)
+        await self.handshake(reader, writer, max_frame_size=1024)
+
+        writer.write(encode_notify(1, 1, "check", {"size": 4096}))
+        frame = await asyncio.wait_for(Frame.read_frame(reader), 1)
+        self.assertEqual((frame.headers.type, bytes(frame.payload)), (FrameType.ACK, b""))
+
+        writer.write(encode_notify(2, 1, "check", {"size": 16}))
+        frame = await asyncio.wait_for(Frame.read_frame(reader), 1)
+        self.assertEqual(frame.headers.type, FrameType.ACK)
+        self.assertIn(b"blob", bytes(frame.payload))
+
+
+class TestMetrics(SpoaServerTestCase):
+
+    async def test_metrics_are_recorded_and_served(self):
+        agent = SpoaServer()
+
+        @agent.handler("check")
+        async def check(value: int):
+            return AckPayload().set_txn_var("value", value)
+
+        reader, writer = await self.start(agent)
+        await self.handshake(reader, writer)
+        for stream_id in range(1, 4):
+            writer.write(encode_notify(stream_id, 1, "check", {"value": stream_id}))
+            await asyncio.wait_for(Frame.read_frame(reader), 1)
+
+        endpoint = MetricsEndpoint(agent.metrics)
+        await endpoint.start("127.0.0.1", 0)
+        self.addCleanup(endpoint.close)
+        metrics_reader, metrics_writer = await asyncio.open_connection(
+            "127.0.0.1", endpoint.server.sockets[0].getsockname()[1],
+        )
+        metrics_writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        response = (await asyncio.wait_for(metrics_reader.read(), 1)).decode()
+        metrics_writer.close()
+
+        self.assertTrue(response.startswith("HTTP/1.1 200 OK"))
+        self.assertIn('spoa_frames_received_total{type="HAPROXY_NOTIFY"} 3', response)
+        self.assertIn('spoa_frames_sent_total{type="ACK"} 3', response)
+        self.assertIn("spoa_connections 1", response)
+        self.assertIn('spoa_handler_duration_seconds_count{message="check"} 3', response)
+        self.assertIn("spoa_notify_parse_duration_seconds_count 3", response)
+
+    def test_label_values_are_escaped(self):
+        metrics = SpoaMetrics()
+        message_key = 'check "a"\\b\nc'
+        metrics.handler_histogram(message_key).observe(0.001)
+        metrics.handler_timed_out(message_key)
+        rendered = metrics.render()
+        escaped = 'message="check \\"a\\"\\\\b\\nc"'
+        self.assertIn(f'spoa_handler_duration_seconds_count{{{escaped}}} 1', rendered)
+        self.assertIn(f'spoa_handler_duration_seconds_bucket{{{escaped},le="+Inf"}} 1', rendered)
+        self.assertIn(f'spoa_handler_timeouts_total{{{escaped}}} 1', rendered)
+        self.assertNotIn("\nc", rendered)
+
+
+class TestDeadlines(SpoaServerTestCase):
+
+    def register_handlers(self, agent: SpoaServer):
+        self.cancelled = asyncio.Event()
+
+        @agent.handler("check")
+        async def fast():
+            return AckPayload().set_txn_var("fast", 1)
+
+        @agent.handler("check")
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                self.cancelled.set()
+                raise
+            return AckPayload().set_txn_var("slow", 1)
+
+    async def test_partial_ack_after_deadline(self):
+        agent = SpoaServer(notify_timeout=0.05, timeout_ack=AckPayload().set_txn_var("timeout", 1))
+        self.register_handlers(agent)
+        reader, writer = await self.start(agent)
+        await self.handshake(reader, writer)
+
+        writer.write(encode_notify(1, 1, "check", {}))
+        frame = await asyncio.wait_for(Frame.read_frame(reader), 1)
+        expected = AckPayload().set_txn_var("fast", 1).set_txn_var("timeout", 1)
+        self.assertEqual(bytes(frame.payload), bytes(expected.encode()))
+        await asyncio.wait_for(self.cancelled.wait(), 1)
+        self.assertEqual(agent.metrics.notify_timeouts, 1)
+        self.assertEqual(agent.metrics.handler_timeouts, {"check": 1})
+
+    async def test_fallback_ack_only(self):
+        agent = SpoaServer(
+            notify_timeout=0.05,
+            timeout_ack=AckPayload().set_txn_var("timeout", 1),
+            partial_ack_on_timeout=False,
+        )
+        self.register_handlers(agent)
+        reader, writer = await self.start(agent)
+        await self.handshake(reader, writer)
+
+        writer.write(encode_notify(1, 1, "check", {}))
+        frame = await asyncio.wait_for(Frame.read_frame(reader), 1)
+        self.assertEqual(bytes(frame.payload), bytes(AckPayload().set_txn_var("timeout", 1).encode()))
+
+    async def test_per_handler_timeout(self):
+        agent = SpoaServer()
+
+        @agent.handler("check", timeout=0.05)
+        async def slow():
+            await asyncio.sleep(10)
+
+        reader, writer = await self.start(agent)
+        await self.handshake(reader, writer)
+
+        writer.write(encode_notify(1, 1, "check", {}))
+        frame = await asyncio.wait_for(Frame.read_frame(reader), 1)
+        self.assertEqual((frame.headers.type, bytes(frame.payload)), (FrameType.ACK, b""))
+        self.assertEqual(agent.metrics.notify_timeouts, 1)
+
+
+class TestAdmission(SpoaServerTestCase):
+
+    async def test_sheds_past_connection_inflight_limit(self):
+        agent = SpoaServer(pipelining=True, max_connection_inflight=2)
+        release = asyncio.Event()
+
+        @agent.handler("check")
+        async def check():
+            await release.wait()
+            return AckPayload().set_txn_var("done", 1)
+
+        reader, writer = await self.start(agent)
+        await self.handshake(reader, writer)
+
+        for stream_id in (1, 2, 3):
+            writer.write(encode_notify(stream_id, 1, "check", {}))
+        frame = await asyncio.wait_for(Frame.read_frame(reader), 1)
+        self.assertEqual(frame.headers.stream_id, 3)
+        self.assertEqual(bytes(frame.payload), bytes(AckPayload().set_txn_var("shed", 1).encode()))
+
+        release.set()
+        acked = {(await asyncio.wait_for(Frame.read_frame(reader), 1)).headers.stream_id for _ in range(2)}
+        self.assertEqual(acked, {1, 2})
+        self.assertEqual(agent.metrics.notify_shed["inflight"], 1)
+        self.assertEqual(agent.admission.inflight, 0)
+
+    async def test_global_limit_spans_connections(self):
+        agent = SpoaServer(pipelining=True, max_inflight=1, shed_ack=AckPayload().set_txn_var("busy", True))
+        release = asyncio.Event()
+
+        @agent.handler("check")
+        async def check():
+            await release.wait()
+            return AckPayload()
+
+        first_reader, first_writer = await self.start(agent)
+        await self.handshake(first_reader, first_writer)
+        first_writer.write(encode_notify(1, 1, "check", {}))
+        await asyncio.sleep(0.05)
+
+        reader, writer = await self.start(agent)
+        await self.handshake(reader, writer)
+        writer.write(encode_notify(1, 1, "check", {}))
+        frame = await asyncio.wait_for(Frame.read_frame(reader), 1)
+        self.assertEqual(bytes(frame.payload), bytes(AckPayload().set_txn_var("busy", True).encode()))
+
+        release.set()
+        frame = await asyncio.wait_for(Frame.read_frame(first_reader), 1)
+        self.assertEqual((frame.headers.type, bytes(frame.payload)), (FrameType.ACK, b""))
+
+    async def test_sheds_after_queue_delay(self):
+        agent = SpoaServer(pipelining=True, max_inflight_frames=1, max_queue_delay=0.05)
+
+        @agent.handler("check")
+        async def check():
+            await asyncio.sleep(0.1)
+            return AckPayload().set_txn_var("done", 1)
+
+        reader, writer = await self.start(agent)
+        await self.handshake(reader, writer)
+
+        writer.write(encode_notify(1, 1, "check", {}) + encode_notify(2, 1, "check", {}))
+        first = await asyncio.wait_for(Frame.read_frame(reader), 1)
+        second = await asyncio.wait_for(Frame.read_frame(reader), 1)
+        self.assertEqual(first.headers.stream_id, 1)
+        self.assertEqual(bytes(first.payload), bytes(AckPayload().set_txn_var("done", 1).encode()))
+        self.assertEqual(second.headers.stream_id, 2)
+        self.assertEqual(bytes(second.payload), bytes(AckPayload().set_txn_var("shed", 1).encode()))
+        self.assertEqual(agent.metrics.notify_shed["queue_delay"], 1)
+
+
+class TestShutdown(SpoaServerTestCase):
+
+    async def test_in_flight_notify_is_acked_before_disconnect(self):
+        agent = SpoaServer(pipelining=True)
+        release = asyncio.Event()
+
+        @agent.handler("check")
+        async def check():
+            await release.wait()
+            return AckPayload().set_txn_var("done", 1)
+
+        reader, writer = await self.start(agent)
+        await self.handshake(reader, writer)
+        idle_reader, idle_writer = await self.start(agent)
+        await self.handshake(idle_reader, idle_writer)
+
+        writer.write(encode_notify(1, 1, "check", {}))
+        await asyncio.sleep(0.05)
+        shutdown = asyncio.ensure_future(agent.shutdown(timeout=1))
+
+        frame = await asyncio.wait_for(Frame.read_frame(idle_reader), 1)
+        self.assertEqual(frame.headers.type, FrameType.AGENT_DISCONNECT)
+        self.assertFalse(shutdown.done())
+
+        release.set()
+        frame = await asyncio.wait_for(Frame.read_frame(reader), 1)
+        self.assertEqual(frame.headers.type, FrameType.ACK)
+        self.assertEqual(bytes(frame.payload), bytes(AckPayload().set_txn_var("done", 1).encode()))
+        frame = await asyncio.wait_for(Frame.read_frame(reader), 1)
+        self.assertEqual(frame.headers.type, FrameType.AGENT_DISCONNECT)
+        self.assertEqual(parse_kv_list(frame.payload)["status-code"], DisconnectStatusCode.NORMAL)
+
+        await asyncio.wait_for(shutdown, 1)
+        self.assertEqual(agent.connections, {})
+
+
+class TestReload(SpoaServerTestCase):
+
+    def write_module(self, directory: str, name: str, source: str):
+        with open(os.path.join(directory, f"{name}.py"), "w") as f:
+            f.write(textwrap.dedent(source))
+
+    async def test_reload_replaces_handlers_of_open_connections(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        sys.path.insert(0, directory)
+        self.addCleanup(sys.path.remove, directory)
+        self.addCleanup(sys.modules.pop, "reload_app", None)
+        self.addCleanup(sys.modules.pop, "reload_handlers", None)
+
+        self.write_module(directory, "reload_app", """
+            from haproxyspoa.spoa_server import SpoaServer
+            agent = SpoaServer()
+        """)
+        self.write_module(directory, "reload_handlers", """
+            from haproxyspoa.payloads.ack import AckPayload
+            from reload_app import agent
+
+            @agent.handler("check")
+            async def check():
+                return AckPayload().set_txn_var("version", 1)
+        """)
+        agent = importlib.import_module("reload_app").agent
+        importlib.import_module("reload_handlers")
+
+        @agent.handler("other")
+        async def other():
+            return AckPayload()
+
+        reloaded = []
+        agent.on_reload(lambda: reloaded.append(True))
+
+        reader, writer = await self.start(agent)
+        await self.handshake(reader, writer)
+        writer.write(encode_notify(1, 1, "check", {}))
+        frame = await asyncio.wait_for(Frame.read_frame(reader), 1)
+        self.assertEqual(bytes(frame.payload), bytes(AckPayload().set_txn_var("version", 1).encode()))
+
+        # A different size keeps the stale bytecode from being reused.
+        self.write_module(directory, "reload_handlers", """
+            from haproxyspoa.payloads.ack import AckPayload
+            from reload_app import agent
+
+            @agent.handler("check")
+            async def check_again():
+                return AckPayload().set_txn_var("version", 2)
+        """)
+        await agent.reload("reload_handlers")
+
+        writer.write(encode_notify(1, 2, "check", {}))
+        frame = await asyncio.wait_for(Frame.read_frame(reader), 1)
+        self.assertEqual(bytes(frame.payload), bytes(AckPayload().set_txn_var("version", 2).encode()))
+        self.assertEqual(len(agent.handlers["check"]), 1)
+        self.assertEqual(len(agent.handlers["other"]), 1)
+        self.assertEqual(reloaded, [True])
+
+        self.write_module(directory, "reload_handlers", "raise RuntimeError('broken')\n")
+        with self.assertRaises(RuntimeError):
+            await agent.reload("reload_handlers")
+        writer.write(encode_notify(1, 3, "check", {}))
+        frame = await asyncio.wait_for(Frame.read_frame(reader), 1)
+        self.assertEqual(bytes(frame.payload), bytes(AckPayload().set_txn_var("version", 2).encode()))
+
+
+class TestBatchHandler(SpoaServerTestCase):
+
+    async def test_messages_are_batched_across_connections(self):
+        agent = SpoaServer(pipelining=True)
+        batches = []
+
+        @agent.batch_handler("check", max_batch=4, max_wait=0.05)
+        async def check(batch):
+            batches.append(sorted(call["id"] for call in batch))
+            return [AckPayload().set_txn_var("id", call["id"]) for call in batch]
+
+        connections = []
+        for _ in range(2):
+            reader, writer = await self.start(agent)
+            await self.handshake(reader, writer)
+            connections.append((reader, writer))
+
+        for stream_id in (1, 2):
+            for index, (_, writer) in enumerate(connections):
+                writer.write(encode_notify(stream_id, 1, "check", {"id": index * 10 + stream_id}))
+
+        for index, (reader, _) in enumerate(connections):
+            for _ in range(2):
+                frame = await asyncio.wait_for(Frame.read_frame(reader), 1)
+                expected = AckPayload().set_txn_var("id", index * 10 + frame.headers.stream_id)
+                self.assertEqual(bytes(frame.payload), bytes(expected.encode()))
+        self.assertEqual(batches, [[1, 2, 11, 12]])
+
+
+class TestStringDecoding(SpoaServerTestCase):
+
+    async def test_handler_receives_non_ascii_header(self):
+        agent = SpoaServer(string_decoding=StringDecoding.UTF_8)
+
+        @agent.handler("check-ua")
+        async def check_ua(user_agent: str):
+            return AckPayload().set_txn_var("bot", int(user_agent.startswith("Bot-é")))
+
+        self.assertIn("check-ua", agent.strings)
+        self.assertIn("user_agent", agent.strings)
+        self.assertRaises(ValueError, SpoaServer, string_decoding="utf-16")
+
+        @agent.handler("prüfen")
+        async def pruefen(größe: int):
+            pass
+
+        self.assertIn("größe", agent.strings)
+
+        reader, writer = await self.start(agent)
+        await self.handshake(reader, writer)
+        payload = write_string("check-ua") + bytes([1]) + write_string("user_agent") \
+            + bytes([SpopDataTypes.STRING]) + write_binary("Bot-é/1.0".encode("utf-8"))
+        writer.write(encode_frame(FrameType.HAPROXY_NOTIFY, 1, 1, payload))
+        frame = await asyncio.wait_for(Frame.read_frame(reader), 1)
+        self.assertEqual(bytes(frame.payload), bytes(AckPayload().set_txn_var("bot", 1).encode()))
+
+
+if __name__ == '__main__':
+    unittest.main()
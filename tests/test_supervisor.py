@@ -0,0 +1,70 @@
+import os
+import signal
+import tempfile
+import time
+import unittest
+
+from haproxyspoa.spoa_supervisor import WorkerSupervisor
+
+
+def wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.01)
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "requires os.fork")
+class TestWorkerSupervisor(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def events(self, prefix: str):
+        return sorted(name for name in os.listdir(self.directory) if name.startswith(prefix))
+
+    def record(self, name: str):
+        open(os.path.join(self.directory, name), "w").close()
+
+    def worker(self, index: int):
+        signal.signal(signal.SIGHUP, lambda *_: self.record(f"reloaded-{index}-{os.getpid()}"))
+        crashed_before = bool(self.events(f"started-{index}-"))
+        self.record(f"started-{index}-{os.getpid()}")
+        if index == 0 and not crashed_before:
+            raise RuntimeError("Crash on first start")
+        while True:
+            signal.pause()
+
+    def test_restarts_crashed_workers_and_forwards_signals(self):
+        supervisor_pid = os.fork()
+        if supervisor_pid == 0:
+            try:
+                WorkerSupervisor(self.worker, workers=2, restart_delay=0.05).run()
+            finally:
+                os._exit(0)
+
+        try:
+            # Worker 0 crashes once and is restarted with the same index.
+            wait_until(lambda: len(self.events("started-0-")) == 2 and len(self.events("started-1-")) == 1)
+
+            os.kill(supervisor_pid, signal.SIGHUP)
+            wait_until(lambda: len(self.events("reloaded-")) == 2)
+            self.assertEqual([name.split("-")[1] for name in self.events("reloaded-")], ["0", "1"])
+
+            os.kill(supervisor_pid, signal.SIGTERM)
+            wait_until(lambda: os.waitpid(supervisor_pid, os.WNOHANG)[0] == supervisor_pid)
+        except BaseException:
+            os.kill(supervisor_pid, signal.SIGKILL)
+            raise
+
+        # The supervisor only exits once every worker has.
+        for name in self.events("started-"):
+            with self.assertRaises(ProcessLookupError):
+                os.kill(int(name.rsplit("-", 1)[1]), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()